@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import database
+import factor_tables
+import storage
+
+# gspreadの呼び出しは全部同期HTTPなので、イベントループではなくこの専用スレッドプールで実行する。
+# プールの大きさが、そのまま同時に実行できるシート操作の上限になる。
+_executor = ThreadPoolExecutor(max_workers=config.SHEETS_IO_MAX_WORKERS, thread_name_prefix="sheets-io")
+# 投入したがまだ終わっていないシート操作の数 (/metrics 用)。完了はプールのスレッドで数えるのでロックで守る
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def _finished(_future):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+
+
+async def run_blocking(func, *args, timeout: float = None, **kwargs):
+    """
+    ブロッキングする関数をシート操作用のスレッドプールで実行し、結果を待つ。
+    タイムアウトした場合はasyncio.TimeoutErrorを送出する (スレッド側の処理は止まらない)。
+    """
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    future = _executor.submit(functools.partial(func, *args, **kwargs))
+    # タイムアウトしてもスレッド側は動き続けるので、待つ側ではなくプールのFutureの完了で数を減らす
+    future.add_done_callback(_finished)
+    return await asyncio.wait_for(asyncio.wrap_future(future), timeout or config.SHEETS_IO_TIMEOUT)
+
+
+async def load_factor_dictionaries(gspread_client):
+    return await run_blocking(database.load_factor_dictionaries, gspread_client, timeout=config.SHEETS_IO_LONG_TIMEOUT)
+
+
+async def load_score_sheets_by_id(gspread_client, factor_name_to_id):
+    return await run_blocking(database.load_score_sheets_by_id, gspread_client, factor_name_to_id, timeout=config.SHEETS_IO_LONG_TIMEOUT)
+
+
+async def load_reference_data(gspread_client):
+    return await run_blocking(database.load_reference_data, gspread_client, timeout=config.SHEETS_IO_LONG_TIMEOUT)
+
+
+# 実行中のデータベースの読み込み。同時に来た読み込みは、これ1つの結果を待つ
+_database_load: asyncio.Future | None = None
+
+
+async def _load_full_database(gspread_client):
+    try:
+        return await run_blocking(storage.get_backend(gspread_client).load_all)
+    except Exception as e:
+        # Googleが応答しないときは、最後に読み込んだ内容(起動直後ならスナップショット)で応答する
+        tables = factor_tables.current()
+        if tables is None:
+            raise
+        print(f"警告: データベースの読み込みに失敗したため、{tables.age:.0f}秒前の内容({tables.source})で応答します: {e}")
+        return tables.summary_df, tables.factors_df
+
+
+async def get_full_database(gspread_client):
+    """データベースを読み込む。既に読み込み中なら、新しく読み込まずにその結果を待つ"""
+    global _database_load
+    if _database_load is None or _database_load.done():
+        _database_load = asyncio.ensure_future(_load_full_database(gspread_client))
+    # 待っている側がキャンセルされても、ほかの人が待っている読み込みは止めない
+    return await asyncio.shield(_database_load)
+
+
+def prefetch_full_database(gspread_client) -> asyncio.Task:
+    """バックグラウンドでデータベースの読み込みを始め、そのTaskを返す (結果を使わなくてもエラーは表示だけして捨てる)"""
+    task = asyncio.create_task(get_full_database(gspread_client))
+
+    def report(done: asyncio.Task):
+        if not done.cancelled() and done.exception() is not None:
+            print(f"データベースの先読みに失敗: {done.exception()}")
+    task.add_done_callback(report)
+    return task
+
+
+# 行や列を削除する処理と、書き込みキューへの積み込みを同時に行わないためのロック。
+# キューの書き込み先の行・列は積んだ時点で決まるので、削除の前にキューを空にし、削除中は新しく積ませない
+_structure_lock = asyncio.Lock()
+
+
+async def _run_structural(queue, func, *args, **kwargs):
+    """
+    キューを空にしてから、行や列を消す処理を実行する。
+    保存先のメソッドにもwrite_queueを渡して、スプレッドシートへの書き写しまでロックを持っている間に終わらせる。
+    """
+    async with _structure_lock:
+        if queue is not None:
+            await queue.drain()
+        return await run_blocking(func, *args, **kwargs)
+
+
+async def record_evaluation_to_db(gspread_client, interaction, character_name, factor_details, image_url, purpose, race_route, memo, factor_dictionary, score_sheets, char_name_to_id):
+    _, summary_row, factor_rows = database.build_evaluation_rows(
+        interaction, character_name, factor_details, image_url, purpose, race_route, memo, factor_dictionary, score_sheets, char_name_to_id
+    )
+    return await run_blocking(storage.get_backend(gspread_client).insert_individual, summary_row, factor_rows)
+
+
+async def update_summary_fields(gspread_client, individual_id: str, updates: dict, write_queue=None, add_missing_headers: bool = False):
+    if write_queue is None:
+        return await run_blocking(storage.get_backend(gspread_client).update_fields, individual_id, updates, add_missing_headers=add_missing_headers)
+    # キューに積む行・列の位置を、削除の途中の状態で決めないようにする
+    async with _structure_lock:
+        return await run_blocking(storage.get_backend(gspread_client).update_fields, individual_id, updates, write_queue=write_queue, add_missing_headers=add_missing_headers)
+
+
+async def save_parent_factors(gspread_client, individual_id, p1_factor_id, p1_stars, p2_factor_id, p2_stars, write_queue=None):
+    updates = database.parent_factor_updates(p1_factor_id, p1_stars, p2_factor_id, p2_stars)
+    return await update_summary_fields(gspread_client, individual_id, updates, write_queue=write_queue, add_missing_headers=True)
+
+
+async def update_owner(gspread_client, individual_id: str, user, write_queue=None):
+    return await update_summary_fields(gspread_client, individual_id, database.owner_updates(user), write_queue=write_queue, add_missing_headers=True)
+
+
+async def delete_factor_by_id(gspread_client, individual_id: str, user_id: int, is_admin: bool, write_queue=None):
+    if config.SOFT_DELETE:
+        # 削除済みの印を付けるだけなら、行はずれない
+        return await run_blocking(storage.get_backend(gspread_client).delete, individual_id, user_id, is_admin)
+    return await _run_structural(write_queue, storage.get_backend(gspread_client).delete, individual_id, user_id, is_admin, write_queue=write_queue)
+
+
+async def compact_deleted_rows(gspread_client, write_queue=None):
+    return await _run_structural(write_queue, storage.get_backend(gspread_client).compact, write_queue=write_queue, timeout=config.SHEETS_IO_LONG_TIMEOUT)
+
+
+async def get_archive_database(gspread_client):
+    """アーカイブの内容を返す。前回読み込んでからARCHIVE_CACHE_SECONDS以内なら、読み込み直さない"""
+    tables = factor_tables.current_archive()
+    if tables is not None and tables.age < config.ARCHIVE_CACHE_SECONDS:
+        return tables.summary_df, tables.factors_df
+    return await run_blocking(database.get_archive_database, gspread_client, timeout=config.SHEETS_IO_LONG_TIMEOUT)
+
+
+async def archive_individuals(gspread_client, older_than_days: int, write_queue=None):
+    return await _run_structural(write_queue, database.archive_individuals, gspread_client, older_than_days, timeout=config.SHEETS_IO_LONG_TIMEOUT)
+
+
+async def recalculate_all_scores(gspread_client, score_sheets: dict, sheet_names: list = None, write_queue=None):
+    # 使われなくなった採点簿の列を削除することがある
+    return await _run_structural(write_queue, storage.get_backend(gspread_client).bulk_update_scores, score_sheets, sheet_names, write_queue=write_queue, timeout=config.SHEETS_IO_LONG_TIMEOUT)
+
+
+def stats() -> dict:
+    return {
+        'max_workers': config.SHEETS_IO_MAX_WORKERS,
+        'in_flight': _in_flight,
+        'storage': storage.stats(),
+    }
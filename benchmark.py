@@ -0,0 +1,86 @@
+"""
+偽のスプレッドシート (fake_gspread) を使って、主な処理のAPI呼び出し回数と所要時間を測るツール。
+
+    python benchmark.py                       # 2000体・待ち時間0.2秒で測る
+    python benchmark.py 10000 0.3             # 10000体・待ち時間0.3秒で測る
+
+Googleには一切接続しない。表示される秒数は、待ち時間を含めた実測値。
+"""
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import database
+import factor_tables
+from fake_gspread import FakeClient
+from scoring import ScoreSheets
+
+FACTOR_IDS = [f"F{i:03d}" for i in range(300)]
+CHARACTER_IDS = [f"C{i:03d}" for i in range(80)]
+
+
+def build_client(individuals: int, latency: float) -> tuple[FakeClient, ScoreSheets]:
+    """評価サマリーと因子データに、ランダムな個体を入れた偽のスプレッドシートを作る"""
+    random.seed(0)
+    score_sheets = ScoreSheets({
+        f"採点簿{n}": {factor_id: random.randint(1, 10) for factor_id in random.sample(FACTOR_IDS, 60)}
+        for n in range(3)
+    })
+    summary = [['個体ID', '投稿日時', '投稿者名', '投稿者ID', 'キャラ名', '画像URL', '用途', 'レースローテ', 'メモ', '所有者ID']
+               + [f"合計({name})" for name in score_sheets]]
+    factors = [database.FACTOR_SHEET_HEADERS]
+    for i in range(individuals):
+        individual_id = str(1_700_000_000 + i)
+        owner_id = str(random.randint(1, 50))
+        summary.append([individual_id, '2024-01-01 00:00:00', 'ユーザー', owner_id, random.choice(CHARACTER_IDS), '', '', '', '', owner_id, 0, 0, 0])
+        for factor_id in random.sample(FACTOR_IDS, random.randint(15, 30)):
+            factors.append([individual_id, factor_id, factor_id, '青', random.randint(1, 3)])
+
+    client = FakeClient(latency=latency)
+    client.spreadsheet.add_worksheet("評価サマリー", values=summary)
+    client.spreadsheet.add_worksheet("因子データ", values=factors)
+    return client, score_sheets
+
+
+def measure(client: FakeClient, label: str, func, *args, **kwargs):
+    client.reset_stats()
+    started_at = time.monotonic()
+    result = func(*args, **kwargs)
+    elapsed = time.monotonic() - started_at
+    stats = client.stats()
+    print(f"{label:<24} {stats['total_calls']:>5}回 {elapsed:>8.2f}秒  {stats['calls']}")
+    return result
+
+
+def main():
+    individuals = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    client, score_sheets = build_client(individuals, latency)
+    print(f"{individuals}体・1回あたり{latency}秒の待ち時間で測定します。\n")
+
+    measure(client, "get_full_database", database.get_full_database, client)
+
+    interaction = SimpleNamespace(
+        created_at=datetime.now(timezone.utc),
+        user=SimpleNamespace(id=1, display_name="ベンチマーク"),
+    )
+    factor_details = [{'id': factor_id, 'stars': 3} for factor_id in random.sample(FACTOR_IDS, 20)]
+    individual_id = measure(
+        client, "record_evaluation_to_db", database.record_evaluation_to_db,
+        client, interaction, CHARACTER_IDS[0], factor_details, '', '', '', '', {}, score_sheets, {}
+    )
+    measure(client, "update_summary_fields", database.update_summary_fields, client, individual_id, {'メモ': 'ベンチマーク'}, add_missing_headers=True)
+
+    database.get_full_database(client)
+    measure(client, "delete_factor_by_id", database.delete_factor_by_id, client, individual_id, 1, True)
+    measure(client, "compact_deleted_rows", database.compact_deleted_rows, client)
+    measure(client, "recalculate_all_scores", database.recalculate_all_scores, client, score_sheets)
+
+    tables = factor_tables.current()
+    print(f"\n最終的な件数: サマリー {len(tables.all_summary_df)}件・因子 {len(tables.all_factors_df)}行")
+
+
+if __name__ == '__main__':
+    main()
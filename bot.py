@@ -1,15 +1,27 @@
+import asyncio
 import discord
 from discord import ui, Interaction, Embed, Color, ButtonStyle, TextStyle, app_commands
 import pandas as pd
 import traceback
+from datetime import datetime, timedelta
 from collections import defaultdict
 import gspread
 import os
 import cv2
 
 import config
+import async_database
 import database
+import factor_tables
 import image_processor
+import query_engine
+import result_sessions
+import search_query
+import snapshot
+import storage
+from concurrent.futures import Future
+from write_queue import SheetWriteQueue
+from scoring import ScoreSheets
 
 from views.ranking_view import RankingView
 from views.register_view import SetOwnerView, DetailsEditView
@@ -24,7 +36,7 @@ from threading import Thread
 # --- グローバル変数 ---
 factor_dictionary = {}
 factor_name_to_id = {}
-score_sheets = {}
+score_sheets = ScoreSheets()
 character_data = {}
 char_name_to_id = {}
 character_list_sorted = []
@@ -71,7 +83,7 @@ async def evaluate(interaction: Interaction, image: discord.Attachment, score_sh
         
         permanent_image_url = await client.upload_image_to_log_channel(interaction, temp_image_path, character_name, image.url)
         
-        individual_id = database.record_evaluation_to_db(
+        individual_id = await async_database.record_evaluation_to_db(
             gspread_client=client.gspread_client,
             interaction=interaction,
             character_name=character_name,
@@ -86,10 +98,9 @@ async def evaluate(interaction: Interaction, image: discord.Attachment, score_sh
         )
         
         if score_sheet_name:
-            score_sheet = score_sheets.get(score_sheet_name)
-            if not score_sheet:
+            if score_sheet_name not in score_sheets:
                 return await interaction.followup.send(f"指定されたスコアシート `{score_sheet_name}` は見つかりませんでしたわ。", ephemeral=True)
-            total_score = sum(score_sheet.get(factor['id'], 0) * factor['stars'] for factor in factor_details)
+            total_score = score_sheets.score_individual(factor_details)[score_sheet_name]
             desc = f"まあ、`{score_sheet_name}`で**{total_score}点**ですのね！ふふっ、素晴らしい評価ですわ！\n（個体ID: {individual_id}）"
         else:
             desc = f"この出会いが、あなたの素敵な思い出のひとつになりますように♪\n（個体ID: {individual_id}）"
@@ -147,7 +158,8 @@ async def debug_evaluate(interaction: Interaction, image: discord.Attachment, le
         if os.path.exists(debug_image_path): os.remove(debug_image_path)
 
 @app_commands.command(name="因子検索", description="データベースに登録された因子を検索いたしますわ。")
-async def search_factors_command(interaction: Interaction):
+@app_commands.describe(query="条件を書くと、すぐに検索しますの。例: chara:ファインモーション blue:スピード>=3 white:右回り>=2,コーナー回復>=1 any2")
+async def search_factors_command(interaction: Interaction, query: str = None):
     client: FactorBotClient = interaction.client
     try:
         # ★★★ 何よりも先に、まず返事をする！ ★★★
@@ -157,6 +169,18 @@ async def search_factors_command(interaction: Interaction):
         if not client.gspread_client: 
             # deferの後なので、send_messageではなくfollowup.sendを使う
             return await interaction.followup.send("データベースが読み込まれておりませんので、検索できませんでしたわ。", ephemeral=True)
+
+        if query:
+            # 条件がテキストで書かれていれば、ビルダーを通さずにそのまま検索する
+            try:
+                conditions, search_only_mine, include_archive = search_query.parse(query, factor_dictionary, char_name_to_id, score_sheets)
+            except ValueError as e:
+                return await interaction.followup.send(f"検索条件を読み取れませんでしたわ。\n{e}", ephemeral=True)
+            message = await interaction.followup.send("データベースを検索中です…")
+            view = SearchView(client.gspread_client, interaction.user, message, factor_dictionary, character_data, score_sheets, character_list_sorted, conditions)
+            view.search_only_mine = search_only_mine
+            view.include_archive = include_archive
+            return await view.run_search()
         
         message = await interaction.followup.send("検索画面を準備しておりますので、少々お待ちくださいな♪")
         
@@ -169,8 +193,9 @@ async def search_factors_command(interaction: Interaction):
             score_sheets=score_sheets,
             character_list_sorted=character_list_sorted
         )
+        # 条件を組み立てている間に、データベースの読み込みを済ませておく
+        view.start_prefetch()
         await message.edit(content=None, embed=view.create_embed(), view=view)
-        client.active_search_views[interaction.user.id] = message
             
     except Exception as e:
         print(f"検索機能の起動中にエラーが発生しました: {e}"); traceback.print_exc()
@@ -180,12 +205,12 @@ async def mybox(interaction: Interaction):
     client: FactorBotClient = interaction.client
     await interaction.response.defer(ephemeral=True)
     try:
-        summary_df, _ = database.get_full_database(client.gspread_client)
+        summary_df, _ = await async_database.get_full_database(client.gspread_client)
         if summary_df.empty or '所有者ID' not in summary_df.columns:
             return await interaction.followup.send("まだどなたも因子を所有しておりませんわ。", ephemeral=True)
 
-        my_factors = summary_df[summary_df['所有者ID'] == str(interaction.user.id)]
-        if my_factors.empty:
+        my_rows = (summary_df['所有者ID'] == str(interaction.user.id)).to_numpy().nonzero()[0]
+        if not len(my_rows):
             embed = create_themed_embed(title="🍀 マイ倉庫", description="これからどんな因子と出会うのか、楽しみですわね♪", footer_text=f"Request by {interaction.user.display_name}", thumbnail_url=config.MYBOX_THUMBNAIL_URL)
             return await interaction.followup.send(embed=embed, ephemeral=True)
 
@@ -194,14 +219,14 @@ async def mybox(interaction: Interaction):
             gspread_client=client.gspread_client,
             author=interaction.user,
             message=message,
-            summary_df=my_factors,
+            session=result_sessions.manager.open(summary_df, my_rows),
             conditions={},
             factor_dictionary=factor_dictionary,
             character_data=character_data,
             score_sheets=score_sheets,
             character_list_sorted=character_list_sorted
         )
-        await message.edit(content=f"**{len(my_factors)}件**の因子が見つかりましたわ。", embed=view.create_embed(), view=view)
+        await message.edit(content=f"**{len(my_rows)}件**の因子が見つかりましたわ。", embed=view.create_embed(), view=view)
     except Exception as e:
         print(f"マイ倉庫の表示中にエラーが発生: {e}"); traceback.print_exc()
         await interaction.followup.send(f"エラーが発生いたしましたわ。\n`{e}`", ephemeral=True)
@@ -212,18 +237,35 @@ async def recalculate(interaction: Interaction):
     await interaction.response.defer(ephemeral=True)
     client: FactorBotClient = interaction.client
     try:
-        count = database.recalculate_all_scores(client.gspread_client, score_sheets)
+        count = await async_database.recalculate_all_scores(client.gspread_client, score_sheets, write_queue=client.write_queue)
         await interaction.followup.send(f"{count}件の因子のスコアを再計算いたしましたわ。", ephemeral=True)
     except Exception as e:
         print(f"スコア再計算中にエラーが発生: {e}"); traceback.print_exc()
         await interaction.followup.send(f"エラーが発生いたしましたわ。\n`{e}`", ephemeral=True)
 
+@app_commands.command(name="reload", description="【管理者用】辞書と採点簿を、再起動せずに読み込み直しますわ。")
+async def reload(interaction: Interaction):
+    if interaction.user.id not in config.ADMIN_USER_IDS: return await interaction.response.send_message("エラーですわ: このコマンドは管理者の方しかお使いになれませんの。", ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+    client: FactorBotClient = interaction.client
+    try:
+        changed_sheets = await client.reload_reference_data()
+        if changed_sheets is None:
+            return await interaction.followup.send("辞書と採点簿に変更はございませんでしたわ。", ephemeral=True)
+        message = f"辞書と採点簿を読み込み直しましたわ。(世代: {client.reference_generation})"
+        if changed_sheets:
+            message += f"\n変更のあった採点簿 `{'`, `'.join(changed_sheets)}` のスコアも再計算いたしましたの。"
+        await interaction.followup.send(message, ephemeral=True)
+    except Exception as e:
+        print(f"辞書の再読み込み中にエラーが発生: {e}"); traceback.print_exc()
+        await interaction.followup.send(f"エラーが発生いたしましたわ。\n`{e}`", ephemeral=True)
+
 @app_commands.command(name="ranking", description="サーバー内の因子ランキングを表示いたしますわ。")
 async def ranking(interaction: Interaction):
     client: FactorBotClient = interaction.client
     try:
         await interaction.response.defer(ephemeral=True, thinking=True)
-        summary_df, _ = database.get_full_database(client.gspread_client)
+        summary_df, _ = await async_database.get_full_database(client.gspread_client)
         all_usages = []
         if '用途' in summary_df.columns:
             all_usages = summary_df['用途'].dropna().unique().tolist()
@@ -251,7 +293,7 @@ async def setowner(interaction: Interaction, individual_id: str, user: discord.M
     client: FactorBotClient = interaction.client
     await interaction.response.defer(ephemeral=True)
     try:
-        success = database.update_owner(client.gspread_client, individual_id, user)
+        success = await client.wait_for_write(await async_database.update_owner(client.gspread_client, individual_id, user, write_queue=client.write_queue))
         if success:
             await interaction.followup.send(f"ふふっ、個体ID `{individual_id}` の新しいトレーナーは **{user.display_name}** さんですのね♪ 承知いたしましたわ。", ephemeral=True)
         else:
@@ -265,7 +307,14 @@ class FactorBotClient(discord.Client):
         super().__init__(intents=intents)
         self.tree = app_commands.CommandTree(self)
         self.gspread_client = None
-        self.active_search_views = {}
+        self.write_queue = None
+        self.reload_lock = asyncio.Lock()
+        self.reference_data = None
+        self.reference_checksum = None
+        self.reference_generation = 0
+        self.reference_poll_task = None
+        self.maintenance_task = None
+        self.snapshot_refresh_task = None
 
     async def upload_image_to_log_channel(self, interaction: Interaction, image_path: str, character_name: str, original_url: str):
         if config.FACTOR_LOG_CHANNEL_ID:
@@ -283,7 +332,7 @@ class FactorBotClient(discord.Client):
 
     async def check_rank_in(self, interaction: Interaction, gspread_client, individual_id: str, author: discord.User):
         try:
-            summary_df, factors_df = database.get_full_database(gspread_client)
+            summary_df, factors_df = await async_database.get_full_database(gspread_client)
             if summary_df.empty or factors_df.empty: return
 
             target_row = summary_df[summary_df['個体ID'] == individual_id]
@@ -292,17 +341,13 @@ class FactorBotClient(discord.Client):
             
             target_factors = factors_df[factors_df['個体ID'] == individual_id]
             if target_factors.empty: return
-            factor_details = [{'id': str(row['因子ID']), 'stars': int(row['星の数'])} for _, row in target_factors.iterrows()]
-
-            new_factor_scores = { s_name: sum(s_sheet.get(f['id'], 0) * f['stars'] for f in factor_details) for s_name, s_sheet in score_sheets.items() }
+            new_factor_scores = score_sheets.score_factors_df(target_factors, [individual_id]).iloc[0].to_dict()
 
             notification_messages = []
             for sheet_name, new_score in new_factor_scores.items():
                 if new_score <= 0: continue
                 score_col = f"合計({sheet_name})"
                 if score_col not in summary_df.columns: continue
-
-                summary_df[score_col] = pd.to_numeric(summary_df[score_col], errors='coerce').fillna(0)
                 
                 my_other_scores = summary_df[(summary_df['所有者ID'] == str(author.id)) & (summary_df['個体ID'] != individual_id)][score_col]
                 my_current_best = 0
@@ -333,9 +378,28 @@ class FactorBotClient(discord.Client):
             print(f"ランキング通知のチェック中にエラー: {e}")
             traceback.print_exc()
 
+    async def wait_for_write(self, result):
+        """書き込みキューに積まれた書き込みなら、確定するまで待ってから成否を返す"""
+        if not isinstance(result, Future):
+            return bool(result)
+        try:
+            await asyncio.wrap_future(result)
+            return True
+        except Exception as e:
+            print(f"キュー経由の書き込みに失敗: {e}")
+            return False
+
+    async def update_summary_fields(self, individual_id: str, updates: dict):
+        try:
+            return await self.wait_for_write(await async_database.update_summary_fields(self.gspread_client, individual_id, updates, write_queue=self.write_queue))
+        except Exception as e:
+            print(f"DB更新中にエラーが発生: {e}")
+            traceback.print_exc()
+            return False
+
     async def save_parent_factors_to_db(self, individual_id: str, p1_factor_id: str, p1_stars: str, p2_factor_id: str, p2_stars: str):
         try:
-            return database.save_parent_factors(self.gspread_client, individual_id, p1_factor_id, p1_stars, p2_factor_id, p2_stars)
+            return await self.wait_for_write(await async_database.save_parent_factors(self.gspread_client, individual_id, p1_factor_id, p1_stars, p2_factor_id, p2_stars, write_queue=self.write_queue))
         except Exception as e:
             print(f"DB保存中にエラーが発生: {e}")
             traceback.print_exc()
@@ -343,19 +407,22 @@ class FactorBotClient(discord.Client):
 
     async def delete_factor_by_id(self, gspread_client, individual_id: str, user_id: int, is_admin: bool):
         try:
-            return database.delete_factor_by_id(gspread_client, individual_id, user_id, is_admin)
+            return await async_database.delete_factor_by_id(gspread_client, individual_id, user_id, is_admin, write_queue=self.write_queue)
         except Exception as e:
             print(f"delete_factor_by_idの呼び出し中にエラー: {e}")
             traceback.print_exc()
             return False, "削除処理の呼び出し中に予期せぬエラーが発生しました。"           
     
     async def setup_hook(self):
+        self.load_warm_start_snapshot()
+
         # この中に、定義した全てのコマンドを追加していきます
         self.tree.add_command(evaluate)
         self.tree.add_command(debug_evaluate)
         self.tree.add_command(search_factors_command)
         self.tree.add_command(mybox)
         self.tree.add_command(recalculate)
+        self.tree.add_command(reload)
         self.tree.add_command(ranking)
         self.tree.add_command(whoami)
         self.tree.add_command(setowner)
@@ -367,9 +434,118 @@ class FactorBotClient(discord.Client):
         # グローバル（全てのサーバー）に反映させる場合はこちらを使います
         await self.tree.sync()
 
-    async def on_ready(self):
+    def apply_reference_data(self, data: dict):
+        """新しく読み込んだ辞書と採点簿を、まとめて差し替える"""
         global factor_dictionary, factor_name_to_id, score_sheets, character_data, char_name_to_id, character_list_sorted
+        # awaitを挟まずに全部を入れ替えるので、途中の状態が他の処理から見えることはない。
+        # 表示中のViewは作られたときの辞書を持ち続けるから、古い世代のまま一貫して動く。
+        factor_dictionary = data['factor_dictionary']
+        factor_name_to_id = data['factor_name_to_id']
+        character_data = data['character_data']
+        char_name_to_id = data['char_name_to_id']
+        character_list_sorted = data['character_list_sorted']
+        score_sheets = data['score_sheets']
+        self.reference_data = data
+        self.reference_checksum = data['checksum']
+        self.reference_generation += 1
+
+    def load_warm_start_snapshot(self):
+        """前回保存したスナップショットを同期的に読み込み、Googleの応答を待たずにコマンドを使えるようにする"""
+        reference, tables = snapshot.load_snapshot(config.SNAPSHOT_PATH)
+        if reference is not None:
+            self.apply_reference_data(database.build_reference_data(
+                reference['factor_dictionary'], reference['factor_name_to_id'],
+                reference['character_data'], reference['char_name_to_id'], reference['score_sheets']
+            ))
+            print(f"スナップショットから辞書 {len(factor_dictionary)}件・採点簿 {len(score_sheets)}個を読み込んだで。")
+        if tables is not None:
+            factor_tables.publish(
+                factor_tables.apply_summary_schema(tables['summary_df']),
+                factor_tables.apply_factors_schema(tables['factors_df']),
+                loaded_at=tables['loaded_at'], source='snapshot'
+            )
+            print(f"スナップショットからデータベース {len(tables['summary_df'])}件を読み込んだで。")
+
+    async def save_warm_start_snapshot(self):
+        if self.reference_data is None:
+            return
+        try:
+            await async_database.run_blocking(snapshot.save_snapshot, config.SNAPSHOT_PATH, self.reference_data, factor_tables.current())
+        except Exception as e:
+            print(f"スナップショットの保存中にエラー: {e}")
+            traceback.print_exc()
+
+    async def refresh_database_snapshot(self):
+        """バックグラウンドでデータベースを読み込み直し、スナップショットを最新にしておく"""
+        try:
+            await async_database.run_blocking(storage.get_backend(self.gspread_client).load_all, timeout=config.SHEETS_IO_LONG_TIMEOUT)
+            await self.save_warm_start_snapshot()
+            print("データベースの最新の内容をスナップショットに保存したで。")
+        except Exception as e:
+            print(f"データベースの読み込み中にエラー: {e}")
+            traceback.print_exc()
+
+    async def reload_reference_data(self, recalculate: bool = True):
+        """
+        辞書と採点簿をスレッドプールで読み込み直し、中身が変わっていれば差し替える。
+        中身が変わった採点簿があれば、その列だけスコアを再計算する。
+        差し替えなかった場合はNone、差し替えた場合はスコアが変わった採点簿の名前のリストを返す。
+        """
+        async with self.reload_lock:
+            data = await async_database.load_reference_data(self.gspread_client)
+            if data is None:
+                print("エラーや: 辞書か採点簿の読み込みに失敗したから、今の辞書のまま動かすで。")
+                return None
+            if data['checksum'] == self.reference_checksum:
+                return None
+
+            old_score_sheets = score_sheets
+            self.apply_reference_data(data)
+            print(f"辞書と採点簿を差し替えたで (世代: {self.reference_generation})")
+            await self.save_warm_start_snapshot()
+
+            new_score_sheets = data['score_sheets']
+            changed_sheets = [name for name in new_score_sheets if old_score_sheets.get(name) != new_score_sheets[name]]
+            if recalculate and changed_sheets:
+                print(f"採点簿 {changed_sheets} が変わったから、その列だけ再計算するで...")
+                await async_database.recalculate_all_scores(self.gspread_client, new_score_sheets, sheet_names=changed_sheets, write_queue=self.write_queue)
+            return changed_sheets
+
+    async def poll_reference_data(self):
+        """
+        定期的に辞書と採点簿のシートだけを読み込み、チェックサムが変わっていたら差し替える。
+        スプレッドシート全体の更新日時は因子の登録でも変わるので使わない。読み込みに失敗しても次の回にまた試す。
+        """
+        while not self.is_closed():
+            await asyncio.sleep(config.REFERENCE_POLL_INTERVAL)
+            try:
+                await self.reload_reference_data()
+            except Exception as e:
+                print(f"辞書の自動再読み込み中にエラー: {e}")
+                traceback.print_exc()
+
+    async def run_daily_maintenance(self):
+        """毎日config.COMPACTION_HOURの時刻に、削除済みの行の整理と、古い個体のアーカイブへの移動を行う"""
+        while not self.is_closed():
+            now = datetime.now()
+            next_run = now.replace(hour=config.COMPACTION_HOUR, minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            await asyncio.sleep((next_run - now).total_seconds())
+            try:
+                # 行番号がずれる前に、キューに残っとる書き込みはそれぞれの中で全部送られる
+                count = 0
+                if config.SOFT_DELETE:
+                    count += await async_database.compact_deleted_rows(self.gspread_client, write_queue=self.write_queue)
+                if config.ARCHIVE_AFTER_DAYS is not None and config.STORAGE_BACKEND == "sheets":
+                    count += await async_database.archive_individuals(self.gspread_client, config.ARCHIVE_AFTER_DAYS, write_queue=self.write_queue)
+                if count:
+                    await self.save_warm_start_snapshot()
+            except Exception as e:
+                print(f"夜間の整理中にエラー: {e}")
+                traceback.print_exc()
 
+    async def on_ready(self):
         print(f'{self.user} としてログインしたで')
         try:
             print("Google SpreadSheetに接続しにいくで...");
@@ -380,10 +556,22 @@ class FactorBotClient(discord.Client):
                  print("エラーや: config.pyでのGoogle認証に失敗したみたいや。")
                  return
 
+            if self.write_queue is None:
+                self.write_queue = SheetWriteQueue(self.gspread_client)
+                self.write_queue.start()
+
             print("データベースの読み込み、始めるで..."); 
             
-            factor_dictionary, factor_name_to_id, character_data, char_name_to_id, character_list_sorted = database.load_factor_dictionaries(self.gspread_client)
-            score_sheets = database.load_score_sheets_by_id(self.gspread_client, factor_name_to_id)
+            await self.reload_reference_data(recalculate=False)
+            # 再接続のたびにon_readyが呼ばれるので、最初の1回だけ読み込む
+            if self.snapshot_refresh_task is None:
+                self.snapshot_refresh_task = asyncio.create_task(self.refresh_database_snapshot())
+
+            if config.REFERENCE_POLL_INTERVAL > 0 and self.reference_poll_task is None:
+                self.reference_poll_task = asyncio.create_task(self.poll_reference_data())
+
+            if config.COMPACTION_HOUR is not None and (config.SOFT_DELETE or config.ARCHIVE_AFTER_DAYS is not None) and self.maintenance_task is None:
+                self.maintenance_task = asyncio.create_task(self.run_daily_maintenance())
 
             print("データベースの読み込み完了や。いつでもいけるで。")
             print(f"全 {len(self.tree.get_commands())} 個のコマンドを同期し、準備完了や！")
@@ -392,27 +580,24 @@ class FactorBotClient(discord.Client):
             print(f"起動んときにヤバいエラーが出てもうた: {e}\n主要機能は動かへんかもしれんわ。"); 
             traceback.print_exc()
 
+    async def close(self):
+        # 終了する前に、書き込みキューに残っとる分を全部送っとく
+        if self.write_queue is not None:
+            print(f"書き込みキューに残っとる {self.write_queue.depth} 件を送信してから終了するで...")
+            await self.write_queue.close()
+        await super().close()
+
 async def check_rank_in(interaction: discord.Interaction, gspread_client, individual_id: str, author: discord.User, score_sheets: dict, character_data: dict):
     try:
-        spreadsheet = gspread_client.open("因子評価データベース")
-        summary_sheet = spreadsheet.worksheet("評価サマリー")
-        factors_sheet = spreadsheet.worksheet("因子データ")
-
-        summary_df = pd.DataFrame(summary_sheet.get_all_records(numericise_ignore=['all']))
+        summary_df, factor_rows = await async_database.get_full_database(gspread_client)
         target_row = summary_df[summary_df['個体ID'] == individual_id]
         if target_row.empty: return
         character_name = target_row.iloc[0]['キャラ名']
         
-        factor_rows = pd.DataFrame(factors_sheet.get_all_records(numericise_ignore=['all']))
         target_factors = factor_rows[factor_rows['個体ID'] == individual_id]
         if target_factors.empty: return
         
-        factor_details = [{'id': str(row['因子ID']), 'stars': int(row['星の数'])} for _, row in target_factors.iterrows()]
-
-        new_factor_scores = {
-            s_name: sum(s_sheet.get(f['id'], 0) * f['stars'] for f in factor_details)
-            for s_name, s_sheet in score_sheets.items()
-        }
+        new_factor_scores = score_sheets.score_factors_df(target_factors, [individual_id]).iloc[0].to_dict()
 
         notification_messages = []
 
@@ -420,8 +605,6 @@ async def check_rank_in(interaction: discord.Interaction, gspread_client, indivi
             if new_score <= 0: continue
             score_col = f"合計({sheet_name})"
             if score_col not in summary_df.columns: continue
-
-            summary_df[score_col] = pd.to_numeric(summary_df[score_col], errors='coerce').fillna(0)
             
             server_ids = {str(m.id) for m in interaction.guild.members}
             server_summary = summary_df[summary_df['所有者ID'].isin(server_ids)]
@@ -473,11 +656,22 @@ async def check_rank_in(interaction: discord.Interaction, gspread_client, indivi
         traceback.print_exc()
 
 app = Flask('')
+client = None
 
 @app.route('/')
 def health_check():
     return "I'm alive!"
 
+@app.route('/metrics')
+def metrics():
+    write_queue = getattr(client, 'write_queue', None) if client else None
+    return {
+        'write_queue': write_queue.stats() if write_queue else None,
+        'sheets_io': async_database.stats(),
+        'search_cache': query_engine.result_cache.stats(),
+        'result_sessions': result_sessions.manager.stats(),
+    }
+
 def run_web_server():
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port)
@@ -32,6 +32,78 @@ LEFT_COLUMN_SEARCH_WIDTH_RATIO = 0.20
 RIGHT_COLUMN_SEARCH_START_RATIO = 0.65
 RIGHT_COLUMN_SEARCH_WIDTH_RATIO = 0.20
 
+# --- スプレッドシート書き込みキューの調整パラメータ ---
+# Sheets APIの書き込み上限(1分あたり60リクエスト)より少し余裕を持たせる
+SHEETS_WRITE_REQUESTS_PER_MINUTE = 50
+SHEETS_WRITE_BURST = 5
+# 書き込みをまとめるために待つ秒数
+SHEETS_WRITE_FLUSH_DELAY = 1.0
+SHEETS_WRITE_MAX_RETRIES = 5
+SHEETS_WRITE_BACKOFF_BASE = 2.0
+SHEETS_WRITE_BACKOFF_MAX = 64.0
+
+# --- スプレッドシート読み書き用スレッドプールの調整パラメータ ---
+# 同時に実行するgspread呼び出しの最大数
+SHEETS_IO_MAX_WORKERS = 4
+# 1回の呼び出しのタイムアウト秒数 (全件の再計算など重い処理は長めに取る)
+SHEETS_IO_TIMEOUT = 30.0
+SHEETS_IO_LONG_TIMEOUT = 300.0
+
+# スコア再計算で、1回のvalues_batch_updateに含める範囲の最大数
+RECALC_BATCH_RANGES = 500
+
+# --- 因子データの保存先 ---
+# "sheets": スプレッドシートに直接読み書き / "sqlite": ローカルのSQLiteだけ
+# "sqlite+sheets": SQLiteを正として読み書きし、スプレッドシートには裏で書き写す
+STORAGE_BACKEND = "sheets"
+SQLITE_PATH = "factor_db.sqlite3"
+
+# --- 因子データの保存形式 ---
+# "rows": 因子1つにつき因子データシートの1行 / "packed": 評価サマリーの「因子パック」列に1個体1セルでまとめて保存
+# 切り替えるときは、先に convert_factor_storage.py で既存のデータを変換しておくこと
+FACTOR_STORAGE = "rows"
+
+# --- 因子の削除 ---
+# Trueにすると、削除した因子には「削除済み」の印を付けるだけにして、行の削除は整理の時間にまとめて行う
+# Falseなら今まで通り、削除したときにすぐ行を消す
+SOFT_DELETE = False
+# 削除済みの行の整理とアーカイブへの移動を行う時刻 (サーバーの時計で0〜23時)。Noneにすると自動では行わない
+# SOFT_DELETEもARCHIVE_AFTER_DAYSも使わないときは、この時刻になっても何もしない
+COMPACTION_HOUR = 5
+
+# --- アーカイブ ---
+# 登録からこの日数が過ぎた個体と、「放出済み」列がTRUEの個体を、アーカイブ用のシートへ移す。Noneにすると移さない
+# (保存先が "sheets" のときだけ有効)
+ARCHIVE_AFTER_DAYS = None
+ARCHIVE_RELEASED_COLUMN = '放出済み'
+# 検索でアーカイブも含めたときに、読み込んだアーカイブを使い回す秒数
+ARCHIVE_CACHE_SECONDS = 3600
+
+# --- 検索結果のキャッシュ ---
+# 検索結果と条件ごとの途中結果を、データの世代ごとに覚えておくメモリの上限(バイト)。0にするとキャッシュしない
+SEARCH_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# --- 結果画面のセッション ---
+# 表示中の検索結果・ランキングが使うメモリ(行位置の配列と参照している評価サマリー)の上限(バイト)。
+# 超えたら、しばらく操作されていない画面から期限切れにする
+RESULT_SESSION_MAX_BYTES = 64 * 1024 * 1024
+
+# --- テキストでの検索条件 (/因子検索 の query) ---
+# 因子名・キャラ名・採点簿名が辞書と完全に一致しないとき、あいまい一致で採用する最低の一致度(0〜100)
+SEARCH_QUERY_MATCH_THRESHOLD = 80
+
+# --- 検索ビルダーの先読み ---
+# 検索ビルダーを開いたときに先読みしたデータベースを、検索に使ってよい時間(秒)。過ぎたら読み込み直す
+SEARCH_PREFETCH_MAX_AGE = 120
+
+# --- 辞書・採点簿の自動再読み込み ---
+# 辞書と採点簿のシートを読み込んで変更を確認する間隔(秒)。毎回それらのシートを1回のAPI呼び出しで読む。0にすると自動再読み込みは行わない
+REFERENCE_POLL_INTERVAL = 0
+
+# --- ウォームスタート用のスナップショット ---
+# 起動時にまずこのファイルから辞書・採点簿・データベースを読み込み、Googleの応答を待たずに動き始める
+SNAPSHOT_PATH = "warm_start_snapshot.msgpack"
+
 # --- Botが投稿するEmbedの画像URL ---
 AUTHOR_NAME = "ファインモーション"
 AUTHOR_ICON_URL = "https://cdn.discordapp.com/attachments/1407605158161940480/1407617349355442197/2-removebg-preview.png"
@@ -0,0 +1,37 @@
+"""
+因子データの保存形式を変換するツール。
+
+    python convert_factor_storage.py pack     # 因子データシート → 評価サマリーの「因子パック」列
+    python convert_factor_storage.py unpack   # 「因子パック」列 → 因子データシート
+
+変換が終わったら config.FACTOR_STORAGE を書き換えて、Botを再起動すること。
+"""
+import sys
+
+import config
+import database
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] not in ('pack', 'unpack'):
+        print(__doc__)
+        return 1
+    if not config.gc:
+        print("エラー: Googleの認証情報が設定されていません。")
+        return 1
+
+    if sys.argv[1] == 'pack':
+        count = database.pack_factor_rows(config.gc)
+        print(f"{count}個体分の因子を、因子パック列に書き込みました。")
+    else:
+        loaded = database.load_factor_dictionaries(config.gc)
+        if loaded is None:
+            print("エラー: 因子辞書を読み込めませんでした。")
+            return 1
+        count = database.unpack_factor_rows(config.gc, loaded[0])
+        print(f"因子データシートに{count}行を書き込みました。")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
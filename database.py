@@ -1,43 +1,69 @@
 import gspread
+import hashlib
+import json
+import threading
+import time
 import traceback
-from collections import defaultdict
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import numpy as np
 import pandas as pd
 import config
 import discord
+from scoring import ScoreSheets
+import factor_tables
+import factor_codec
 
-def load_factor_dictionaries(gspread_client):
+def _values_to_records(values: list) -> list[dict]:
+    """シートの値(先頭行がヘッダー)を、get_all_records()と同じ形のレコードのリストにする"""
+    if not values:
+        return []
+    values = gspread.utils.fill_gaps(values)
+    keys, rows = values[0], values[1:]
+    rows = [gspread.utils.numericise_all(row) for row in rows]
+    return gspread.utils.to_records(keys, rows)
+
+
+def _fetch_tabs(spreadsheet, prefixes: tuple) -> dict:
+    """
+    名前が指定した接頭辞で始まるシートの値を、values_batch_getの1回の呼び出しでまとめて取得する。
+    {シート名: 値の2次元リスト} をシートの並び順で返す。
+    """
+    titles = [ws.title for ws in spreadsheet.worksheets() if ws.title.startswith(prefixes)]
+    if not titles:
+        return {}
+    response = spreadsheet.values_batch_get([gspread.utils.absolute_range_name(title) for title in titles])
+    return {title: value_range.get('values', []) for title, value_range in zip(titles, response.get('valueRanges', []))}
+
+
+def parse_factor_dictionaries(tabs: dict):
+    """[辞書]シートの値から、因子辞書とキャラ辞書を組み立てる"""
     global factor_dictionary, factor_name_to_id, character_data, char_name_to_id, character_list_sorted
     try:
-        spreadsheet = gspread_client.open("因子評価データベース")
         temp_factor_dict = {}
         temp_factor_name_to_id = {}
         temp_character_data = {}
         temp_char_name_to_id = {}
         print("1. [辞書]キャラ名 シートを読み込み中...")
+        if '[辞書]キャラ名' not in tabs:
+            print("致命的エラー: '[辞書]キャラ名'シートが見つかりません。")
+            return
         try:
-            ws = spreadsheet.worksheet('[辞書]キャラ名')
-            records = ws.get_all_records()
-            for record in records:
+            for record in _values_to_records(tabs['[辞書]キャラ名']):
                 if record.get('キャラID') and record.get('キャラ名'):
                     char_id = str(record['キャラID']).strip()
                     char_name = str(record['キャラ名']).strip()
-                    thumbnail_url = record.get('サムネイルURL', '').strip()
+                    thumbnail_url = str(record.get('サムネイルURL', '')).strip()
                     temp_character_data[char_id] = {'name': char_name, 'green_factor_ids': [], 'thumbnail_url': thumbnail_url}
                     temp_char_name_to_id[char_name] = char_id
             print(f"-> {len(temp_character_data)}件のキャラ名をロードしました。")
-        except gspread.exceptions.WorksheetNotFound:
-            print("致命的エラー: '[辞書]キャラ名'シートが見つかりません。")
-            return
         except Exception as e:
             print(f"キャラ名辞書の読み込み中にエラー: {e}")
             return
         print("2. スキル・ステータス等の因子辞書を読み込み中...")
-        for ws in spreadsheet.worksheets():
-            if ws.title.startswith('[辞書]') and ws.title not in ['[辞書]キャラ名', '[辞書]キャラ緑因子紐付け']:
-                factor_type = ws.title.replace('[辞書]', '').strip()
-                records = ws.get_all_records()
-                for record in records:
+        for title, values in tabs.items():
+            if title.startswith('[辞書]') and title not in ['[辞書]キャラ名', '[辞書]キャラ緑因子紐付け']:
+                factor_type = title.replace('[辞書]', '').strip()
+                for record in _values_to_records(values):
                     if record.get('因子ID') and record.get('因子名'):
                         factor_id = str(record['因子ID']).strip()
                         factor_name = str(record['因子名']).strip()
@@ -45,25 +71,24 @@ def load_factor_dictionaries(gspread_client):
                         temp_factor_name_to_id[factor_name] = factor_id
         print(f"-> {len(temp_factor_dict)}件のスキル・ステータス因子をロードしました。")
         print("3. [辞書]キャラ緑因子紐付け シートを読み込み中...")
-        try:
-            ws = spreadsheet.worksheet('[辞書]キャラ緑因子紐付け')
-            records = ws.get_all_records()
-            for record in records:
-                if record.get('キャラID') and record.get('緑因子ID'):
-                    char_id = str(record['キャラID']).strip()
-                    green_id = str(record['緑因子ID']).strip()
-                    if char_id in temp_character_data:
-                        if green_id in temp_factor_dict:
-                            temp_character_data[char_id]['green_factor_ids'].append(green_id)
-                        else:
-                            print(f"警告: 紐付けシートの緑因子ID '{green_id}' は因子辞書に存在しません。")
-                    else:
-                        print(f"警告: 紐付けシートのキャラID '{char_id}' はキャラ名辞書に存在しません。")
-            print(f"-> キャラと緑因子の紐付け完了。")
-        except gspread.exceptions.WorksheetNotFound:
+        if '[辞書]キャラ緑因子紐付け' not in tabs:
             print("警告: '[辞書]キャラ緑因子紐付け'シートが見つかりません。")
-        except Exception as e:
-            print(f"キャラ緑因子紐付け辞書の読み込み中にエラー: {e}")
+        else:
+            try:
+                for record in _values_to_records(tabs['[辞書]キャラ緑因子紐付け']):
+                    if record.get('キャラID') and record.get('緑因子ID'):
+                        char_id = str(record['キャラID']).strip()
+                        green_id = str(record['緑因子ID']).strip()
+                        if char_id in temp_character_data:
+                            if green_id in temp_factor_dict:
+                                temp_character_data[char_id]['green_factor_ids'].append(green_id)
+                            else:
+                                print(f"警告: 紐付けシートの緑因子ID '{green_id}' は因子辞書に存在しません。")
+                        else:
+                            print(f"警告: 紐付けシートのキャラID '{char_id}' はキャラ名辞書に存在しません。")
+                print(f"-> キャラと緑因子の紐付け完了。")
+            except Exception as e:
+                print(f"キャラ緑因子紐付け辞書の読み込み中にエラー: {e}")
         factor_dictionary = temp_factor_dict
         factor_name_to_id = temp_factor_name_to_id
         character_data = temp_character_data
@@ -81,17 +106,16 @@ def load_factor_dictionaries(gspread_client):
         traceback.print_exc()
 
 
-def load_score_sheets_by_id(gspread_client, factor_name_to_id):
+def parse_score_sheets(tabs: dict, factor_name_to_id):
+    """[採点簿]シートの値から、因子IDで引ける採点簿を組み立てる"""
     if not factor_name_to_id:
         print("エラー: 採点簿を読み込むには、先に因子辞書を読み込む必要があります。処理をスキップします。")
         return
     try:
-        spreadsheet = gspread_client.open("因子評価データベース")
         temp_sheets = {}
-        for ws in spreadsheet.worksheets():
-            if ws.title.startswith('[採点簿]'):
-                sheet_name = ws.title.replace('[採点簿]', '', 1).strip()
-                all_values = ws.get_all_values()
+        for title, all_values in tabs.items():
+            if title.startswith('[採点簿]'):
+                sheet_name = title.replace('[採点簿]', '', 1).strip()
                 if not all_values: continue
                 sheet_dict = {}
                 for i, row in enumerate(all_values):
@@ -106,55 +130,153 @@ def load_score_sheets_by_id(gspread_client, factor_name_to_id):
                                 if i > 0: print(f"警告: 採点簿'{sheet_name}'の'{factor_name}'は因子辞書にないため無視されます。")
                         elif i == 0: print(f"情報: 採点簿'{sheet_name}'の1行目はヘッダーとしてスキップします。")
                 if sheet_dict: temp_sheets[sheet_name] = sheet_dict
-        score_sheets = temp_sheets
+        score_sheets = ScoreSheets(temp_sheets)
         print(f"-> 因子ID採点簿の読み込み完了。{len(score_sheets)}個の採点簿をロードしました。")
-        return temp_sheets
+        return score_sheets
     except Exception as e:
         print(f"採点簿の読み込み中にエラー: {e}")
         traceback.print_exc()
 
 
-def record_evaluation_to_db(gspread_client, interaction, character_name, factor_details, image_url, purpose, race_route, memo, factor_dictionary, score_sheets, char_name_to_id):
+def load_factor_dictionaries(gspread_client):
+    try:
+        spreadsheet = gspread_client.open("因子評価データベース")
+        return parse_factor_dictionaries(_fetch_tabs(spreadsheet, ('[辞書]',)))
+    except Exception as e:
+        print(f"因子辞書読み込み中に致命的なエラー: {e}")
+        traceback.print_exc()
+
+
+def load_score_sheets_by_id(gspread_client, factor_name_to_id):
+    try:
+        spreadsheet = gspread_client.open("因子評価データベース")
+        return parse_score_sheets(_fetch_tabs(spreadsheet, ('[採点簿]',)), factor_name_to_id)
+    except Exception as e:
+        print(f"採点簿の読み込み中にエラー: {e}")
+        traceback.print_exc()
+
+
+def load_reference_data(gspread_client):
+    """
+    因子辞書と採点簿をまとめて読み込み、1つの世代として辞書で返す。失敗した場合はNoneを返す。
+    シート一覧の取得と、全ての[辞書]・[採点簿]シートの値の取得を、それぞれ1回のAPI呼び出しで済ませる。
+    """
+    started_at = time.perf_counter()
     try:
         spreadsheet = gspread_client.open("因子評価データベース")
-        individual_id = str(int(interaction.created_at.timestamp()))
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tabs = _fetch_tabs(spreadsheet, ('[辞書]', '[採点簿]'))
+    except Exception as e:
+        print(f"辞書・採点簿シートの取得中にエラー: {e}")
+        traceback.print_exc()
+        return None
+    fetched_at = time.perf_counter()
+
+    dictionaries = parse_factor_dictionaries(tabs)
+    if not dictionaries:
+        return None
+    factor_dictionary, factor_name_to_id, character_data, char_name_to_id, _ = dictionaries
+    score_sheets = parse_score_sheets(tabs, factor_name_to_id)
+    if score_sheets is None:
+        return None
+    finished_at = time.perf_counter()
+    print(f"-> 辞書・採点簿 {len(tabs)}シートの読み込み完了: 合計 {finished_at - started_at:.2f}秒 (取得 {fetched_at - started_at:.2f}秒 / 解析 {finished_at - fetched_at:.2f}秒)")
+    return build_reference_data(factor_dictionary, factor_name_to_id, character_data, char_name_to_id, score_sheets)
+
+
+def build_reference_data(factor_dictionary: dict, factor_name_to_id: dict, character_data: dict, char_name_to_id: dict, score_sheets: dict) -> dict:
+    """辞書と採点簿から、Botが使う1世代分の参照データを組み立てる"""
+    if not isinstance(score_sheets, ScoreSheets):
+        score_sheets = ScoreSheets(score_sheets)
+    return {
+        'factor_dictionary': factor_dictionary,
+        'factor_name_to_id': factor_name_to_id,
+        'character_data': character_data,
+        'char_name_to_id': char_name_to_id,
+        'character_list_sorted': sorted(character_data.items(), key=lambda item: item[1]['name']),
+        'score_sheets': score_sheets,
+        'checksum': reference_checksum(factor_dictionary, character_data, score_sheets),
+    }
+
+
+def reference_checksum(factor_dictionary: dict, character_data: dict, score_sheets: dict) -> str:
+    """辞書と採点簿の中身から、変更検知用のチェックサムを作る"""
+    payload = json.dumps([factor_dictionary, character_data, score_sheets], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+FACTOR_SHEET_HEADERS = ['個体ID', '因子ID', '因子名', '因子の種類', '星の数']
+
+_id_lock = threading.Lock()
+_last_individual_id = 0
+
+
+def new_individual_id(interaction=None) -> str:
+    """
+    個体IDを払い出す。インタラクションのスノーフレーク (ミリ秒の時刻+連番) を使うので、
+    同じ秒に何人が登録しても重ならない。念のため、このプロセス内では必ず前回より大きい値にする。
+    以前の秒単位のID (10桁) とは桁数が違って重なることがないので、既存のIDはそのまま使える。
+    """
+    global _last_individual_id
+    snowflake = getattr(interaction, 'id', None) or discord.utils.time_snowflake(datetime.now(timezone.utc))
+    with _id_lock:
+        _last_individual_id = max(int(snowflake), _last_individual_id + 1)
+        return str(_last_individual_id)
+
+
+def build_evaluation_rows(interaction, character_name, factor_details, image_url, purpose, race_route, memo, factor_dictionary, score_sheets, char_name_to_id):
+    """
+    評価結果から、保存先に関係なく使える (個体ID, サマリーの行の辞書, 因子データの行のリスト) を作る。
+    因子データの行は [個体ID, 因子ID, 因子名, 因子の種類, 星の数]。
+    """
+    individual_id = new_individual_id(interaction)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    all_total_scores = score_sheets.score_individual(factor_details)
+    summary_row_data = {'個体ID': individual_id, '投稿日時': now, '投稿者名': interaction.user.display_name, '投稿者ID': str(interaction.user.id), 'キャラ名': character_name, '画像URL': image_url,
+                        '用途': purpose,
+                        'レースローテ': race_route,
+                        'メモ': memo
+                       }
+    for sheet_name, total_score in all_total_scores.items():
+        summary_row_data[f"合計({sheet_name})"] = total_score
+    rows_to_append = []
+    char_id = char_name_to_id.get(character_name)
+    if char_id:
+         char_factor_info = factor_dictionary.get(char_id, {'name': character_name, 'type': 'キャラ名'})
+         rows_to_append.append([individual_id, char_id, char_factor_info['name'], char_factor_info['type'], 0])
+    for factor in factor_details:
+        factor_id = factor['id']
+        factor_info = factor_dictionary.get(factor_id, {'name': '不明な因子', 'type': '不明'})
+        rows_to_append.append([individual_id, factor_id, factor_info['name'], factor_info['type'], factor['stars']])
+    return individual_id, summary_row_data, rows_to_append
+
+
+def insert_individual(gspread_client, summary_row_data: dict, rows_to_append: list):
+    """build_evaluation_rowsで作った1体分の行を、スプレッドシートに追加する。成功すれば個体IDを返す"""
+    try:
+        spreadsheet = gspread_client.open("因子評価データベース")
+        individual_id = summary_row_data['個体ID']
         summary_sheet = spreadsheet.worksheet("評価サマリー")
         summary_headers = summary_sheet.row_values(1)
         if not summary_headers:
             summary_headers = ['個体ID', '投稿日時', '投稿者名', '投稿者ID', 'キャラ名', '画像URL']
             summary_sheet.update(range_name='A1', values=[summary_headers])
-        all_total_scores = {
-            s_name: sum(s_sheet.get(f['id'], 0) * f['stars'] for f in factor_details)
-            for s_name, s_sheet in score_sheets.items()
-        }
-        summary_row_data = {'個体ID': individual_id, '投稿日時': now, '投稿者名': interaction.user.display_name, '投稿者ID': str(interaction.user.id), 'キャラ名': character_name, '画像URL': image_url,
-                            '用途': purpose,
-                            'レースローテ': race_route,
-                            'メモ': memo
-                           }
-        for sheet_name, total_score in all_total_scores.items():
-            col_name = f"合計({sheet_name})"
-            if col_name not in summary_headers:
+        summary_row_data = dict(summary_row_data)
+        if config.FACTOR_STORAGE == "packed":
+            # 因子はサマリーの1セルにまとめて、因子データシートには書かない
+            summary_row_data[factor_codec.PACKED_COLUMN] = factor_codec.pack_factors((row[1], row[4]) for row in rows_to_append)
+        for col_name in summary_row_data:
+            if (col_name.startswith('合計(') or col_name == factor_codec.PACKED_COLUMN) and col_name not in summary_headers:
                 summary_sheet.update_cell(1, len(summary_headers) + 1, col_name)
                 summary_headers.append(col_name)
-            summary_row_data[col_name] = total_score
         final_summary_row = [summary_row_data.get(h, "") for h in summary_headers]
         summary_sheet.append_row(final_summary_row)
-        factors_sheet = spreadsheet.worksheet("因子データ")
-        if not factors_sheet.row_values(1):
-            factors_sheet.update(range_name='A1', values=[['個体ID', '因子ID', '因子名', '因子の種類', '星の数']])
-        rows_to_append = []
-        char_id = char_name_to_id.get(character_name)
-        if char_id:
-             char_factor_info = factor_dictionary.get(char_id, {'name': character_name, 'type': 'キャラ名'})
-             rows_to_append.append([individual_id, char_id, char_factor_info['name'], char_factor_info['type'], 0])
-        for factor in factor_details:
-            factor_id = factor['id']
-            factor_info = factor_dictionary.get(factor_id, {'name': '不明な因子', 'type': '不明'})
-            rows_to_append.append([individual_id, factor_id, factor_info['name'], factor_info['type'], factor['stars']])
-        if rows_to_append:
-            factors_sheet.append_rows(rows_to_append, value_input_option='USER_ENTERED')
+        if config.FACTOR_STORAGE == "rows" and rows_to_append:
+            factors_sheet = spreadsheet.worksheet("因子データ")
+            if not factors_sheet.row_values(1):
+                factors_sheet.update(range_name='A1', values=[FACTOR_SHEET_HEADERS])
+            # 19桁の個体IDが数値に変換されて桁落ちしないよう、RAWで書き込む
+            factors_sheet.append_rows(rows_to_append, value_input_option='RAW')
+        factor_tables.append_individual(summary_row_data, rows_to_append)
         print(f"ID:{individual_id} の評価結果をデータベースに記録しました。")
         return individual_id
     except Exception as e:
@@ -162,132 +284,251 @@ def record_evaluation_to_db(gspread_client, interaction, character_name, factor_
         traceback.print_exc()
         return None
 
+
+def record_evaluation_to_db(gspread_client, interaction, character_name, factor_details, image_url, purpose, race_route, memo, factor_dictionary, score_sheets, char_name_to_id):
+    _, summary_row_data, rows_to_append = build_evaluation_rows(
+        interaction, character_name, factor_details, image_url, purpose, race_route, memo, factor_dictionary, score_sheets, char_name_to_id
+    )
+    return insert_individual(gspread_client, summary_row_data, rows_to_append)
+
 def get_full_database(gspread_client):
-    """データベースから全データを読み込み、2つのDataFrameを返す"""
+    """データベースから全データを読み込み、削除済みを除いた型変換済みの2つのDataFrameを返す"""
     spreadsheet = gspread_client.open("因子評価データベース")
     summary_sheet = spreadsheet.worksheet("評価サマリー")
-    factors_sheet = spreadsheet.worksheet("因子データ")
 
-    summary_df = pd.DataFrame(summary_sheet.get_all_records(numericise_ignore=['all']))
-    factors_df = pd.DataFrame(factors_sheet.get_all_records(numericise_ignore=['all']))
-    
-    return summary_df, factors_df
+    # 型変換は読み込み時の1回だけ。返すDataFrameは共有されるので、呼び出し側で書き換えないこと
+    summary_records = pd.DataFrame(summary_sheet.get_all_records(numericise_ignore=['all']))
+    if config.FACTOR_STORAGE == "packed":
+        # 因子データシートは読まずに、サマリーの因子パック列から直接組み立てる
+        if factor_codec.PACKED_COLUMN in summary_records.columns:
+            factors_records = factor_codec.unpack_column(summary_records['個体ID'], summary_records[factor_codec.PACKED_COLUMN])
+        else:
+            factors_records = pd.DataFrame(columns=['個体ID', '因子ID', '星の数'])
+    else:
+        factors_sheet = spreadsheet.worksheet("因子データ")
+        factors_records = pd.DataFrame(factors_sheet.get_all_records(numericise_ignore=['all']))
+    summary_df = factor_tables.apply_summary_schema(summary_records)
+    factors_df = factor_tables.apply_factors_schema(factors_records)
 
-def save_parent_factors(gspread_client, individual_id, p1_factor_id, p1_stars, p2_factor_id, p2_stars):
-    """親因子の情報をスプレッドシートに保存する"""
+    tables = factor_tables.publish(summary_df, factors_df)
+    return tables.summary_df, tables.factors_df
+
+def _write_cells(worksheet, cells: list, write_queue=None):
+    """
+    セルを書き込む。write_queueが渡された場合は書き込みキューに積み、
+    書き込みが確定したときに完了するFutureを返す。
+    """
+    if write_queue is not None:
+        return write_queue.enqueue(worksheet.title, cells)
+    worksheet.update_cells(cells)
+    return True
+
+
+def update_summary_fields(gspread_client, individual_id: str, updates: dict, write_queue=None, add_missing_headers: bool = False):
+    """評価サマリーの指定した個体の列をまとめて更新する。値がNoneの項目は更新しない"""
     try:
         spreadsheet = gspread_client.open("因子評価データベース")
         summary_sheet = spreadsheet.worksheet("評価サマリー")
-        
-        # 文字列に変換して、確実に検索できるようにする
         cell = summary_sheet.find(str(individual_id), in_column=1)
         if not cell:
             print(f"エラー: 更新対象の因子 ID {individual_id} が見つかりませんでした。")
             return False
 
-        updates = {
-            '親赤因子1_ID': p1_factor_id, '親赤因子1_星数': p1_stars,
-            '親赤因子2_ID': p2_factor_id, '親赤因子2_星数': p2_stars,
-        }
         headers = summary_sheet.row_values(1)
-        
+        cells_to_update = []
+        written = {}
         for header, value in updates.items():
-            if value is not None:
-                col_index = -1
-                try:
-                    col_index = headers.index(header) + 1
-                except ValueError:
-                    # ヘッダーが存在しない場合は、末尾に追加
-                    summary_sheet.update_cell(1, len(headers) + 1, header)
-                    headers.append(header)
-                    col_index = len(headers)
-                
-                summary_sheet.update_cell(cell.row, col_index, str(value))
-        
-        return True
+            if value is None:
+                continue
+            if header not in headers:
+                if not add_missing_headers:
+                    continue
+                # ヘッダーが存在しない場合は、末尾に追加
+                headers.append(header)
+                cells_to_update.append(gspread.Cell(row=1, col=len(headers), value=header))
+            col_index = headers.index(header) + 1
+            cells_to_update.append(gspread.Cell(row=cell.row, col=col_index, value=str(value)))
+            written[header] = value
+
+        if not cells_to_update:
+            return True
+        result = _write_cells(summary_sheet, cells_to_update, write_queue)
+        if result:
+            factor_tables.update_fields(individual_id, written)
+        return result
     except Exception as e:
-        print(f"DB保存中にエラーが発生: {e}")
+        print(f"DB更新中にエラーが発生: {e}")
         traceback.print_exc()
         return False
 
 
-# database.py に追加
+def parent_factor_updates(p1_factor_id, p1_stars, p2_factor_id, p2_stars) -> dict:
+    return {
+        '親赤因子1_ID': p1_factor_id, '親赤因子1_星数': p1_stars,
+        '親赤因子2_ID': p2_factor_id, '親赤因子2_星数': p2_stars,
+    }
+
+
+def owner_updates(user: discord.Member) -> dict:
+    return {'所有者ID': str(user.id), '所有者メモ': f"サーバーメンバー: {user.display_name}"}
+
+
+def save_parent_factors(gspread_client, individual_id, p1_factor_id, p1_stars, p2_factor_id, p2_stars, write_queue=None):
+    """親因子の情報をスプレッドシートに保存する"""
+    updates = parent_factor_updates(p1_factor_id, p1_stars, p2_factor_id, p2_stars)
+    return update_summary_fields(gspread_client, individual_id, updates, write_queue=write_queue, add_missing_headers=True)
+
+
+
+# シート名 → sheetId (シートを作り直さない限り変わらないので覚えておく)
+_sheet_ids: dict[str, int] = {}
+
+
+def _sheet_id(spreadsheet, title: str) -> int:
+    if title not in _sheet_ids:
+        for worksheet in spreadsheet.worksheets():
+            _sheet_ids[worksheet.title] = worksheet.id
+    return _sheet_ids[title]
+
+
+def _locate_from_index(spreadsheet, tables, individual_id: str):
+    """
+    メモリ上の索引から削除対象の行番号を探し、その行が本当に対象の個体かを1回の読み込みで確かめる。
+    (サマリーの行番号リスト, 所有者ID, 因子データの行番号リスト) を返す。食い違っていればNone。
+    """
+    summary_rows = tables.summary_rows(individual_id)
+    # 因子パック形式では、因子データの行はメモリ上にしか無い
+    factor_rows = tables.factor_rows(individual_id) if config.FACTOR_STORAGE == "rows" else []
+    columns = list(tables.all_summary_df.columns)
+    if not summary_rows or '所有者ID' not in columns:
+        return None
+    owner_index = columns.index('所有者ID')
+    owner_letter = gspread.utils.rowcol_to_a1(1, owner_index + 1).rstrip('1')
+
+    ranges = [f"'評価サマリー'!A{row}:{owner_letter}{row}" for row in summary_rows]
+    if factor_rows:
+        ranges.append(f"'因子データ'!A{min(factor_rows)}:A{max(factor_rows)}")
+    value_ranges = spreadsheet.values_batch_get(ranges).get('valueRanges', [])
+
+    owner_id = None
+    for value_range in value_ranges[:len(summary_rows)]:
+        row = (value_range.get('values') or [[]])[0]
+        if not row or str(row[0]) != individual_id:
+            return None
+        if owner_id is None:
+            owner_id = str(row[owner_index]) if len(row) > owner_index else ''
+    if factor_rows:
+        span = value_ranges[len(summary_rows)].get('values', [])
+        found = [min(factor_rows) + i for i, row in enumerate(span) if row and str(row[0]) == individual_id]
+        if found != sorted(factor_rows):
+            return None
+    return summary_rows, owner_id, factor_rows
+
+
+def _fetch_summary_and_factor_ids(spreadsheet):
+    """評価サマリー全体と因子データのA列を1回で読む (因子パック形式なら因子データは読まない)"""
+    if config.FACTOR_STORAGE == "packed":
+        return spreadsheet.values_get("'評価サマリー'").get('values', []), []
+    value_ranges = spreadsheet.values_batch_get(["'評価サマリー'", "'因子データ'!A:A"]).get('valueRanges', [])
+    return [value_range.get('values', []) for value_range in value_ranges]
+
+
+def _locate_from_sheets(spreadsheet, individual_id: str):
+    """索引が使えないときに、評価サマリーと因子データのA列を1回で読んで削除対象の行番号を探す"""
+    summary_values, factor_ids = _fetch_summary_and_factor_ids(spreadsheet)
+    if not summary_values:
+        return [], '', []
+    headers = summary_values[0]
+    owner_index = headers.index('所有者ID') if '所有者ID' in headers else None
+    summary_rows, owner_id = [], ''
+    for i, row in enumerate(summary_values[1:]):
+        if row and str(row[0]) == individual_id:
+            if not summary_rows and owner_index is not None and len(row) > owner_index:
+                owner_id = str(row[owner_index])
+            summary_rows.append(i + 2)
+    factor_rows = [i + 2 for i, row in enumerate(factor_ids[1:]) if row and str(row[0]) == individual_id]
+    return summary_rows, owner_id, factor_rows
+
+
+def _tombstone_rows(spreadsheet, summary_rows: list[int]):
+    """評価サマリーの指定した行に、削除済みの印を付ける (列が無ければ見出しも足す)"""
+    headers = (spreadsheet.values_get("'評価サマリー'!1:1").get('values') or [[]])[0]
+    data = []
+    if factor_tables.TOMBSTONE_COLUMN not in headers:
+        headers.append(factor_tables.TOMBSTONE_COLUMN)
+        # 見出しがシートの右端まで埋まっていると書き込めないので、先に列を足す
+        summary_sheet = spreadsheet.worksheet('評価サマリー')
+        if len(headers) > summary_sheet.col_count:
+            summary_sheet.add_cols(len(headers) - summary_sheet.col_count)
+        data.append({'range': f"'評価サマリー'!{gspread.utils.rowcol_to_a1(1, len(headers))}", 'values': [[factor_tables.TOMBSTONE_COLUMN]]})
+    col_index = headers.index(factor_tables.TOMBSTONE_COLUMN) + 1
+    for row in summary_rows:
+        data.append({'range': f"'評価サマリー'!{gspread.utils.rowcol_to_a1(row, col_index)}", 'values': [['TRUE']]})
+    spreadsheet.values_batch_update({'valueInputOption': 'USER_ENTERED', 'data': data})
+
+
+def _delete_row_requests(sheet_id: int, rows: list[int]) -> list[dict]:
+    """行番号のリストを、下から順に消すdeleteDimensionのリストにする (連続した行は1つにまとめる)"""
+    requests = []
+    for row in sorted(set(rows), reverse=True):
+        if requests and requests[-1]['deleteDimension']['range']['startIndex'] == row:
+            requests[-1]['deleteDimension']['range']['startIndex'] = row - 1
+            continue
+        requests.append({
+            "deleteDimension": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "dimension": "ROWS",
+                    "startIndex": row - 1,  # APIは0から始まるので-1する
+                    "endIndex": row
+                }
+            }
+        })
+    return requests
+
 
 def delete_factor_by_id(gspread_client, individual_id: str, user_id: int, is_admin: bool):
     """
     指定された個体IDの因子をデータベースから削除する。
     所有者本人か管理者のみ削除可能。
+    行の特定はメモリ上の索引で行い、両シートの行削除は1回のbatch_updateで送る。
+    config.SOFT_DELETEがTrueなら行は消さずに削除済みの印だけ付け、実際の削除はcompact_deleted_rowsに任せる。
     """
     try:
         spreadsheet = gspread_client.open_by_key(config.SPREADSHEET_KEY)
-        summary_sheet = spreadsheet.worksheet("評価サマリー")
-        factors_sheet = spreadsheet.worksheet("因子データ")
 
-        # サマリーシートから該当行を検索
-        summary_records = summary_sheet.get_all_records(numericise_ignore=['all'])
-        summary_df = pd.DataFrame(summary_records)
-        
-        target_row = summary_df[summary_df['個体ID'] == individual_id]
+        tables = factor_tables.current()
+        located = _locate_from_index(spreadsheet, tables, individual_id) if tables is not None else None
+        if located is None:
+            located = _locate_from_sheets(spreadsheet, individual_id)
+        summary_rows, owner_id, factor_rows = located
 
-        if target_row.empty:
+        if not summary_rows:
             return False, "指定されたIDの因子が見つかりませんでしたわ。"
 
-        owner_id = str(target_row.iloc[0].get('所有者ID', ''))
-
         # 権限チェック
         if not is_admin and owner_id != str(user_id):
             return False, "ご自身の因子以外は削除できませんことよ。"
 
+        if config.SOFT_DELETE:
+            # 行をずらさないように、印を付けるだけにしておく
+            _tombstone_rows(spreadsheet, summary_rows)
+            factor_tables.mark_deleted([individual_id])
+            print(f"個体ID '{individual_id}' に削除済みの印を付けました。")
+            return True, f"個体ID `{individual_id}` の因子を削除いたしましたわ。"
+
         # --- 削除処理 ---
-        # 1. サマリーシートから削除
-        # gspreadは行番号でしか削除できないため、該当行のインデックスを探す
-        cell = summary_sheet.find(individual_id)
-        if cell:
-            summary_sheet.delete_rows(cell.row)
-            print(f"サマリーシートから個体ID '{individual_id}' を削除しました。")
-        else:
-            # 見つからなくても因子データは消しに行く
-            print(f"警告: サマリーシートで個体ID '{individual_id}' が見つかりませんでした。")
+        # 1回のリクエストで、両シートの行をまとめて削除する
+        batch_delete_requests = _delete_row_requests(_sheet_id(spreadsheet, "評価サマリー"), summary_rows)
+        batch_delete_requests += _delete_row_requests(_sheet_id(spreadsheet, "因子データ"), factor_rows)
+        spreadsheet.batch_update({'requests': batch_delete_requests})
 
+        # 読み込み直さずに、メモリ上の内容と索引も更新しておく
+        factor_tables.remove_individuals([individual_id])
 
-        # 2. 因子データシートから関連データをすべて削除
-        factor_records = factors_sheet.get_all_records(numericise_ignore=['all'])
-        factor_df = pd.DataFrame(factor_records)
-        
-        # 削除対象の行インデックスをリストアップ（逆順にしておくのが安全）
-        rows_to_delete = factor_df[factor_df['個体ID'] == individual_id].index.tolist()
-        # gspreadの行番号は1から始まり、ヘッダー行があるので+2する
-        # 削除対象の行インデックスをリストアップ（gspreadの行番号は1から、ヘッダー行があるので+2）
-        rows_to_delete = factor_df[factor_df['個体ID'] == individual_id].index.tolist()
-        gspread_rows_to_delete = sorted([i + 2 for i in rows_to_delete], reverse=True)
-
-        if not gspread_rows_to_delete:
+        if not factor_rows:
             print(f"警告: 因子データシートで個体ID '{individual_id}' のデータが見つかりませんでした。")
-            return True, f"個体ID `{individual_id}` の因子を削除いたしましたわ。"
-
-        # ▼▼▼ こっから下が修正箇所や！ ▼▼▼
-
-        # バッチ処理で一括削除する
-        batch_delete_requests = []
-        sheet_id = factors_sheet._properties['sheetId'] # シートの固有IDを取得
-
-        for row_num in gspread_rows_to_delete:
-            batch_delete_requests.append({
-                "deleteDimension": {
-                    "range": {
-                        "sheetId": sheet_id,
-                        "dimension": "ROWS",
-                        "startIndex": row_num - 1,  # APIは0から始まるので-1する
-                        "endIndex": row_num
-                    }
-                }
-            })
-        
-        # 1回のリクエストでまとめて削除依頼を出す
-        if batch_delete_requests:
-            spreadsheet.batch_update({'requests': batch_delete_requests})
-
-        print(f"因子データシートから個体ID '{individual_id}' の関連データを {len(gspread_rows_to_delete)} 件削除しました。")
+        print(f"個体ID '{individual_id}' を削除しました (サマリー {len(summary_rows)} 行, 因子データ {len(factor_rows)} 行)。")
 
         return True, f"個体ID `{individual_id}` の因子を削除いたしましたわ。"
     except Exception as e:
@@ -295,77 +536,303 @@ def delete_factor_by_id(gspread_client, individual_id: str, user_id: int, is_adm
         return False, f"削除中にエラーが発生いたしました: {e}"        
 
 
-def update_owner(gspread_client, individual_id: str, user: discord.Member):
+def compact_deleted_rows(gspread_client) -> int:
+    """
+    削除済みの印が付いた個体の行を、評価サマリーと因子データの両方から1回のbatch_updateでまとめて削除する。
+    行番号がずれるので、書き込みキューが空の、利用の少ない時間に実行すること。削除した個体の数を返す。
+    """
+    spreadsheet = gspread_client.open_by_key(config.SPREADSHEET_KEY)
+    summary_values, factor_ids = _fetch_summary_and_factor_ids(spreadsheet)
+    if not summary_values or factor_tables.TOMBSTONE_COLUMN not in summary_values[0]:
+        return 0
+    flag_index = summary_values[0].index(factor_tables.TOMBSTONE_COLUMN)
+
+    deleted_ids, summary_rows = set(), []
+    for i, row in enumerate(summary_values[1:]):
+        if len(row) > flag_index and str(row[flag_index]).strip().upper() in ('TRUE', '1'):
+            summary_rows.append(i + 2)
+            if row:
+                deleted_ids.add(str(row[0]))
+    if not summary_rows:
+        return 0
+    factor_rows = [i + 2 for i, row in enumerate(factor_ids[1:]) if row and str(row[0]) in deleted_ids]
+
+    requests = _delete_row_requests(_sheet_id(spreadsheet, "評価サマリー"), summary_rows)
+    requests += _delete_row_requests(_sheet_id(spreadsheet, "因子データ"), factor_rows)
+    spreadsheet.batch_update({'requests': requests})
+    factor_tables.remove_individuals(deleted_ids)
+    print(f"削除済みの {len(summary_rows)} 件を整理しました (因子データ {len(factor_rows)} 行)。")
+    return len(summary_rows)
+
+
+ARCHIVE_SUMMARY_SHEET = "評価サマリー(アーカイブ)"
+ARCHIVE_FACTORS_SHEET = "因子データ(アーカイブ)"
+
+
+def _values_to_frame(values: list) -> pd.DataFrame:
+    """シートの値(先頭行がヘッダー)を、数値に変換せずそのままDataFrameにする"""
+    if not values:
+        return pd.DataFrame()
+    values = gspread.utils.fill_gaps(values)
+    return pd.DataFrame(values[1:], columns=values[0])
+
+
+def _is_archivable(row: list, headers: list, cutoff: datetime) -> bool:
+    def value(col):
+        return str(row[headers.index(col)]).strip() if col in headers and len(row) > headers.index(col) else ''
+    # 削除済みの個体は整理に任せる
+    if value(factor_tables.TOMBSTONE_COLUMN).upper() in ('TRUE', '1'):
+        return False
+    if value(config.ARCHIVE_RELEASED_COLUMN).upper() in ('TRUE', '1'):
+        return True
     try:
-        spreadsheet = gspread_client.open("因子評価データベース")
-        summary_sheet = spreadsheet.worksheet("評価サマリー")
-        cell = summary_sheet.find(individual_id, in_column=1)
-        if not cell:
-            return False # 因子が見つからなかった
-
-        headers = summary_sheet.row_values(1)
-        owner_id_col = headers.index('所有者ID') + 1
-        owner_memo_col = headers.index('所有者メモ') + 1
-        
-        cells_to_update = [
-            gspread.Cell(row=cell.row, col=owner_id_col, value=str(user.id)),
-            gspread.Cell(row=cell.row, col=owner_memo_col, value=f"サーバーメンバー: {user.display_name}")
-        ]
-        summary_sheet.update_cells(cells_to_update)
-        return True # 成功
-    except Exception as e:
-        print(f"DBオーナー更新中にエラー: {e}")
-        traceback.print_exc()
+        return datetime.strptime(value('投稿日時'), '%Y-%m-%d %H:%M:%S') < cutoff
+    except ValueError:
         return False
 
 
-def recalculate_all_scores(gspread_client, score_sheets: dict):
+def archive_individuals(gspread_client, older_than_days: int) -> int:
+    """
+    登録から指定日数が過ぎた個体と放出済みの個体を、アーカイブ用のシートへまとめて移す。
+    アーカイブに追記してから、元のシートの行を1回のbatch_updateで削除する。移した個体の数を返す。
+    """
+    spreadsheet = gspread_client.open_by_key(config.SPREADSHEET_KEY)
+    packed = config.FACTOR_STORAGE == "packed"
+    ranges = ["'評価サマリー'"] if packed else ["'評価サマリー'", "'因子データ'"]
+    value_ranges = [r.get('values', []) for r in spreadsheet.values_batch_get(ranges).get('valueRanges', [])]
+    summary_values = value_ranges[0]
+    factor_values = [] if packed else value_ranges[1]
+    if len(summary_values) < 2:
+        return 0
+
+    headers = summary_values[0]
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    summary_rows = [i + 2 for i, row in enumerate(summary_values[1:]) if row and _is_archivable(row, headers, cutoff)]
+    if not summary_rows:
+        return 0
+    archived_ids = {str(summary_values[row - 1][0]) for row in summary_rows}
+    factor_rows = [i + 2 for i, row in enumerate(factor_values[1:]) if row and str(row[0]) in archived_ids]
+
+    # アーカイブ用のシートが無ければ作り、見出しに無い列を足す
+    worksheets = {worksheet.title: worksheet for worksheet in spreadsheet.worksheets()}
+    for title in ([ARCHIVE_SUMMARY_SHEET] if packed else [ARCHIVE_SUMMARY_SHEET, ARCHIVE_FACTORS_SHEET]):
+        if title not in worksheets:
+            worksheets[title] = spreadsheet.add_worksheet(title=title, rows=1, cols=max(26, len(headers)))
+    archive_summary = worksheets[ARCHIVE_SUMMARY_SHEET]
+    archive_headers = archive_summary.row_values(1)
+    new_headers = archive_headers + [h for h in headers if h not in archive_headers]
+    if new_headers != archive_headers:
+        if len(new_headers) > archive_summary.col_count:
+            archive_summary.add_cols(len(new_headers) - archive_summary.col_count)
+        archive_summary.update(range_name='A1', values=[new_headers])
+
+    # 見出しの並びが違っても列名で合わせて書き込む。値は読んだ文字列のまま (RAW) 書く
+    summary_rows_to_append = []
+    for row in summary_rows:
+        record = dict(zip(headers, summary_values[row - 1]))
+        summary_rows_to_append.append([record.get(h, '') for h in new_headers])
+    archive_summary.append_rows(summary_rows_to_append, value_input_option='RAW')
+    if factor_rows:
+        archive_factors = worksheets[ARCHIVE_FACTORS_SHEET]
+        rows_to_append = [factor_values[row - 1] for row in factor_rows]
+        if not archive_factors.row_values(1):
+            rows_to_append.insert(0, factor_values[0])
+        archive_factors.append_rows(rows_to_append, value_input_option='RAW')
+
+    requests = _delete_row_requests(_sheet_id(spreadsheet, "評価サマリー"), summary_rows)
+    if factor_rows:
+        requests += _delete_row_requests(_sheet_id(spreadsheet, "因子データ"), factor_rows)
+    spreadsheet.batch_update({'requests': requests})
+
+    factor_tables.remove_individuals(archived_ids)
+    factor_tables.clear_archive()
+    print(f"{len(summary_rows)}件 (因子データ {len(factor_rows)}行) をアーカイブへ移しました。")
+    return len(summary_rows)
+
+
+def get_archive_database(gspread_client):
+    """アーカイブ用のシートを読み込み、型変換済みの2つのDataFrameを返す。シートが無ければ空のDataFrame"""
+    spreadsheet = gspread_client.open_by_key(config.SPREADSHEET_KEY)
+    titles = {worksheet.title for worksheet in spreadsheet.worksheets()}
+    if ARCHIVE_SUMMARY_SHEET not in titles:
+        tables = factor_tables.publish_archive(pd.DataFrame(), pd.DataFrame())
+        return tables.summary_df, tables.factors_df
+
+    packed = config.FACTOR_STORAGE == "packed" or ARCHIVE_FACTORS_SHEET not in titles
+    ranges = [f"'{ARCHIVE_SUMMARY_SHEET}'"] if packed else [f"'{ARCHIVE_SUMMARY_SHEET}'", f"'{ARCHIVE_FACTORS_SHEET}'"]
+    value_ranges = [r.get('values', []) for r in spreadsheet.values_batch_get(ranges).get('valueRanges', [])]
+    summary_records = _values_to_frame(value_ranges[0])
+    if not packed:
+        factors_records = _values_to_frame(value_ranges[1])
+    elif factor_codec.PACKED_COLUMN in summary_records.columns:
+        factors_records = factor_codec.unpack_column(summary_records['個体ID'], summary_records[factor_codec.PACKED_COLUMN])
+    else:
+        factors_records = pd.DataFrame()
+    tables = factor_tables.publish_archive(
+        factor_tables.apply_summary_schema(summary_records),
+        factor_tables.apply_factors_schema(factors_records)
+    )
+    print(f"アーカイブから {len(tables.summary_df)}件を読み込みました。")
+    return tables.summary_df, tables.factors_df
+
+
+def update_owner(gspread_client, individual_id: str, user: discord.Member, write_queue=None):
+    return update_summary_fields(gspread_client, individual_id, owner_updates(user), write_queue=write_queue, add_missing_headers=True)
+
+
+def _score_column_ranges(col_index: int, changed_rows: list[int], values: list[int], total_rows: int) -> list[dict]:
+    """
+    1列分の変更を、values_batch_update用の範囲リストにする。
+    変更が列の半分を超える場合は、列全体を1つの範囲として書き込む。
+    changed_rowsはデータ行の0始まりの位置 (シート上の行番号は+2)。
+    """
+    col_letter = gspread.utils.rowcol_to_a1(1, col_index).rstrip('1')
+    if len(changed_rows) * 2 > total_rows:
+        return [{'range': f"'評価サマリー'!{col_letter}2:{col_letter}{total_rows + 1}", 'values': [[v] for v in values]}]
+    return [
+        {'range': f"'評価サマリー'!{col_letter}{row + 2}", 'values': [[values[row]]]}
+        for row in changed_rows
+    ]
+
+
+def recalculate_all_scores(gspread_client, score_sheets: dict, sheet_names: list = None):
+    """
+    全個体のスコアを採点簿で計算し直し、値が変わったセルだけを書き込む。
+    シートを一度も空にしないので、再計算中に読み込んだ人にも表が見えている。
+    sheet_namesを指定した場合は、その採点簿の列だけを計算し直す (不要な列の削除も行わない)。
+    """
     try:
         spreadsheet = gspread_client.open("因子評価データベース")
         summary_sheet = spreadsheet.worksheet("評価サマリー")
-        factors_sheet = spreadsheet.worksheet("因子データ")
-        
-        summary_data = summary_sheet.get_all_records(numericise_ignore=['all'])
-        factors_data = factors_sheet.get_all_records(numericise_ignore=['all'])
-        
-        if not summary_data or not factors_data:
+
+        summary_values = summary_sheet.get_all_values()
+        if len(summary_values) < 2:
             return 0
 
-        factors_by_id = defaultdict(list)
-        for factor in factors_data:
-            factors_by_id[factor['個体ID']].append(factor)
+        summary_headers = summary_values[0]
+        width = len(summary_headers)
+        summary_rows = [row + [''] * (width - len(row)) for row in summary_values[1:]]
+        summary_df = pd.DataFrame(summary_rows, columns=summary_headers)
+        individual_ids = summary_df['個体ID'].astype(str)
 
-        updated_data = []
-        summary_headers = summary_sheet.row_values(1)
-        
-        # 不要なスコアシート列をヘッダーから削除
-        score_sheet_cols = [h for h in summary_headers if h.startswith('合計(')]
-        for h in score_sheet_cols:
-            if h.replace('合計(', '')[:-1] not in score_sheets:
-                summary_headers.remove(h)
-        
-        # 必要なスコアシート列をヘッダーに追加
-        for sheet_name in score_sheets.keys():
-            if f"合計({sheet_name})" not in summary_headers:
-                summary_headers.append(f"合計({sheet_name})")
-
-        for summary_row in summary_data:
-            individual_id = summary_row['個体ID']
-            current_factors = factors_by_id.get(individual_id, [])
-            for sheet_name, score_sheet in score_sheets.items():
-                total_score = sum(score_sheet.get(str(f['因子ID']), 0) * int(f['星の数']) for f in current_factors if str(f['因子ID']) in score_sheet and str(f['星の数']).isdigit())
-                summary_row[f"合計({sheet_name})"] = total_score
-            
-            # ヘッダーの順序に合わせて行データを作成
-            updated_data.append([summary_row.get(h, "") for h in summary_headers])
-
-        summary_sheet.clear()
-        summary_sheet.update(range_name='A1', values=[summary_headers])
-        if updated_data:
-            summary_sheet.update(range_name='A2', values=updated_data)
-            
-        return len(summary_data)
+        if config.FACTOR_STORAGE == "packed":
+            if factor_codec.PACKED_COLUMN not in summary_df.columns:
+                return 0
+            factors_df = factor_codec.unpack_column(individual_ids, summary_df[factor_codec.PACKED_COLUMN])
+        else:
+            factors_df = pd.DataFrame(spreadsheet.worksheet("因子データ").get_all_records(numericise_ignore=['all']))
+        if factors_df.empty:
+            return 0
+
+        # 全個体の合計点を、採点簿の点数行列との積で一度に出す
+        totals = score_sheets.score_factors_df(factors_df, individual_ids)
+        target_sheets = list(score_sheets.keys()) if sheet_names is None else [n for n in sheet_names if n in score_sheets]
+
+        # 必要なスコアシート列をヘッダーの末尾に追加
+        header_cells = []
+        for sheet_name in target_sheets:
+            col_name = f"合計({sheet_name})"
+            if col_name not in summary_headers:
+                summary_headers.append(col_name)
+                header_cells.append({'range': f"'評価サマリー'!{gspread.utils.rowcol_to_a1(1, len(summary_headers))}", 'values': [[col_name]]})
+        if len(summary_headers) > summary_sheet.col_count:
+            summary_sheet.add_cols(len(summary_headers) - summary_sheet.col_count)
+
+        data = list(header_cells)
+        total_rows = len(summary_df)
+        changed_count = 0
+        for sheet_name in target_sheets:
+            col_name = f"合計({sheet_name})"
+            new_scores = totals[sheet_name].to_numpy()
+            if col_name in summary_df.columns:
+                # 空欄や数値でないセル(NaN)は、必ず書き直す対象になる
+                stored = pd.to_numeric(summary_df[col_name], errors='coerce').to_numpy()
+                changed = stored != new_scores
+            else:
+                changed = np.ones(total_rows, dtype=bool)
+            changed_rows = changed.nonzero()[0].tolist()
+            if not changed_rows:
+                continue
+            changed_count += len(changed_rows)
+            data.extend(_score_column_ranges(summary_headers.index(col_name) + 1, changed_rows, new_scores.tolist(), total_rows))
+
+        chunk_size = config.RECALC_BATCH_RANGES
+        for i in range(0, len(data), chunk_size):
+            spreadsheet.values_batch_update({'valueInputOption': 'USER_ENTERED', 'data': data[i:i + chunk_size]})
+
+        # 採点簿が無くなった列は、列ごと1回のリクエストで削除する (右から消してずれを防ぐ)
+        sheet_id = summary_sheet.id
+        stale_cols = []
+        if sheet_names is None:
+            stale_cols = sorted(
+                [i for i, h in enumerate(summary_headers) if h.startswith('合計(') and h[len('合計('):-1] not in score_sheets],
+                reverse=True
+            )
+        if stale_cols:
+            spreadsheet.batch_update({'requests': [
+                {"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "COLUMNS", "startIndex": i, "endIndex": i + 1}}}
+                for i in stale_cols
+            ]})
+
+        print(f"スコア再計算: {total_rows}件中 {changed_count}セルを更新、不要な列を{len(stale_cols)}件削除しました。")
+        return total_rows
     except Exception as e:
         print(f"スコア再計算中にエラーが発生: {e}")
         traceback.print_exc()
-        raise e # エラーを呼び出し元に伝える                
\ No newline at end of file
+        raise e # エラーを呼び出し元に伝える
+
+
+def pack_factor_rows(gspread_client) -> int:
+    """
+    因子データシートの内容を、評価サマリーの因子パック列に書き写す (rows → packed の変換)。
+    因子データシートはそのまま残す。書き込んだ個体の数を返す。
+    """
+    spreadsheet = gspread_client.open_by_key(config.SPREADSHEET_KEY)
+    summary_values, factor_values = [
+        value_range.get('values', [])
+        for value_range in spreadsheet.values_batch_get(["'評価サマリー'", "'因子データ'"]).get('valueRanges', [])
+    ]
+    if len(summary_values) < 2:
+        return 0
+    packed = factor_codec.pack_frame(pd.DataFrame(_values_to_records(factor_values)))
+
+    headers = summary_values[0]
+    data = []
+    if factor_codec.PACKED_COLUMN not in headers:
+        headers.append(factor_codec.PACKED_COLUMN)
+    col_letter = gspread.utils.rowcol_to_a1(1, headers.index(factor_codec.PACKED_COLUMN) + 1).rstrip('1')
+    column = [[factor_codec.PACKED_COLUMN]] + [[packed.get(str(row[0]), '') if row else ''] for row in summary_values[1:]]
+    data.append({'range': f"'評価サマリー'!{col_letter}1:{col_letter}{len(column)}", 'values': column})
+
+    summary_sheet = spreadsheet.worksheet("評価サマリー")
+    if len(headers) > summary_sheet.col_count:
+        summary_sheet.add_cols(len(headers) - summary_sheet.col_count)
+    # 数字だけの因子IDが数値に変わらないよう、RAWで書き込む
+    spreadsheet.values_batch_update({'valueInputOption': 'RAW', 'data': data})
+    print(f"因子データ {len(factor_values) - 1}行を、{len(packed)}個体分の因子パックにまとめました。")
+    return len(packed)
+
+
+def unpack_factor_rows(gspread_client, factor_dictionary: dict) -> int:
+    """
+    評価サマリーの因子パック列から、因子データシートを作り直す (packed → rows の変換)。
+    因子名と種類は因子辞書から補う。書き込んだ行数を返す。
+    """
+    spreadsheet = gspread_client.open_by_key(config.SPREADSHEET_KEY)
+    summary_values = spreadsheet.values_get("'評価サマリー'").get('values', [])
+    records = pd.DataFrame(_values_to_records(summary_values))
+    if records.empty or factor_codec.PACKED_COLUMN not in records.columns:
+        return 0
+    factors_df = factor_codec.unpack_column(records['個体ID'], records[factor_codec.PACKED_COLUMN])
+
+    rows = [FACTOR_SHEET_HEADERS]
+    for individual_id, factor_id, stars in zip(factors_df['個体ID'], factors_df['因子ID'], factors_df['星の数']):
+        factor_info = factor_dictionary.get(factor_id, {'name': '不明な因子', 'type': '不明'})
+        rows.append([individual_id, factor_id, factor_info['name'], factor_info['type'], int(stars)])
+
+    factors_sheet = spreadsheet.worksheet("因子データ")
+    factors_sheet.clear()
+    factors_sheet.resize(rows=len(rows), cols=len(FACTOR_SHEET_HEADERS))
+    factors_sheet.update(range_name='A1', values=rows, value_input_option='RAW')
+    print(f"因子パックから、因子データ {len(rows) - 1}行を作り直しました。")
+    return len(rows) - 1
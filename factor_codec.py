@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+# 因子リストをまとめて入れておく、評価サマリーの列
+PACKED_COLUMN = '因子パック'
+
+
+def pack_factors(pairs) -> str:
+    """[(因子ID, 星数), ...] を 'ID:星;ID:星' 形式の1つの文字列にする"""
+    return ';'.join(f"{factor_id}:{int(stars)}" for factor_id, stars in pairs)
+
+
+def unpack_column(individual_ids, packed_values) -> pd.DataFrame:
+    """
+    評価サマリーの個体IDと因子パックの列から、因子データと同じ形 (個体ID・因子ID・星の数) のDataFrameを作る。
+    1行ずつ処理せずに、列全体をまとめて分解する。
+    """
+    packed = pd.Series(np.asarray(packed_values, dtype=object), index=pd.Index(individual_ids, dtype=object).astype(str))
+    packed = packed[packed.notna()].astype(str)
+    entries = packed[packed != ''].str.split(';').explode()
+    entries = entries[entries.notna() & (entries != '')]
+    if entries.empty:
+        return pd.DataFrame({'個体ID': pd.Series(dtype=str), '因子ID': pd.Series(dtype=str), '星の数': pd.Series(dtype='int8')})
+    parts = entries.str.rpartition(':')
+    return pd.DataFrame({
+        '個体ID': entries.index.to_numpy(),
+        '因子ID': parts[0].to_numpy(),
+        '星の数': pd.to_numeric(parts[2], errors='coerce').fillna(0).to_numpy(dtype=np.int8),
+    })
+
+
+def pack_frame(factors_df: pd.DataFrame) -> dict:
+    """因子データのDataFrameを、{個体ID: 因子パック} の辞書にする (因子の並び順はそのまま)"""
+    if factors_df.empty:
+        return {}
+    ids = factors_df['個体ID'].astype(str).to_numpy()
+    factor_ids = factors_df['因子ID'].astype(str).to_numpy()
+    stars = pd.to_numeric(factors_df['星の数'], errors='coerce').fillna(0).astype(int).to_numpy()
+    packed = {}
+    for individual_id, factor_id, star in zip(ids, factor_ids, stars):
+        packed.setdefault(individual_id, []).append((factor_id, star))
+    return {individual_id: pack_factors(pairs) for individual_id, pairs in packed.items()}
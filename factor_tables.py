@@ -0,0 +1,352 @@
+import functools
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# 値の種類が少ない列は、カテゴリ型にしてメモリを節約する
+SUMMARY_CATEGORY_COLUMNS = ['キャラ名', '所有者ID', '用途', '親赤因子1_ID', '親赤因子2_ID']
+FACTORS_CATEGORY_COLUMNS = ['因子ID', '因子名', '因子の種類']
+STAR_COLUMNS = ['親赤因子1_星数', '親赤因子2_星数']
+# 削除済みの印を付ける列
+TOMBSTONE_COLUMN = '削除済み'
+RED_FACTOR_TYPE = '赤因子'
+PARENT_COLUMNS = [('親赤因子1_ID', '親赤因子1_星数'), ('親赤因子2_ID', '親赤因子2_星数')]
+
+
+def _to_int(series: pd.Series, dtype: str) -> pd.Series:
+    return pd.to_numeric(series, errors='coerce').fillna(0).astype(dtype)
+
+
+def apply_summary_schema(summary_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    シートから読んだ文字列だけの評価サマリーを、読み込み時に一度だけ型変換する。
+    星数はint8、合計スコアはint32 (空欄は0点)、個体IDは文字列になる。
+    """
+    if summary_df.empty:
+        return summary_df
+    if '個体ID' in summary_df.columns:
+        summary_df['個体ID'] = summary_df['個体ID'].astype(str)
+    for col in summary_df.columns:
+        if col.startswith('合計('):
+            summary_df[col] = _to_int(summary_df[col], 'int32')
+    for col in STAR_COLUMNS:
+        if col in summary_df.columns:
+            summary_df[col] = _to_int(summary_df[col], 'int8')
+    for col in SUMMARY_CATEGORY_COLUMNS:
+        if col in summary_df.columns:
+            summary_df[col] = summary_df[col].astype('category')
+    if TOMBSTONE_COLUMN in summary_df.columns:
+        summary_df[TOMBSTONE_COLUMN] = summary_df[TOMBSTONE_COLUMN].astype(str).str.strip().str.upper().isin(['TRUE', '1'])
+    return summary_df
+
+
+def apply_factors_schema(factors_df: pd.DataFrame) -> pd.DataFrame:
+    """シートから読んだ文字列だけの因子データを、読み込み時に一度だけ型変換する"""
+    if factors_df.empty:
+        return factors_df
+    if '個体ID' in factors_df.columns:
+        factors_df['個体ID'] = factors_df['個体ID'].astype(str)
+    if '星の数' in factors_df.columns:
+        factors_df['星の数'] = _to_int(factors_df['星の数'], 'int8')
+    for col in FACTORS_CATEGORY_COLUMNS:
+        if col in factors_df.columns:
+            factors_df[col] = factors_df[col].astype(str).astype('category')
+    return factors_df
+
+
+class RedStarTotals:
+    """
+    評価サマリーの行ごと・赤因子ごとの星数の合計。
+    parent は親2体の合計、overall は本体 + 親2体の合計で、どちらも (行数, 赤因子の数) のint8の配列。
+    対象の赤因子は、親の赤因子として登録されたものと、因子の種類が赤因子のもの。
+    """
+    def __init__(self, factor_ids: list, parent: np.ndarray, overall: np.ndarray):
+        self.factor_ids = list(factor_ids)
+        self.columns = {factor_id: j for j, factor_id in enumerate(self.factor_ids)}
+        self.parent = parent
+        self.overall = overall
+
+    @classmethod
+    def build(cls, summary_df: pd.DataFrame, factors_df: pd.DataFrame) -> 'RedStarTotals':
+        factor_ids = set()
+        for id_col, _ in PARENT_COLUMNS:
+            if id_col in summary_df.columns:
+                factor_ids.update(summary_df[id_col].astype(str).unique())
+        if '因子の種類' in factors_df.columns:
+            factor_ids.update(factors_df.loc[factors_df['因子の種類'].astype(str) == RED_FACTOR_TYPE, '因子ID'].astype(str).unique())
+        factor_ids.discard('')
+        factor_ids = sorted(factor_ids)
+        columns = pd.Index(factor_ids)
+        parent = np.zeros((len(summary_df), len(factor_ids)), dtype=np.int8)
+        for id_col, star_col in PARENT_COLUMNS:
+            if id_col not in summary_df.columns:
+                continue
+            codes = columns.get_indexer(summary_df[id_col].astype(str).to_numpy())
+            rows = np.flatnonzero(codes >= 0)
+            if star_col in summary_df.columns:
+                np.add.at(parent, (rows, codes[rows]), _to_int(summary_df[star_col], 'int8').to_numpy()[rows])
+
+        # 本体の星数は個体IDごとに最大値を取り、同じ個体IDの行すべてに足す
+        body = np.zeros_like(parent)
+        if factor_ids and not factors_df.empty and '個体ID' in summary_df.columns:
+            row_ids = summary_df['個体ID'].astype(str).to_numpy()
+            unique_ids = pd.Index(pd.unique(row_ids))
+            codes = columns.get_indexer(factors_df['因子ID'].astype(str).to_numpy())
+            owners = unique_ids.get_indexer(factors_df['個体ID'].astype(str).to_numpy())
+            keep = (codes >= 0) & (owners >= 0)
+            by_id = np.zeros((len(unique_ids), len(factor_ids)), dtype=np.int8)
+            np.maximum.at(by_id, (owners[keep], codes[keep]), _to_int(factors_df['星の数'], 'int8').to_numpy()[keep])
+            body = by_id[unique_ids.get_indexer(row_ids)]
+        return cls(factor_ids, parent, parent + body)
+
+    def _copy_covering(self, factor_ids) -> 'RedStarTotals | None':
+        """
+        書き換え用のコピーを返す。まだ列の無い赤因子が含まれるときはNoneを返す。
+        新しい列には既存の行の本体の星数も入れる必要があるので、その場合は全体を作り直してもらう。
+        """
+        if any(f and f not in self.columns for f in factor_ids):
+            return None
+        return RedStarTotals(self.factor_ids, self.parent.copy(), self.overall.copy())
+
+    def appended(self, summary_row: dict, factor_rows: list) -> 'RedStarTotals | None':
+        """
+        1体分の行 (因子データの行は [個体ID, 因子ID, 因子名, 因子の種類, 星の数]) を末尾に足したものを返す。
+        新しい赤因子が出てきたときは、作り直しが必要なのでNoneを返す。
+        """
+        red_rows = [row for row in factor_rows if str(row[3]) == RED_FACTOR_TYPE or str(row[1]) in self.columns]
+        parents = [(str(summary_row.get(id_col) or ''), int(summary_row.get(star_col) or 0)) for id_col, star_col in PARENT_COLUMNS]
+        totals = self._copy_covering([str(row[1]) for row in red_rows] + [factor_id for factor_id, _ in parents])
+        if totals is None:
+            return None
+        parent = np.zeros((1, len(totals.factor_ids)), dtype=np.int8)
+        for factor_id, stars in parents:
+            if factor_id:
+                parent[0, totals.columns[factor_id]] += stars
+        body = np.zeros_like(parent)
+        for row in red_rows:
+            j = totals.columns[str(row[1])]
+            body[0, j] = max(body[0, j], int(row[4] or 0))
+        return RedStarTotals(totals.factor_ids, np.vstack([totals.parent, parent]), np.vstack([totals.overall, parent + body]))
+
+    def with_parents(self, rows, parents: list) -> 'RedStarTotals | None':
+        """指定した行の親の赤因子を [(因子ID, 星数), (因子ID, 星数)] に置き換えたものを返す (新しい赤因子ならNone)"""
+        totals = self._copy_covering([str(factor_id or '') for factor_id, _ in parents])
+        if totals is None:
+            return None
+        parent = np.zeros(len(totals.factor_ids), dtype=np.int8)
+        for factor_id, stars in parents:
+            if factor_id:
+                parent[totals.columns[str(factor_id)]] += int(stars or 0)
+        rows = np.asarray(rows, dtype=np.int64)
+        totals.overall[rows] += parent - totals.parent[rows]
+        totals.parent[rows] = parent
+        return totals
+
+    def reduce_rows(self, row_positions: np.ndarray, size: int) -> 'RedStarTotals':
+        """同じ個体IDの行が複数あるとき、個体ごとの最大値にまとめる"""
+        parent = np.zeros((size, len(self.factor_ids)), dtype=np.int8)
+        overall = np.zeros_like(parent)
+        np.maximum.at(parent, row_positions, self.parent)
+        np.maximum.at(overall, row_positions, self.overall)
+        return RedStarTotals(self.factor_ids, parent, overall)
+
+
+class FactorTables:
+    """
+    ある時点での評価サマリーと因子データの内容。
+    複数の処理から共有されるので、中のDataFrameは読み取り専用として扱うこと。
+    all_summary_df / all_factors_df はシートの行そのままで、削除済みの個体も含む。
+    summary_df / factors_df は削除済みの個体を除いたもので、検索などはこちらを使う。
+    """
+    def __init__(self, summary_df, factors_df, version: int, loaded_at: float, source: str):
+        self.all_summary_df = summary_df
+        self.all_factors_df = factors_df
+        self.summary_df = summary_df
+        self.factors_df = factors_df
+        if TOMBSTONE_COLUMN in summary_df.columns and summary_df[TOMBSTONE_COLUMN].any():
+            deleted = summary_df[TOMBSTONE_COLUMN].astype(bool)
+            self.summary_df = summary_df[~deleted]
+            if '個体ID' in factors_df.columns:
+                self.factors_df = factors_df[~factors_df['個体ID'].isin(set(summary_df.loc[deleted, '個体ID']))]
+        self.version = version
+        self.loaded_at = loaded_at
+        self.source = source
+        # 個体ID → 評価サマリーの行位置
+        self.id_index = pd.Index(summary_df['個体ID'] if '個体ID' in summary_df.columns else [], dtype=object)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.loaded_at
+
+    @functools.cached_property
+    def factor_row_index(self) -> dict:
+        """個体ID → 因子データの行位置の配列 (初めて使うときに作る)"""
+        if self.all_factors_df.empty:
+            return {}
+        return self.all_factors_df.groupby('個体ID', sort=False).indices
+
+    @functools.cached_property
+    def red_star_totals(self) -> RedStarTotals:
+        """summary_df の行ごとの赤因子の星数の合計 (初めて使うときに作り、登録・親因子の保存では差分だけ直す)"""
+        return RedStarTotals.build(self.summary_df, self.factors_df)
+
+    def summary_rows(self, individual_id: str) -> list[int]:
+        """個体IDの、評価サマリー上の行番号 (1始まり・ヘッダー行込み)"""
+        return [int(i) + 2 for i in self.id_index.get_indexer_for([individual_id]) if i >= 0]
+
+    def factor_rows(self, individual_id: str) -> list[int]:
+        """個体IDの、因子データ上の行番号 (1始まり・ヘッダー行込み)"""
+        return [int(i) + 2 for i in self.factor_row_index.get(individual_id, [])]
+
+
+_lock = threading.Lock()
+_current: FactorTables | None = None
+_version = 0
+
+
+def current() -> FactorTables | None:
+    """最後に読み込んだデータベースの内容を返す。まだ何も読み込んでいなければNone"""
+    return _current
+
+
+def publish(summary_df, factors_df, loaded_at: float = None, source: str = 'sheets') -> FactorTables:
+    """
+    新しく読み込んだ内容を、次の世代としてまとめて差し替える。
+    中身が今の世代とまったく同じなら世代は進めず、読み込み日時だけ更新して今の世代を使い続ける
+    (検索のインデックスや結果のキャッシュをそのまま使い回せる)。
+    """
+    global _current, _version
+    with _lock:
+        if _current is not None and _current.all_summary_df.equals(summary_df) and _current.all_factors_df.equals(factors_df):
+            _current.loaded_at = loaded_at or time.time()
+            _current.source = source
+            return _current
+        _version += 1
+        _current = FactorTables(summary_df, factors_df, _version, loaded_at or time.time(), source)
+        return _current
+
+
+def remove_individuals(individual_ids) -> FactorTables | None:
+    """
+    シートから行を削除したあと、読み込み直さずにメモリ上の内容からも同じ個体を取り除く。
+    行位置がシートと揃うように、残った行は詰めて新しい世代として差し替える。
+    """
+    global _current, _version
+    with _lock:
+        if _current is None:
+            return None
+        ids = set(individual_ids)
+        summary_df = _current.all_summary_df
+        factors_df = _current.all_factors_df
+        if '個体ID' in summary_df.columns:
+            summary_df = summary_df[~summary_df['個体ID'].isin(ids)].reset_index(drop=True)
+        if '個体ID' in factors_df.columns:
+            factors_df = factors_df[~factors_df['個体ID'].isin(ids)].reset_index(drop=True)
+        _version += 1
+        _current = FactorTables(summary_df, factors_df, _version, _current.loaded_at, _current.source)
+        return _current
+
+
+def mark_deleted(individual_ids) -> FactorTables | None:
+    """シートに削除済みの印を付けたあと、読み込み直さずにメモリ上の内容にも同じ印を付ける"""
+    global _current, _version
+    with _lock:
+        if _current is None or '個体ID' not in _current.all_summary_df.columns:
+            return _current
+        summary_df = _current.all_summary_df.copy()
+        deleted = summary_df['個体ID'].isin(set(individual_ids))
+        if TOMBSTONE_COLUMN in summary_df.columns:
+            summary_df[TOMBSTONE_COLUMN] = summary_df[TOMBSTONE_COLUMN].astype(bool) | deleted
+        else:
+            summary_df[TOMBSTONE_COLUMN] = deleted
+        _version += 1
+        _current = FactorTables(summary_df, _current.all_factors_df, _version, _current.loaded_at, _current.source)
+        return _current
+
+
+def _publish_patched(summary_df, factors_df, red_star_totals=None) -> FactorTables:
+    """_lockを持った状態で、今の世代を書き換えたものを次の世代にする。赤因子の合計は渡されたら引き継ぎ、Noneなら使うときに作り直す"""
+    global _current, _version
+    _version += 1
+    tables = FactorTables(summary_df, factors_df, _version, _current.loaded_at, _current.source)
+    if red_star_totals is not None:
+        tables.__dict__['red_star_totals'] = red_star_totals
+    _current = tables
+    return tables
+
+
+def append_individual(summary_row: dict, factor_rows: list) -> FactorTables | None:
+    """
+    1体を登録したあと、読み込み直さずにメモリ上の内容にも追加する。
+    因子データの行は [個体ID, 因子ID, 因子名, 因子の種類, 星の数]。同じ個体IDが既にあれば何もしない。
+    """
+    with _lock:
+        if _current is None or str(summary_row.get('個体ID')) in _current.id_index:
+            return _current
+        old_summary_df = _current.all_summary_df
+        new_row = pd.DataFrame([{col: summary_row.get(col, '') for col in list(old_summary_df.columns) + [c for c in summary_row if c not in old_summary_df.columns]}])
+        summary_df = pd.concat([old_summary_df, new_row], ignore_index=True)
+        for col in new_row.columns.difference(old_summary_df.columns):
+            if not col.startswith('合計('):
+                summary_df[col] = summary_df[col].fillna('')
+        summary_df = apply_summary_schema(summary_df)
+
+        factors_df = _current.all_factors_df
+        if factor_rows:
+            new_factors = pd.DataFrame([row[:5] for row in factor_rows], columns=['個体ID', '因子ID', '因子名', '因子の種類', '星の数'])
+            if not factors_df.empty:
+                new_factors = new_factors[[c for c in new_factors.columns if c in factors_df.columns]]
+            factors_df = apply_factors_schema(pd.concat([factors_df, new_factors], ignore_index=True))
+
+        red_star_totals = _current.__dict__.get('red_star_totals')
+        if red_star_totals is not None:
+            red_star_totals = red_star_totals.appended(summary_row, factor_rows)
+        return _publish_patched(summary_df, factors_df, red_star_totals)
+
+
+def update_fields(individual_id: str, updates: dict) -> FactorTables | None:
+    """評価サマリーの列を書き換えたあと、読み込み直さずにメモリ上の内容にも同じ値を書き込む"""
+    with _lock:
+        if _current is None or not updates or str(individual_id) not in _current.id_index:
+            return _current
+        summary_df = _current.all_summary_df.copy()
+        rows = summary_df['個体ID'] == str(individual_id)
+        for col, value in updates.items():
+            column = summary_df[col].astype(object) if col in summary_df.columns else pd.Series(0 if col.startswith('合計(') else '', index=summary_df.index, dtype=object)
+            column[rows] = value
+            summary_df[col] = column
+        summary_df = apply_summary_schema(summary_df)
+
+        red_star_totals = _current.__dict__.get('red_star_totals')
+        if red_star_totals is not None and any(id_col in updates or star_col in updates for id_col, star_col in PARENT_COLUMNS):
+            visible_rows = np.flatnonzero(_current.summary_df['個体ID'].to_numpy() == str(individual_id))
+            new_row = summary_df[rows].iloc[0]
+            parents = [(str(new_row.get(id_col, '') or ''), int(new_row.get(star_col, 0) or 0)) for id_col, star_col in PARENT_COLUMNS]
+            red_star_totals = red_star_totals.with_parents(visible_rows, parents)
+        return _publish_patched(summary_df, _current.all_factors_df, red_star_totals)
+
+
+# アーカイブ (古い個体・放出済みの個体) は、普段の内容とは別に読み込んで持っておく
+_archive: FactorTables | None = None
+_archive_version = 0
+
+
+def current_archive() -> FactorTables | None:
+    return _archive
+
+
+def publish_archive(summary_df, factors_df) -> FactorTables:
+    global _archive, _archive_version
+    with _lock:
+        _archive_version += 1
+        _archive = FactorTables(summary_df, factors_df, _archive_version, time.time(), 'archive')
+        return _archive
+
+
+def clear_archive():
+    """アーカイブの中身が変わったときに、読み込み済みの内容を捨てる"""
+    global _archive
+    with _lock:
+        _archive = None
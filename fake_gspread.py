@@ -0,0 +1,377 @@
+"""
+オフラインで負荷試験をするための、gspreadのクライアント・スプレッドシート・ワークシートの代役。
+このプロジェクトで使っている機能だけをメモリ上で再現し、APIの呼び出し回数を数える。
+1回の呼び出しごとの待ち時間と、1分あたりの読み書き回数の上限(超えるとHTTP 429)も再現できる。
+
+    client = FakeClient(latency=0.2, write_quota_per_minute=60)
+    database.get_full_database(client)
+    print(client.stats())
+"""
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+import gspread
+from gspread.utils import a1_range_to_grid_range, fill_gaps, numericise_all, to_records
+
+DEFAULT_ROWS = 1000
+DEFAULT_COLS = 26
+
+
+class FakeResponse:
+    """gspread.exceptions.APIErrorに渡すための、最低限のHTTPレスポンス"""
+    def __init__(self, status_code: int, message: str, status: str):
+        self.status_code = status_code
+        self.text = message
+        self._error = {'code': status_code, 'message': message, 'status': status}
+
+    def json(self):
+        return {'error': self._error}
+
+
+def _api_error(status_code: int, message: str, status: str) -> gspread.exceptions.APIError:
+    return gspread.exceptions.APIError(FakeResponse(status_code, message, status))
+
+
+def _split_range(range_name: str):
+    """"'シート名'!A1:B2" を (シート名, "A1:B2") に分ける。範囲が無ければ (シート名, "")"""
+    title, sep, a1 = range_name.rpartition('!')
+    if not sep:
+        title, a1 = range_name, ''
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title, a1
+
+
+def _trim(rows: list) -> list:
+    """APIと同じく、各行の末尾の空セルと、末尾の空行を取り除く"""
+    trimmed = []
+    for row in rows:
+        end = len(row)
+        while end and row[end - 1] == '':
+            end -= 1
+        trimmed.append(row[:end])
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+
+def _to_cell_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    return str(value)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title: str, sheet_id: int, rows: int = DEFAULT_ROWS, cols: int = DEFAULT_COLS):
+        self.spreadsheet = spreadsheet
+        self.client = spreadsheet.client
+        self.title = title
+        self.id = sheet_id
+        self.row_count = rows
+        self.col_count = cols
+        # 値のある部分だけを持つ (行の長さはそろっていない)
+        self._rows: list[list[str]] = []
+
+    @property
+    def _properties(self) -> dict:
+        return {'sheetId': self.id, 'title': self.title, 'gridProperties': {'rowCount': self.row_count, 'columnCount': self.col_count}}
+
+    # --- 内部用 (呼び出し回数には数えない) ---
+
+    def _grid(self, a1: str):
+        """A1形式の範囲を、0始まり・終わりを含まない (行の開始, 行の終了, 列の開始, 列の終了) にする"""
+        if not a1:
+            return 0, self.row_count, 0, self.col_count
+        grid = a1_range_to_grid_range(a1)
+        return (
+            grid.get('startRowIndex', 0), grid.get('endRowIndex', self.row_count),
+            grid.get('startColumnIndex', 0), grid.get('endColumnIndex', self.col_count),
+        )
+
+    def _read(self, a1: str = '') -> list:
+        start_row, end_row, start_col, end_col = self._grid(a1)
+        rows = [row[start_col:end_col] for row in self._rows[start_row:end_row]]
+        return _trim(rows)
+
+    def _write(self, start_row: int, start_col: int, values: list):
+        """0始まりの位置から、2次元の値を書き込む"""
+        end_row = start_row + len(values)
+        end_col = start_col + max((len(row) for row in values), default=0)
+        if end_row > self.row_count or end_col > self.col_count:
+            raise _api_error(400, f"Range exceeds grid limits. Max rows: {self.row_count}, max columns: {self.col_count}", 'INVALID_ARGUMENT')
+        while len(self._rows) < end_row:
+            self._rows.append([])
+        for i, row_values in enumerate(values):
+            row = self._rows[start_row + i]
+            if len(row) < start_col + len(row_values):
+                row.extend([''] * (start_col + len(row_values) - len(row)))
+            for j, value in enumerate(row_values):
+                row[start_col + j] = _to_cell_value(value)
+        self.spreadsheet._touch()
+
+    def _write_a1(self, a1: str, values: list):
+        start_row, _, start_col, _ = self._grid(a1)
+        self._write(start_row, start_col, values)
+
+    def _append(self, rows: list):
+        last = len(_trim(self._rows))
+        if last + len(rows) > self.row_count:
+            self.row_count = last + len(rows)
+        self._write(last, 0, rows)
+
+    def _delete_dimension(self, dimension: str, start: int, end: int):
+        if dimension == 'ROWS':
+            del self._rows[start:end]
+            self.row_count -= min(end, self.row_count) - start
+        else:
+            for row in self._rows:
+                del row[start:end]
+            self.col_count -= min(end, self.col_count) - start
+        self.spreadsheet._touch()
+
+    # --- gspread.Worksheet と同じ名前のメソッド ---
+
+    def get_all_values(self, **kwargs) -> list:
+        with self.client._call('read', 'get_all_values'):
+            return fill_gaps(self._read())
+
+    def get_all_records(self, numericise_ignore=None, **kwargs) -> list:
+        with self.client._call('read', 'get_all_records'):
+            values = fill_gaps(self._read())
+        if not values:
+            return []
+        keys, rows = values[0], values[1:]
+        if numericise_ignore != ['all']:
+            rows = [numericise_all(row, ignore=numericise_ignore) for row in rows]
+        return to_records(keys, rows)
+
+    def row_values(self, row: int, **kwargs) -> list:
+        with self.client._call('read', 'row_values'):
+            values = self._read(f"{row}:{row}")
+        return values[0] if values else []
+
+    def col_values(self, col: int, **kwargs) -> list:
+        with self.client._call('read', 'col_values'):
+            return [row[col - 1] if len(row) >= col else '' for row in _trim(self._rows)]
+
+    def find(self, query: str, in_row: int = None, in_column: int = None, **kwargs):
+        with self.client._call('read', 'find'):
+            for r, row in enumerate(self._rows, start=1):
+                if in_row is not None and r != in_row:
+                    continue
+                for c, value in enumerate(row, start=1):
+                    if in_column is not None and c != in_column:
+                        continue
+                    if value == str(query):
+                        return gspread.Cell(r, c, value)
+        return None
+
+    def update(self, values=None, range_name=None, **kwargs):
+        with self.client._call('write', 'update'):
+            self._write_a1(range_name or 'A1', values)
+
+    def update_cell(self, row: int, col: int, value):
+        with self.client._call('write', 'update_cell'):
+            self._write(row - 1, col - 1, [[value]])
+
+    def update_cells(self, cell_list: list, **kwargs):
+        with self.client._call('write', 'update_cells'):
+            for cell in cell_list:
+                self._write(cell.row - 1, cell.col - 1, [[cell.value]])
+
+    def append_row(self, values: list, **kwargs):
+        with self.client._call('write', 'append_row'):
+            self._append([values])
+
+    def append_rows(self, values: list, **kwargs):
+        with self.client._call('write', 'append_rows'):
+            self._append(values)
+
+    def delete_rows(self, start_index: int, end_index: int = None):
+        with self.client._call('write', 'delete_rows'):
+            self._delete_dimension('ROWS', start_index - 1, end_index or start_index)
+
+    def clear(self):
+        with self.client._call('write', 'clear'):
+            self._rows = []
+            self.spreadsheet._touch()
+
+    def add_cols(self, cols: int):
+        with self.client._call('write', 'add_cols'):
+            self.col_count += cols
+
+    def add_rows(self, rows: int):
+        with self.client._call('write', 'add_rows'):
+            self.row_count += rows
+
+    def resize(self, rows: int = None, cols: int = None):
+        with self.client._call('write', 'resize'):
+            if rows is not None:
+                self.row_count = rows
+                del self._rows[rows:]
+            if cols is not None:
+                self.col_count = cols
+                for row in self._rows:
+                    del row[cols:]
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, title: str, key: str):
+        self.client = client
+        self.title = title
+        self.id = key
+        self._worksheets: list[FakeWorksheet] = []
+        self._updated_at = datetime.now(timezone.utc)
+
+    def _touch(self):
+        self._updated_at = datetime.now(timezone.utc)
+
+    def _find_worksheet(self, title: str) -> FakeWorksheet:
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def add_worksheet(self, title: str, rows: int = DEFAULT_ROWS, cols: int = DEFAULT_COLS, values: list = None) -> FakeWorksheet:
+        """ワークシートを追加する。valuesを渡すと、その内容を書き込んだ状態で作る (呼び出し回数には数えない)"""
+        worksheet = FakeWorksheet(self, title, len(self._worksheets) * 1000 + 1, rows, cols)
+        if values:
+            worksheet.row_count = max(rows, len(values))
+            worksheet.col_count = max(cols, max(len(row) for row in values))
+            worksheet._write(0, 0, values)
+        self._worksheets.append(worksheet)
+        return worksheet
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        with self.client._call('read', 'worksheet'):
+            return self._find_worksheet(title)
+
+    def worksheets(self, **kwargs) -> list:
+        with self.client._call('read', 'worksheets'):
+            return list(self._worksheets)
+
+    def values_get(self, range_name: str, params: dict = None) -> dict:
+        with self.client._call('read', 'values_get'):
+            title, a1 = _split_range(range_name)
+            values = self._find_worksheet(title)._read(a1)
+        return {'range': range_name, 'values': values} if values else {'range': range_name}
+
+    def values_batch_get(self, ranges: list, params: dict = None) -> dict:
+        with self.client._call('read', 'values_batch_get'):
+            value_ranges = []
+            for range_name in ranges:
+                title, a1 = _split_range(range_name)
+                values = self._find_worksheet(title)._read(a1)
+                value_ranges.append({'range': range_name, 'values': values} if values else {'range': range_name})
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+    def values_batch_update(self, body: dict = None, **kwargs) -> dict:
+        with self.client._call('write', 'values_batch_update'):
+            for entry in body.get('data', []):
+                title, a1 = _split_range(entry['range'])
+                self._find_worksheet(title)._write_a1(a1 or 'A1', entry['values'])
+        return {'spreadsheetId': self.id, 'totalUpdatedRanges': len(body.get('data', []))}
+
+    def batch_update(self, body: dict) -> dict:
+        """deleteDimensionだけに対応する。リクエストは実際のAPIと同じく先頭から順に適用する"""
+        with self.client._call('write', 'batch_update'):
+            by_id = {worksheet.id: worksheet for worksheet in self._worksheets}
+            for request in body.get('requests', []):
+                if 'deleteDimension' not in request:
+                    raise NotImplementedError(f"FakeSpreadsheet.batch_update は {list(request)} に対応していません")
+                grid = request['deleteDimension']['range']
+                by_id[grid['sheetId']]._delete_dimension(grid['dimension'], grid['startIndex'], grid['endIndex'])
+        return {'spreadsheetId': self.id, 'replies': [{} for _ in body.get('requests', [])]}
+
+    def get_lastUpdateTime(self) -> str:
+        with self.client._call('read', 'get_lastUpdateTime'):
+            return self._updated_at.isoformat()
+
+
+class _Call:
+    """1回のAPI呼び出し。入るときに上限と待ち時間を処理し、出るときに所要時間を記録する"""
+    def __init__(self, client, kind: str, name: str):
+        self.client = client
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.client._before_call(self.kind, self.name)
+        self.started_at = time.monotonic()
+        self.client._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.client._lock.release()
+        self.client._after_call(self.name, time.monotonic() - self.started_at)
+        return False
+
+
+class FakeClient:
+    """
+    gspread.Client の代役。スプレッドシートは1つだけで、open() と open_by_key() はどちらもそれを返す。
+    latencyは1回の呼び出しごとの待ち秒数、*_quota_per_minuteは直近60秒の上限 (Noneなら無制限)。
+    """
+    def __init__(self, title: str = "因子評価データベース", key: str = "fake-spreadsheet", latency: float = 0.0,
+                 read_quota_per_minute: int = None, write_quota_per_minute: int = None):
+        self.latency = latency
+        self.quotas = {'read': read_quota_per_minute, 'write': write_quota_per_minute}
+        self._recent = {'read': deque(), 'write': deque()}
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self.calls = Counter()
+        self.call_seconds = Counter()
+        self.quota_errors = 0
+        self.spreadsheet = FakeSpreadsheet(self, title, key)
+
+    def _call(self, kind: str, name: str) -> _Call:
+        return _Call(self, kind, name)
+
+    def _before_call(self, kind: str, name: str):
+        quota = self.quotas[kind]
+        if quota is not None:
+            with self._stats_lock:
+                now = time.monotonic()
+                recent = self._recent[kind]
+                while recent and now - recent[0] >= 60:
+                    recent.popleft()
+                if len(recent) >= quota:
+                    self.quota_errors += 1
+                    raise _api_error(429, f"Quota exceeded for quota metric '{kind} requests' (fake)", 'RESOURCE_EXHAUSTED')
+                recent.append(now)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _after_call(self, name: str, seconds: float):
+        with self._stats_lock:
+            self.calls[name] += 1
+            self.call_seconds[name] += seconds + self.latency
+
+    def open(self, title: str, folder_id: str = None) -> FakeSpreadsheet:
+        with self._call('read', 'open'):
+            if title != self.spreadsheet.title:
+                raise gspread.exceptions.SpreadsheetNotFound(title)
+            return self.spreadsheet
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        with self._call('read', 'open_by_key'):
+            return self.spreadsheet
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.calls.clear()
+            self.call_seconds.clear()
+            self.quota_errors = 0
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'total_calls': sum(self.calls.values()),
+                'calls': dict(self.calls),
+                'simulated_seconds': round(sum(self.call_seconds.values()), 3),
+                'quota_errors': self.quota_errors,
+            }
@@ -0,0 +1,494 @@
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import config
+import factor_tables
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _union(arrays) -> np.ndarray:
+    arrays = [a for a in arrays if len(a)]
+    if not arrays:
+        return _EMPTY
+    return np.unique(np.concatenate(arrays))
+
+
+def _group_postings(keys: np.ndarray, positions: np.ndarray, stars: np.ndarray) -> dict:
+    """(キー, 個体の位置, 星数) の組を、キーごとに星数の降順に並べたポスティングリストにまとめる"""
+    if not len(keys):
+        return {}
+    codes, uniques = pd.factorize(keys)
+    order = np.lexsort((-stars, codes))
+    codes, positions, stars = codes[order], positions[order], stars[order]
+    bounds = np.searchsorted(codes, np.arange(len(uniques) + 1))
+    return {
+        str(key): (positions[bounds[i]:bounds[i + 1]], stars[bounds[i]:bounds[i + 1]])
+        for i, key in enumerate(uniques)
+    }
+
+
+def _at_least(posting, min_stars: int):
+    """星数の降順に並んだポスティングリストから、星数がmin_stars以上の先頭部分を切り出す"""
+    positions, stars = posting
+    count = np.searchsorted(-stars, -min_stars, side='right')
+    return positions[:count], stars[:count]
+
+
+class Term:
+    """
+    検索プランの1項。見積もり件数と、集合を作る関数・候補を絞り込む関数を持つ。
+    key は条件を正規化したもので、同じ条件なら書き方や並び順によらず同じになる。
+    """
+    def __init__(self, label: str, key: tuple, estimate: int, materialize, probe=None):
+        self.label = label
+        self.key = key
+        self.estimate = estimate
+        self.result = None
+        self._materialize = materialize
+        self._probe = probe
+
+    def materialize(self) -> np.ndarray:
+        if self.result is None:
+            self.result = self._materialize()
+        return self.result
+
+    def probe(self, candidates: np.ndarray) -> np.ndarray:
+        if self._probe is not None:
+            return self._probe(candidates)
+        return candidates[np.isin(candidates, self.materialize(), assume_unique=True)]
+
+    def __repr__(self):
+        return f"Term({self.label}, 見積もり{self.estimate}件)"
+
+
+class FactorIndex:
+    """
+    検索用の転置インデックス。
+    個体IDを0始まりの位置に置き換え、因子IDごとに (個体の位置, 星数) のポスティングリストを星数の降順で持つ。
+    検索条件はポスティングリストの和集合・積集合に変換し、見積もり件数の少ないものから順に実行する。
+    """
+    def __init__(self, summary_df: pd.DataFrame, factors_df: pd.DataFrame, red_star_totals: factor_tables.RedStarTotals = None, version=None):
+        # 結果のキャッシュのキーに使う。同じ世代から作ったインデックスは同じversionになる
+        self.version = version if version is not None else next(_index_versions)
+        self.summary_df = summary_df
+        row_ids = summary_df['個体ID'].astype(str).to_numpy() if '個体ID' in summary_df.columns else np.empty(0, dtype=object)
+        self.ids = pd.Index(pd.unique(row_ids))
+        self.size = len(self.ids)
+        # 評価サマリーの行 → 個体の位置 (同じ個体IDの行が複数あっても同じ位置になる)
+        self.row_positions = self.ids.get_indexer(row_ids) if len(row_ids) else _EMPTY
+        self.unique_rows = self.size == len(row_ids)
+        self.postings = self._build_factor_postings(factors_df)
+        # 親・全体の赤因子の条件は、個体ごとに作り済みの星数の合計と比べるだけにする
+        if red_star_totals is None:
+            red_star_totals = factor_tables.RedStarTotals.build(summary_df, factors_df)
+        self.red_star_totals = red_star_totals if self.unique_rows else red_star_totals.reduce_rows(self.row_positions, self.size)
+        self._value_postings = {}
+        self._score_orders = {}
+        self._position_views = {}
+        self._hits = {}
+        self._total_red_stars = None
+
+    def _build_factor_postings(self, factors_df: pd.DataFrame) -> dict:
+        if factors_df.empty or '個体ID' not in factors_df.columns:
+            return {}
+        positions = self.ids.get_indexer(factors_df['個体ID'].astype(str).to_numpy())
+        keep = positions >= 0
+        stars = pd.to_numeric(factors_df['星の数'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        return _group_postings(factors_df['因子ID'].astype(str).to_numpy()[keep], positions[keep], stars[keep])
+
+    # --- 基本の検索 ---
+
+    def all_positions(self) -> np.ndarray:
+        return np.arange(self.size, dtype=np.int64)
+
+    def value_count(self, column: str, values) -> int:
+        postings = self._value_postings_for(column)
+        return sum(len(postings[str(v)][0]) for v in values if str(v) in postings)
+
+    def value_positions(self, column: str, values) -> np.ndarray:
+        """評価サマリーの列の値が、valuesのどれかに一致する個体の位置"""
+        postings = self._value_postings_for(column)
+        return _union(postings[str(v)][0] for v in values if str(v) in postings)
+
+    def _value_postings_for(self, column: str) -> dict:
+        if column not in self.summary_df.columns:
+            return {}
+        if column not in self._value_postings:
+            rows = self.row_positions
+            self._value_postings[column] = _group_postings(self.summary_df[column].astype(str).to_numpy(), rows, np.zeros(len(rows), dtype=np.int64))
+        return self._value_postings[column]
+
+    def _score_order(self, column: str):
+        if column not in self._score_orders:
+            scores = pd.to_numeric(self.summary_df[column], errors='coerce').fillna(0).to_numpy()
+            order = np.argsort(-scores, kind='stable')
+            # 候補の絞り込み用に、個体の位置ごとの最高点も持っておく
+            by_position = np.full(self.size, -np.inf)
+            np.maximum.at(by_position, self.row_positions, scores)
+            self._score_orders[column] = (self.row_positions[order], scores[order], by_position)
+        return self._score_orders[column]
+
+    def score_count(self, column: str, min_score) -> int:
+        _, scores, _ = self._score_order(column)
+        return int(np.searchsorted(-scores, -min_score, side='right'))
+
+    def score_at_least(self, column: str, min_score) -> np.ndarray:
+        positions, _, _ = self._score_order(column)
+        return np.unique(positions[:self.score_count(column, min_score)])
+
+    def factor_count(self, factor_id: str, min_stars: int) -> int:
+        posting = self.postings.get(str(factor_id))
+        return len(_at_least(posting, min_stars)[0]) if posting else 0
+
+    def factor_at_least(self, factor_id: str, min_stars: int) -> np.ndarray:
+        posting = self.postings.get(str(factor_id))
+        return np.unique(_at_least(posting, min_stars)[0]) if posting else _EMPTY
+
+    def stars_at(self, factor_id: str, positions: np.ndarray) -> np.ndarray:
+        """指定した個体の位置ごとに、その因子の最大の星数を返す (持っていなければ0)"""
+        factor_id = str(factor_id)
+        if factor_id not in self._position_views:
+            posting = self.postings.get(factor_id)
+            if posting is None:
+                self._position_views[factor_id] = None
+            else:
+                # 星数の降順に並んでいるので、各個体で最初に出てくるものが最大
+                unique_positions, first = np.unique(posting[0], return_index=True)
+                self._position_views[factor_id] = (unique_positions, posting[1][first])
+        stars = np.zeros(len(positions), dtype=np.int64)
+        view = self._position_views[factor_id]
+        if view is None or not len(positions):
+            return stars
+        index = np.minimum(np.searchsorted(view[0], positions), len(view[0]) - 1)
+        found = view[0][index] == positions
+        stars[found] = view[1][index[found]]
+        return stars
+
+    def _sorted_hits(self, factor_id: str, min_stars: int) -> np.ndarray:
+        """因子をmin_stars以上で持つ因子データの行を、個体の位置の昇順に並べたもの (同じ個体が複数回出ることもある)"""
+        key = (str(factor_id), int(min_stars))
+        if key not in self._hits:
+            posting = self.postings.get(key[0])
+            self._hits[key] = np.sort(_at_least(posting, key[1])[0]) if posting else _EMPTY
+        return self._hits[key]
+
+    def n_of_m(self, items: dict, required_count: int) -> np.ndarray:
+        """{因子ID: 最低星数} のうち、required_count個以上を満たす個体の位置"""
+        hits = [self._sorted_hits(f, s) for f, s in items.items()]
+        hits = [h for h in hits if len(h)]
+        if not hits:
+            return _EMPTY
+        # 条件を満たす行をまとめて並べ、個体ごとの件数を一度に数える
+        positions, counts = np.unique(np.concatenate(hits), return_counts=True)
+        return positions[counts >= required_count]
+
+    def hit_counts(self, items: dict, positions: np.ndarray) -> np.ndarray:
+        """指定した個体の位置ごとに、{因子ID: 最低星数} を満たす因子データの行数を数える"""
+        counts = np.zeros(len(positions), dtype=np.int64)
+        for f, s in items.items():
+            hits = self._sorted_hits(f, s)
+            if len(hits):
+                counts += np.searchsorted(hits, positions, side='right') - np.searchsorted(hits, positions, side='left')
+        return counts
+
+    def red_stars(self, kind: str, factor_id: str, positions: np.ndarray = None) -> np.ndarray:
+        """
+        個体の位置ごとの赤因子の星数の合計。kind は 'parent' (親2体) か 'overall' (本体 + 親2体)。
+        positionsを省略すると全個体分を返す。
+        """
+        totals = self.red_star_totals
+        j = totals.columns.get(str(factor_id))
+        if j is not None:
+            column = getattr(totals, kind)[:, j]
+            return column if positions is None else column[positions]
+        # 親にも赤因子の種類にも出てこない因子は、親の合計が0なので本体の星数だけになる
+        positions = self.all_positions() if positions is None else positions
+        return self.stars_at(factor_id, positions) if kind == 'overall' else np.zeros(len(positions), dtype=np.int64)
+
+    def red_at_least(self, kind: str, factor_id: str, min_stars: int) -> np.ndarray:
+        return np.flatnonzero(self.red_stars(kind, factor_id) >= min_stars)
+
+    # --- 条件の実行 ---
+
+    def plan(self, conditions: dict, owner_id: str = None, cache: 'SearchCache' = None) -> list:
+        """
+        検索条件を、見積もり件数の少ない順に並べた項 (Term) のリストにする。
+        項どうしはすべて積集合 (AND) で組み合わせる。
+        見積もりは、ポスティングリストの長さ (星数ごとの件数) から求める。
+        キャッシュに同じ条件の結果があれば、それを使い、見積もりも正確な件数になる。
+        """
+        terms = []
+
+        def add(label, key, estimate, materialize, probe=None):
+            term = Term(label, key, estimate, materialize, probe)
+            cached = cache.get(('term', self.version, key)) if cache is not None else None
+            if cached is not None:
+                term.result = cached
+                term.estimate = len(cached)
+            elif estimate is None:
+                # 比較1回で結果が出るものは、見積もりの代わりに先に実行してしまう
+                term.estimate = len(term.materialize())
+            terms.append(term)
+
+        if owner_id is not None:
+            add('所有者', ('value', '所有者ID', (str(owner_id),)), self.value_count('所有者ID', [owner_id]),
+                lambda: self.value_positions('所有者ID', [owner_id]), self._value_probe('所有者ID', [owner_id]))
+        for cond_type, conds in conditions.items():
+            if not conds:
+                continue
+            if cond_type == 'characters':
+                names = [item['name'] for item in conds[0]['items']]
+                add('キャラ名', ('value', 'キャラ名', tuple(sorted({str(n) for n in names}))), self.value_count('キャラ名', names),
+                    lambda names=names: self.value_positions('キャラ名', names), self._value_probe('キャラ名', names))
+            elif cond_type == 'score':
+                for cond in conds:
+                    column = f"合計({cond['sheet']})"
+                    if column in self.summary_df.columns:
+                        add(column, ('score', column, cond['score']), self.score_count(column, cond['score']),
+                            lambda c=column, s=cond['score']: self.score_at_least(c, s),
+                            lambda positions, c=column, s=cond['score']: positions[self._score_order(c)[2][positions] >= s])
+            elif cond_type in ('blue_factors', 'green_factors', 'red_factor_body'):
+                items = [cond['items'][0] if 'items' in cond else cond for cond in conds]
+                add(cond_type, ('any', tuple(sorted({(str(i['id']), int(i['stars'])) for i in items}))), sum(self.factor_count(i['id'], i['stars']) for i in items),
+                    lambda items=items: _union(self.factor_at_least(i['id'], i['stars']) for i in items),
+                    lambda positions, items=items: positions[np.logical_or.reduce([self.stars_at(i['id'], positions) >= i['stars'] for i in items])])
+            elif cond_type in ('required_skills', 'required_genes'):
+                for cond in conds:
+                    item = cond['items'][0]
+                    add(cond_type, ('factor', str(item['id']), int(item['stars'])), self.factor_count(item['id'], item['stars']),
+                        lambda i=item: self.factor_at_least(i['id'], i['stars']),
+                        lambda positions, i=item: positions[self.stars_at(i['id'], positions) >= i['stars']])
+            elif cond_type in ('optional_skills', 'optional_genes'):
+                cond_group = conds[0]
+                items = {item['id']: item['stars'] for item in cond_group['items']}
+                required_count = cond_group.get('count', 1)
+                # 合計件数をrequired_countで割ったものが、満たす個体数の上限になる
+                estimate = sum(self.factor_count(f, s) for f, s in items.items()) // max(required_count, 1)
+                add(cond_type, ('n_of_m', tuple(sorted((str(f), int(s)) for f, s in items.items())), required_count), estimate,
+                    lambda items=items, n=required_count: self.n_of_m(items, n),
+                    lambda positions, items=items, n=required_count: positions[self.hit_counts(items, positions) >= n])
+            elif cond_type in ('red_factor_parent', 'red_factor_overall'):
+                kind = 'parent' if cond_type == 'red_factor_parent' else 'overall'
+                for cond in conds:
+                    add(cond_type, ('red', kind, str(cond['id']), int(cond['stars'])), None,
+                        lambda k=kind, c=cond: self.red_at_least(k, c['id'], c['stars']),
+                        lambda positions, k=kind, c=cond: positions[self.red_stars(k, c['id'], positions) >= c['stars']])
+        return sorted(terms, key=lambda term: term.estimate)
+
+    def _value_probe(self, column: str, values):
+        """評価サマリーの行と個体の位置が1対1なら、候補の行の値を直接比べる"""
+        if not self.unique_rows or column not in self.summary_df.columns:
+            return None
+        values = {str(v) for v in values}
+        return lambda positions: positions[self.summary_df[column].iloc[positions].astype(str).isin(values).to_numpy()]
+
+    def search(self, conditions: dict, owner_id: str = None, cache: 'SearchCache' = None) -> np.ndarray:
+        """
+        条件をすべて満たす個体の位置を、昇順の配列で返す。
+        最も絞り込める項で候補を作り、残りの項は候補が見積もりより少なければ候補だけを調べる。
+        候補が空になった時点で打ち切る。
+        cacheを渡すと、検索結果と、項ごとに作った集合をそこに覚えておく。
+        """
+        terms = self.plan(conditions, owner_id, cache)
+        query_key = ('query', self.version, frozenset(term.key for term in terms))
+        if cache is not None:
+            cached = cache.get(query_key)
+            if cached is not None:
+                return cached
+
+        if not terms:
+            candidates = self.all_positions()
+        else:
+            candidates = terms[0].materialize()
+            for term in terms[1:]:
+                if not len(candidates):
+                    break
+                if len(candidates) < term.estimate:
+                    candidates = term.probe(candidates)
+                else:
+                    candidates = np.intersect1d(candidates, term.materialize(), assume_unique=True)
+
+        if cache is not None:
+            for term in terms:
+                if term.result is not None:
+                    cache.put(('term', self.version, term.key), term.result)
+            cache.put(query_key, candidates)
+        return candidates
+
+    def preview(self, conditions: dict, owner_id: str = None, cache: 'SearchCache' = None) -> tuple[int, dict]:
+        """
+        検索した場合の件数と、条件の種類ごとに、その条件だけで絞り込んだ場合の件数を返す。
+        項ごとの集合はキャッシュから使い回すので、条件を1つ変えても、その条件の分だけ計算し直す。
+        """
+        total = len(self.search(conditions, owner_id, cache))
+        counts = {cond_type: len(self.search({cond_type: conds}, None, cache)) for cond_type, conds in conditions.items() if conds}
+        return total, counts
+
+    def select_rows(self, positions: np.ndarray, owner_id: str = None) -> np.ndarray:
+        """個体の位置から、評価サマリーの行番号を元の並び順のまま取り出す"""
+        if self.unique_rows:
+            return np.sort(positions)
+        # 同じ個体IDの行が複数ある古いデータでは、所有者の絞り込みも行ごとに行う
+        mask = np.isin(self.row_positions, positions)
+        if owner_id is not None:
+            mask &= (self.summary_df['所有者ID'].astype(str) == owner_id).to_numpy()
+        return np.flatnonzero(mask)
+
+    def select(self, positions: np.ndarray, owner_id: str = None) -> pd.DataFrame:
+        """個体の位置から、評価サマリーの行を元の並び順のまま取り出す"""
+        return self.summary_df.iloc[self.select_rows(positions, owner_id)]
+
+    def total_red_stars(self) -> np.ndarray:
+        """個体の位置ごとの、全体の赤因子 (本体 + 親2体) の星数をすべての赤因子で足したもの"""
+        if self._total_red_stars is None:
+            self._total_red_stars = self.red_star_totals.overall.sum(axis=1, dtype=np.int32)
+        return self._total_red_stars
+
+
+class TopK:
+    """
+    値の大きい順の並びを、表示に必要な順位の分だけ作る。
+    argpartitionで上位k件を選んでからその中だけを並べるので、先頭のページを見るだけなら全件の並べ替えは要らない。
+    同じ値どうしは元の並び順にする。
+    """
+    def __init__(self, values: np.ndarray):
+        self.values = np.asarray(values, dtype=np.float64)
+        self._prefix = _EMPTY
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self._prefix.nbytes
+
+    def at(self, rank: int) -> int:
+        """rank番目 (0始まり) に大きい値の、元の位置"""
+        if rank >= len(self._prefix):
+            self._extend(rank + 1)
+        return int(self._prefix[rank])
+
+    def _extend(self, count: int):
+        n = len(self.values)
+        k = min(n, max(count, 2 * len(self._prefix), 32))
+        negated = -self.values
+        if k >= n:
+            self._prefix = np.lexsort((np.arange(n), negated))
+            return
+        # k番目の値と同じ値はすべて候補に入れて、同じ値の並び順が毎回変わらないようにする
+        threshold = np.partition(negated, k - 1)[k - 1]
+        candidates = np.flatnonzero(negated <= threshold)
+        self._prefix = candidates[np.lexsort((candidates, negated[candidates]))][:k]
+
+
+def _entry_size(positions: np.ndarray) -> int:
+    # 配列の中身に、キーと配列オブジェクトの分をざっくり足したもの
+    return positions.nbytes + 256
+
+
+class SearchCache:
+    """
+    検索結果と項ごとの集合 (個体の位置の配列) を覚えておくLRUキャッシュ。合計サイズがmax_bytesを超えたら古いものから捨てる。
+    キーにインデックスの世代が入るので、データが変われば古い世代のものは使われなくなり、そのうち追い出される。
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> np.ndarray | None:
+        positions = self._entries.get(key)
+        if positions is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return positions
+
+    def put(self, key, positions: np.ndarray):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        # 個体の位置はint32で十分なので、半分の大きさにして覚える
+        positions = positions.astype(np.int32)
+        if _entry_size(positions) > self.max_bytes:
+            return
+        self._entries[key] = positions
+        self.bytes += _entry_size(positions)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= _entry_size(evicted)
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+result_cache = SearchCache(config.SEARCH_CACHE_MAX_BYTES)
+_index_versions = itertools.count(1)
+# 世代の種類 ('current' / 'archive' / 'other') → (評価サマリー, 因子データ, インデックス)
+_cached = {}
+_combined: tuple | None = None
+
+
+def _generation_of(summary_df: pd.DataFrame, factors_df: pd.DataFrame):
+    """DataFrameの組が読み込み済みの世代そのもの (またはそれにアーカイブを足したもの) なら、その世代を表すキーを返す"""
+    tables = factor_tables.current()
+    if tables is not None and tables.summary_df is summary_df and tables.factors_df is factors_df:
+        return 'current', ('current', tables.version)
+    if _combined is not None and _combined[1][0] is summary_df and _combined[1][1] is factors_df and _combined[2] is not None:
+        return 'archive', _combined[2]
+    return 'other', None
+
+
+def index_for(summary_df: pd.DataFrame, factors_df: pd.DataFrame) -> FactorIndex:
+    """
+    同じDataFrameの組に対しては、作ったインデックスを使い回す。
+    読み込み済みの世代そのものなら、その世代が持っている赤因子の星数の合計を使い、世代の番号をインデックスのversionにする。
+    読み込み直しても同じ世代のままなら、結果のキャッシュもそのまま使える。
+    普段の内容とアーカイブ込みの内容は別々に持つので、交互に検索しても作り直さない。
+    """
+    kind, version = _generation_of(summary_df, factors_df)
+    cached = _cached.get(kind)
+    if cached is not None and cached[0] is summary_df and cached[1] is factors_df:
+        return cached[2]
+    red_star_totals = factor_tables.current().red_star_totals if kind == 'current' else None
+    index = FactorIndex(summary_df, factors_df, red_star_totals, version=version)
+    _cached[kind] = (summary_df, factors_df, index)
+    return index
+
+
+def with_archive(summary_df: pd.DataFrame, factors_df: pd.DataFrame, archive_summary_df: pd.DataFrame, archive_factors_df: pd.DataFrame):
+    """普段の内容にアーカイブを足したDataFrameの組を返す。同じ組み合わせなら前回作ったものを使い回す"""
+    global _combined
+    frames = (summary_df, factors_df, archive_summary_df, archive_factors_df)
+    if _combined is not None and all(a is b for a, b in zip(_combined[0], frames)):
+        return _combined[1]
+    combined = (pd.concat([summary_df, archive_summary_df], ignore_index=True), pd.concat([factors_df, archive_factors_df], ignore_index=True))
+    tables, archive = factor_tables.current(), factor_tables.current_archive()
+    version = None
+    if tables is not None and archive is not None and tables.summary_df is summary_df and tables.factors_df is factors_df \
+            and archive.summary_df is archive_summary_df and archive.factors_df is archive_factors_df:
+        version = ('archive', tables.version, archive.version)
+    _combined = (frames, combined, version)
+    return combined
+
+
+def current_index(include_archive: bool = False) -> FactorIndex | None:
+    """
+    最後に読み込んだ内容 (シートには問い合わせない) のインデックスを返す。まだ何も読み込んでいなければNone。
+    include_archiveがTrueなら、読み込み済みのアーカイブがあればそれも含める。
+    """
+    tables = factor_tables.current()
+    if tables is None or tables.summary_df.empty:
+        return None
+    summary_df, factors_df = tables.summary_df, tables.factors_df
+    archive = factor_tables.current_archive() if include_archive else None
+    if archive is not None and not archive.summary_df.empty:
+        summary_df, factors_df = with_archive(summary_df, factors_df, archive.summary_df, archive.factors_df)
+    return index_for(summary_df, factors_df)
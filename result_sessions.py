@@ -0,0 +1,132 @@
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import config
+
+
+class ResultSession:
+    """
+    1つの結果画面が表示している個体の並び。
+    共有の評価サマリー (読み取り専用) への参照と、その中の行位置のint32の配列だけを持ち、
+    表示する行はその都度取り出すので、結果ごとにDataFrameのコピーを作らない。
+    """
+    def __init__(self, session_id: int, summary_df: pd.DataFrame, rows: np.ndarray, columns: dict):
+        self.id = session_id
+        self.summary_df = summary_df
+        self.rows = np.asarray(rows, dtype=np.int32)
+        # rowsと同じ並びの、行ごとの追加の値 (赤因子の星数の合計など)
+        self.columns = {name: np.asarray(values) for name, values in columns.items() if values is not None}
+        # 画面側が持っている並べ替えの状態 (query_engine.TopK)。メモリの計算に含める
+        self.ranking = None
+        self.expired = False
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.rows) == 0
+
+    @property
+    def nbytes(self) -> int:
+        size = self.rows.nbytes + sum(values.nbytes for values in self.columns.values())
+        if self.ranking is not None:
+            size += self.ranking.nbytes
+        return size
+
+    def has_column(self, name: str) -> bool:
+        return name in self.columns or (self.summary_df is not None and name in self.summary_df.columns)
+
+    def row(self, i: int) -> pd.Series:
+        """i番目の結果の行"""
+        return self.summary_df.iloc[int(self.rows[i])]
+
+    def head(self, n: int) -> pd.DataFrame:
+        """先頭n件の行 (n件分だけのDataFrameを作る)"""
+        return self.summary_df.iloc[self.rows[:n]].reset_index(drop=True)
+
+    def values(self, name: str) -> np.ndarray:
+        """結果の並びでの、列の値の配列"""
+        if name in self.columns:
+            return self.columns[name]
+        return self.summary_df[name].iloc[self.rows].to_numpy()
+
+    def remove(self, name: str, value):
+        """列の値がvalueの行を結果から取り除く"""
+        keep = self.values(name) != value
+        self.rows = self.rows[keep]
+        self.columns = {key: values[keep] for key, values in self.columns.items()}
+
+    def release(self):
+        self.summary_df = None
+        self.rows = self.rows[:0]
+        self.columns = {}
+        self.ranking = None
+        self.expired = True
+
+
+def _frame_bytes(summary_df: pd.DataFrame) -> int:
+    # 文字列の中身までは数えない (deep=Trueは大きな表だと遅い)
+    return int(summary_df.memory_usage(index=True).sum())
+
+
+class SessionManager:
+    """
+    表示中の結果画面のセッションを管理する。
+    セッションの配列と、セッションが参照している評価サマリー (同じものは1回だけ数える) の合計が
+    max_bytesを超えたら、最後に使われたのが古いものから期限切れにする。
+    古い世代の評価サマリーを参照したまま放置されたセッションも、これで解放される。
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._ids = itertools.count(1)
+        # id(評価サマリー) → (評価サマリー, 大きさ)。参照しているセッションがある間だけ持つ
+        self._frames = {}
+        self.expired = 0
+
+    def open(self, summary_df: pd.DataFrame, rows: np.ndarray, **columns) -> ResultSession:
+        session = ResultSession(next(self._ids), summary_df, rows, columns)
+        self._sessions[session.id] = session
+        if id(summary_df) not in self._frames:
+            self._frames[id(summary_df)] = (summary_df, _frame_bytes(summary_df))
+        self._evict()
+        return session
+
+    def touch(self, session: ResultSession):
+        if session.id in self._sessions:
+            self._sessions.move_to_end(session.id)
+            self._evict()
+
+    def close(self, session: ResultSession):
+        if self._sessions.pop(session.id, None) is not None:
+            session.release()
+            self._forget_unused_frames()
+
+    @property
+    def bytes(self) -> int:
+        return sum(session.nbytes for session in self._sessions.values()) + sum(size for _, size in self._frames.values())
+
+    def _forget_unused_frames(self):
+        in_use = {id(session.summary_df) for session in self._sessions.values()}
+        for key in [key for key in self._frames if key not in in_use]:
+            del self._frames[key]
+
+    def _evict(self):
+        # 最後に使われたセッションだけは、上限を超えていても残す
+        if self.bytes <= self.max_bytes:
+            return
+        while len(self._sessions) > 1 and self.bytes > self.max_bytes:
+            _, session = self._sessions.popitem(last=False)
+            session.release()
+            self.expired += 1
+            self._forget_unused_frames()
+
+    def stats(self) -> dict:
+        return {'sessions': len(self._sessions), 'bytes': self.bytes, 'expired': self.expired}
+
+
+manager = SessionManager(config.RESULT_SESSION_MAX_BYTES)
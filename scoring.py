@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+
+class ScoreSheets(dict):
+    """
+    {採点簿名: {因子ID: 点数}} の辞書に、因子 × 採点簿 の点数行列を持たせたもの。
+    スコアの計算はすべてこのクラスを通して、行列の積で行う。
+    """
+    def __init__(self, sheets: dict = None):
+        super().__init__(sheets or {})
+        self.sheet_names = list(self.keys())
+        factor_ids = sorted({factor_id for sheet in self.values() for factor_id in sheet})
+        # 因子ID → 行列の行番号
+        self.factor_index = {factor_id: i for i, factor_id in enumerate(factor_ids)}
+        self.matrix = np.zeros((len(factor_ids), len(self.sheet_names)), dtype=np.int32)
+        for j, sheet in enumerate(self.values()):
+            for factor_id, score in sheet.items():
+                self.matrix[self.factor_index[factor_id], j] = score
+
+    def score_sparse(self, rows: np.ndarray, factor_ids, stars: np.ndarray, n_individuals: int) -> np.ndarray:
+        """
+        (個体の位置, 因子ID, 星数) の組から、個体 × 採点簿 の合計点行列を計算する。
+        採点簿に載っていない因子は0点として扱う。
+        """
+        cols = np.fromiter((self.factor_index.get(str(f), -1) for f in factor_ids), dtype=np.int64, count=len(stars))
+        known = cols >= 0
+        totals = np.zeros((n_individuals, len(self.sheet_names)), dtype=np.int64)
+        np.add.at(totals, rows[known], self.matrix[cols[known]] * stars[known, None])
+        return totals
+
+    def score_individual(self, factor_details: list) -> dict:
+        """1体分の因子リスト [{'id': 因子ID, 'stars': 星数}] から、採点簿ごとの合計点を返す"""
+        stars = np.array([int(f['stars']) for f in factor_details], dtype=np.int64)
+        totals = self.score_sparse(np.zeros(len(stars), dtype=np.int64), [f['id'] for f in factor_details], stars, 1)
+        return dict(zip(self.sheet_names, totals[0].tolist()))
+
+    def score_factors_df(self, factors_df: pd.DataFrame, individual_ids) -> pd.DataFrame:
+        """
+        因子データのDataFrameから、指定した個体たちの合計点を 個体ID × 採点簿 のDataFrameで返す。
+        individual_idsの順番と重複はそのまま保たれる。
+        """
+        individual_ids = pd.Index(individual_ids, dtype=object).astype(str)
+        unique_ids = pd.Index(pd.unique(individual_ids))
+        rows = unique_ids.get_indexer(factors_df['個体ID'].astype(str))
+        in_target = rows >= 0
+        stars = pd.to_numeric(factors_df['星の数'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        totals = self.score_sparse(rows[in_target], factors_df['因子ID'].to_numpy()[in_target], stars[in_target], len(unique_ids))
+        return pd.DataFrame(totals, index=unique_ids, columns=self.sheet_names).reindex(individual_ids)
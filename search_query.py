@@ -0,0 +1,129 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+import config
+import image_processor
+
+# 条件のキーワード → (条件の種類, 辞書の因子の種類)。日本語の別名も使える
+FACTOR_KEYS = {
+    'blue': ('blue_factors', '青因子'),
+    'green': ('green_factors', '緑因子'),
+    'red': ('red_factor_body', '赤因子'),
+    'parent': ('red_factor_parent', '赤因子'),
+    'overall': ('red_factor_overall', '赤因子'),
+    'white': ('required_skills', '白因子'),
+    'gene': ('required_genes', '遺伝子因子'),
+}
+KEY_ALIASES = {
+    'キャラ': 'chara', 'スコア': 'score',
+    '青': 'blue', '緑': 'green', '赤': 'red', '親': 'parent', '全体': 'overall', '白': 'white', '遺伝子': 'gene',
+}
+# anyN で「N個以上」にできる条件 (必須 → 選択)
+OPTIONAL_TYPES = {'required_skills': 'optional_skills', 'required_genes': 'optional_genes'}
+OPTIONAL_LABELS = {'optional_skills': '選択白スキル', 'optional_genes': '選択遺伝子'}
+FLAGS = {'mine': 'search_only_mine', '自分': 'search_only_mine', 'archive': 'include_archive', 'アーカイブ': 'include_archive'}
+
+_ITEM = re.compile(r'^(?P<name>.+?)(?:>=(?P<value>\d+))?$')
+_ANY = re.compile(r'^any(?P<count>\d+)$')
+
+
+def _resolve(name: str, name_to_id: dict):
+    """名前を辞書のIDにする。完全一致がなければ、画像認識と同じあいまい一致で探す"""
+    if name in name_to_id:
+        return name_to_id[name]
+    return image_processor.classify_factor_by_id(name, name_to_id, threshold=config.SEARCH_QUERY_MATCH_THRESHOLD)
+
+
+def _split_items(value: str) -> list:
+    items = []
+    for part in value.split(','):
+        match = _ITEM.match(part.strip())
+        if match:
+            items.append((match['name'], int(match['value']) if match['value'] else 1))
+    return items
+
+
+def parse(query: str, factor_dictionary: dict, char_name_to_id: dict, score_sheets) -> tuple:
+    """
+    テキストの検索条件を、検索ビルダーと同じ conditions の形にする。
+    例: chara:ファインモーション blue:スピード>=3 white:右回り>=2,コーナー回復>=1 any2 score:育成用>=120
+    直前の white / gene に any2 を付けると「2個以上」の選択条件になる。
+    (conditions, 自分の因子だけか, アーカイブも含めるか) を返す。読み取れない部分があればValueErrorを送出する。
+    """
+    # 全角の記号・数字・空白も受け付ける
+    tokens = unicodedata.normalize('NFKC', query).split()
+    names_by_type = defaultdict(dict)
+    for fid, finfo in factor_dictionary.items():
+        names_by_type[finfo['type']][finfo['name']] = fid
+    sheet_names = {name: name for name in score_sheets.keys()}
+    char_id_to_name = {char_id: name for name, char_id in char_name_to_id.items()}
+
+    conditions = defaultdict(list)
+    flags = {'search_only_mine': False, 'include_archive': False}
+    characters = {}
+    groups = []
+    errors = []
+    for token in tokens:
+        if token in FLAGS:
+            flags[FLAGS[token]] = True
+            continue
+        any_match = _ANY.match(token.lower())
+        if any_match:
+            count = int(any_match['count'])
+            if not groups or groups[-1]['type'] not in OPTIONAL_TYPES:
+                errors.append(f"`{token}` は white: か gene: の直後に書いてくださいまし。")
+            elif not 1 <= count <= len(groups[-1]['items']):
+                errors.append(f"`{token}` の個数は 1〜{len(groups[-1]['items'])} にしてくださいまし。")
+            else:
+                groups[-1]['count'] = count
+            continue
+        key, sep, value = token.partition(':')
+        key = KEY_ALIASES.get(key, key.lower())
+        if not sep or not value:
+            errors.append(f"`{token}` の意味が分かりませんでしたわ。")
+        elif key == 'chara':
+            for name in value.split(','):
+                char_id = _resolve(name.strip(), char_name_to_id)
+                if char_id is None:
+                    errors.append(f"キャラ `{name}` が見つかりませんでしたわ。")
+                else:
+                    characters[char_id] = char_id_to_name[char_id]
+        elif key == 'score':
+            for name, score in _split_items(value):
+                sheet = _resolve(name, sheet_names)
+                if sheet is None:
+                    errors.append(f"採点簿 `{name}` が見つかりませんでしたわ。")
+                else:
+                    conditions['score'].append({'type': 'score', 'sheet': sheet, 'score': score})
+        elif key in FACTOR_KEYS:
+            cond_type, factor_type = FACTOR_KEYS[key]
+            items = []
+            for name, stars in _split_items(value):
+                factor_id = _resolve(name, names_by_type[factor_type])
+                if factor_id is None:
+                    errors.append(f"{factor_type} `{name}` が見つかりませんでしたわ。")
+                else:
+                    items.append({'id': factor_id, 'stars': stars})
+            groups.append({'type': cond_type, 'items': items, 'count': None})
+        else:
+            errors.append(f"`{key}:` という条件はありませんわ。")
+
+    for group in groups:
+        cond_type, items = group['type'], group['items']
+        if group['count'] is not None:
+            optional_type = OPTIONAL_TYPES[cond_type]
+            if conditions.get(optional_type):
+                errors.append(f"{OPTIONAL_LABELS[optional_type]}の any は1つだけにしてくださいまし。")
+            conditions[optional_type].append({'type': optional_type, 'items': items, 'count': group['count']})
+        elif not items:
+            continue
+        elif cond_type.startswith('red_factor'):
+            conditions[cond_type].extend(items)
+        else:
+            conditions[cond_type].extend({'type': cond_type, 'items': [item]} for item in items)
+    if characters:
+        conditions['characters'] = [{'type': 'characters', 'items': [{'id': cid, 'name': name} for cid, name in characters.items()]}]
+    if errors:
+        raise ValueError("\n".join(errors))
+    return conditions, flags['search_only_mine'], flags['include_archive']
@@ -0,0 +1,74 @@
+import os
+import time
+import traceback
+
+import msgpack
+import pandas as pd
+
+# スナップショットの形式を変えたら上げる。違う版のファイルは読み込まずに捨てる
+SNAPSHOT_VERSION = 1
+
+
+def _frame_to_dict(df: pd.DataFrame) -> dict:
+    df = df.astype(object).where(df.notna(), None)
+    return {'columns': [str(c) for c in df.columns], 'rows': df.values.tolist()}
+
+
+def _dict_to_frame(data: dict) -> pd.DataFrame:
+    return pd.DataFrame(data['rows'], columns=data['columns'])
+
+
+def save_snapshot(path: str, reference: dict, tables=None):
+    """
+    辞書・採点簿とデータベースの内容を、msgpack形式のスナップショットファイルに書き出す。
+    一時ファイルに書いてから置き換えるので、途中で落ちても壊れたファイルは残らない。
+    """
+    payload = {
+        'version': SNAPSHOT_VERSION,
+        'saved_at': time.time(),
+        'reference': {
+            'factor_dictionary': reference['factor_dictionary'],
+            'factor_name_to_id': reference['factor_name_to_id'],
+            'character_data': reference['character_data'],
+            'char_name_to_id': reference['char_name_to_id'],
+            'score_sheets': {name: dict(sheet) for name, sheet in reference['score_sheets'].items()},
+        },
+        'database': None,
+    }
+    if tables is not None:
+        payload['database'] = {
+            'loaded_at': tables.loaded_at,
+            'summary': _frame_to_dict(tables.all_summary_df),
+            'factors': _frame_to_dict(tables.all_factors_df),
+        }
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(msgpack.packb(payload, use_bin_type=True))
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path: str):
+    """
+    スナップショットファイルを読み込み、(辞書・採点簿の辞書, データベースの辞書) を返す。
+    ファイルが無い・版が違う・壊れている場合は (None, None) を返す。
+    """
+    if not os.path.exists(path):
+        return None, None
+    try:
+        with open(path, 'rb') as f:
+            payload = msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+        if payload.get('version') != SNAPSHOT_VERSION:
+            print(f"情報: スナップショットの版({payload.get('version')})が違うため、読み込みません。")
+            return None, None
+        database = payload.get('database')
+        if database is not None:
+            database = {
+                'loaded_at': database['loaded_at'],
+                'summary_df': _dict_to_frame(database['summary']),
+                'factors_df': _dict_to_frame(database['factors']),
+            }
+        return payload['reference'], database
+    except Exception as e:
+        print(f"スナップショットの読み込み中にエラー: {e}")
+        traceback.print_exc()
+        return None, None
@@ -0,0 +1,367 @@
+import sqlite3
+import threading
+import traceback
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import config
+import database
+import factor_tables
+
+
+class StorageBackend(ABC):
+    """
+    因子データの保存先の共通インターフェース。
+    足りないメソッドがある保存先は作る時点でエラーになる。
+    どのメソッドも同期的にブロックするので、async_database経由でスレッドプールから呼ぶこと。
+    """
+    name = 'base'
+
+    @abstractmethod
+    def load_all(self):
+        """(評価サマリー, 因子データ) を、削除済みを除いた型変換済みのDataFrameで返す"""
+
+    @abstractmethod
+    def insert_individual(self, summary_row: dict, factor_rows: list):
+        """1体分の行を追加する。成功すれば個体ID、失敗すればNoneを返す"""
+
+    @abstractmethod
+    def update_fields(self, individual_id: str, updates: dict, write_queue=None, add_missing_headers: bool = False):
+        """評価サマリーの列をまとめて更新する。値がNoneの項目は更新しない"""
+
+    @abstractmethod
+    def delete(self, individual_id: str, user_id: int, is_admin: bool, write_queue=None):
+        """所有者本人か管理者なら削除する。(成功したか, メッセージ) を返す"""
+
+    @abstractmethod
+    def bulk_update_scores(self, score_sheets, sheet_names: list = None, write_queue=None) -> int:
+        """全個体の合計スコアを計算し直す。対象になった個体の数を返す"""
+
+    @abstractmethod
+    def compact(self, write_queue=None) -> int:
+        """
+        削除済みの印が付いた個体を実際に削除する。削除した個体の数を返す。
+        行や列を消すメソッド (delete・bulk_update_scores・compact) に渡されるwrite_queueは、
+        呼び出し側で空にしてあり、戻るまで新しい書き込みは積まれない。
+        """
+
+    def stats(self) -> dict:
+        return {'backend': self.name}
+
+
+class SheetsBackend(StorageBackend):
+    """今までどおり、Googleスプレッドシートに直接読み書きする"""
+    name = 'sheets'
+
+    def __init__(self, gspread_client):
+        self.gspread_client = gspread_client
+
+    def load_all(self):
+        return database.get_full_database(self.gspread_client)
+
+    def insert_individual(self, summary_row: dict, factor_rows: list):
+        return database.insert_individual(self.gspread_client, summary_row, factor_rows)
+
+    def update_fields(self, individual_id: str, updates: dict, write_queue=None, add_missing_headers: bool = False):
+        return database.update_summary_fields(self.gspread_client, individual_id, updates, write_queue=write_queue, add_missing_headers=add_missing_headers)
+
+    def delete(self, individual_id: str, user_id: int, is_admin: bool, write_queue=None):
+        return database.delete_factor_by_id(self.gspread_client, individual_id, user_id, is_admin)
+
+    def bulk_update_scores(self, score_sheets, sheet_names: list = None, write_queue=None) -> int:
+        return database.recalculate_all_scores(self.gspread_client, score_sheets, sheet_names)
+
+    def compact(self, write_queue=None) -> int:
+        return database.compact_deleted_rows(self.gspread_client)
+
+
+def _quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    ローカルのSQLiteファイルに保存する。評価サマリーの列はスプレッドシートと同じく、必要になった時点で追加する。
+    値はスプレッドシートと同じく文字列で持ち、型変換は読み込み時にfactor_tablesで行う。
+    """
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS summary ("個体ID" TEXT PRIMARY KEY)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS factors ("個体ID" TEXT NOT NULL, "因子ID" TEXT NOT NULL, '
+                '"因子名" TEXT, "因子の種類" TEXT, "星の数" INTEGER NOT NULL DEFAULT 0)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS factors_by_individual ON factors ("個体ID")')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS factors_by_factor ON factors ("因子ID", "星の数")')
+        self._columns = [row[1] for row in self._conn.execute('PRAGMA table_info(summary)')]
+        self._ensure_columns(['所有者ID'])
+
+    def _ensure_columns(self, columns):
+        """評価サマリーに無い列を末尾に追加する"""
+        with self._lock, self._conn:
+            for col in columns:
+                if col in self._columns:
+                    continue
+                self._conn.execute(f'ALTER TABLE summary ADD COLUMN {_quote(col)} TEXT')
+                self._columns.append(col)
+                if col == '所有者ID':
+                    self._conn.execute('CREATE INDEX IF NOT EXISTS summary_by_owner ON summary ("所有者ID")')
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM summary').fetchone()[0] == 0
+
+    def load_all(self):
+        with self._lock:
+            summary_df = pd.read_sql_query('SELECT * FROM summary ORDER BY rowid', self._conn)
+            factors_df = pd.read_sql_query('SELECT "個体ID", "因子ID", "因子名", "因子の種類", "星の数" FROM factors ORDER BY rowid', self._conn)
+        summary_df = factor_tables.apply_summary_schema(summary_df.fillna(''))
+        factors_df = factor_tables.apply_factors_schema(factors_df)
+        tables = factor_tables.publish(summary_df, factors_df, source=self.name)
+        return tables.summary_df, tables.factors_df
+
+    def import_frames(self, summary_df: pd.DataFrame, factors_df: pd.DataFrame):
+        """読み込み済みのDataFrameの内容で、SQLiteの中身をまるごと置き換える"""
+        summary_df = summary_df.astype(object).where(summary_df.notna(), None)
+        self._ensure_columns([str(c) for c in summary_df.columns])
+        columns = ', '.join(_quote(c) for c in summary_df.columns)
+        placeholders = ', '.join('?' for _ in summary_df.columns)
+        summary_rows = [[None if v is None else str(v) for v in row] for row in summary_df.values.tolist()]
+        factor_rows = [
+            (str(row['個体ID']), str(row['因子ID']), str(row.get('因子名', '') or ''), str(row.get('因子の種類', '') or ''), int(row['星の数']))
+            for row in factors_df.to_dict('records')
+        ]
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM summary')
+            self._conn.execute('DELETE FROM factors')
+            self._conn.executemany(f'INSERT OR REPLACE INTO summary ({columns}) VALUES ({placeholders})', summary_rows)
+            self._conn.executemany('INSERT INTO factors VALUES (?, ?, ?, ?, ?)', factor_rows)
+        print(f"SQLiteに {len(summary_rows)}件・因子 {len(factor_rows)}行を取り込みました。")
+
+    def insert_individual(self, summary_row: dict, factor_rows: list):
+        try:
+            individual_id = str(summary_row['個体ID'])
+            self._ensure_columns(list(summary_row))
+            columns = ', '.join(_quote(c) for c in summary_row)
+            placeholders = ', '.join('?' for _ in summary_row)
+            values = [None if v is None else str(v) for v in summary_row.values()]
+            with self._lock, self._conn:
+                self._conn.execute(f'INSERT OR REPLACE INTO summary ({columns}) VALUES ({placeholders})', values)
+                self._conn.execute('DELETE FROM factors WHERE "個体ID" = ?', (individual_id,))
+                self._conn.executemany(
+                    'INSERT INTO factors VALUES (?, ?, ?, ?, ?)',
+                    [(str(row[0]), str(row[1]), row[2], row[3], int(row[4] or 0)) for row in factor_rows]
+                )
+            factor_tables.append_individual(summary_row, factor_rows)
+            print(f"ID:{individual_id} の評価結果をSQLiteに記録しました。")
+            return individual_id
+        except Exception as e:
+            print(f"SQLiteへの記録中にエラーが発生: {e}")
+            traceback.print_exc()
+            return None
+
+    def update_fields(self, individual_id: str, updates: dict, write_queue=None, add_missing_headers: bool = False):
+        try:
+            updates = {k: v for k, v in updates.items() if v is not None}
+            if add_missing_headers:
+                self._ensure_columns(list(updates))
+            updates = {k: v for k, v in updates.items() if k in self._columns}
+            with self._lock, self._conn:
+                if not updates:
+                    return self._conn.execute('SELECT 1 FROM summary WHERE "個体ID" = ?', (str(individual_id),)).fetchone() is not None
+                assignments = ', '.join(f'{_quote(k)} = ?' for k in updates)
+                cursor = self._conn.execute(
+                    f'UPDATE summary SET {assignments} WHERE "個体ID" = ?',
+                    [str(v) for v in updates.values()] + [str(individual_id)]
+                )
+            if cursor.rowcount == 0:
+                print(f"エラー: 更新対象の因子 ID {individual_id} が見つかりませんでした。")
+                return False
+            factor_tables.update_fields(individual_id, updates)
+            return True
+        except Exception as e:
+            print(f"SQLiteの更新中にエラーが発生: {e}")
+            traceback.print_exc()
+            return False
+
+    def delete(self, individual_id: str, user_id: int, is_admin: bool, write_queue=None):
+        try:
+            with self._lock:
+                row = self._conn.execute('SELECT "所有者ID" FROM summary WHERE "個体ID" = ?', (individual_id,)).fetchone()
+            if row is None:
+                return False, "指定されたIDの因子が見つかりませんでしたわ。"
+            if not is_admin and str(row[0] or '') != str(user_id):
+                return False, "ご自身の因子以外は削除できませんことよ。"
+
+            if config.SOFT_DELETE:
+                self._ensure_columns([factor_tables.TOMBSTONE_COLUMN])
+                with self._lock, self._conn:
+                    self._conn.execute(f'UPDATE summary SET {_quote(factor_tables.TOMBSTONE_COLUMN)} = ? WHERE "個体ID" = ?', ('TRUE', individual_id))
+                factor_tables.mark_deleted([individual_id])
+            else:
+                with self._lock, self._conn:
+                    self._conn.execute('DELETE FROM summary WHERE "個体ID" = ?', (individual_id,))
+                    self._conn.execute('DELETE FROM factors WHERE "個体ID" = ?', (individual_id,))
+                factor_tables.remove_individuals([individual_id])
+            return True, f"個体ID `{individual_id}` の因子を削除いたしましたわ。"
+        except Exception as e:
+            print(f"因子削除中にエラーが発生: {e}"); traceback.print_exc()
+            return False, f"削除中にエラーが発生いたしました: {e}"
+
+    def bulk_update_scores(self, score_sheets, sheet_names: list = None, write_queue=None) -> int:
+        with self._lock:
+            individual_ids = [row[0] for row in self._conn.execute('SELECT "個体ID" FROM summary ORDER BY rowid')]
+            factors_df = pd.read_sql_query('SELECT "個体ID", "因子ID", "星の数" FROM factors', self._conn)
+        if not individual_ids:
+            return 0
+        totals = score_sheets.score_factors_df(factors_df, individual_ids)
+        target_sheets = list(score_sheets.keys()) if sheet_names is None else [n for n in sheet_names if n in score_sheets]
+        self._ensure_columns([f"合計({name})" for name in target_sheets])
+        with self._lock, self._conn:
+            for sheet_name in target_sheets:
+                self._conn.executemany(
+                    f'UPDATE summary SET {_quote(f"合計({sheet_name})")} = ? WHERE "個体ID" = ?',
+                    [(str(score), individual_id) for individual_id, score in zip(individual_ids, totals[sheet_name].tolist())]
+                )
+        print(f"スコア再計算 (SQLite): {len(individual_ids)}件 × {len(target_sheets)}列を更新しました。")
+        return len(individual_ids)
+
+    def compact(self, write_queue=None) -> int:
+        if factor_tables.TOMBSTONE_COLUMN not in self._columns:
+            return 0
+        flag = _quote(factor_tables.TOMBSTONE_COLUMN)
+        with self._lock, self._conn:
+            deleted_ids = [row[0] for row in self._conn.execute(f'SELECT "個体ID" FROM summary WHERE {flag} = ?', ('TRUE',))]
+            self._conn.execute(f'DELETE FROM factors WHERE "個体ID" IN (SELECT "個体ID" FROM summary WHERE {flag} = ?)', ('TRUE',))
+            self._conn.execute(f'DELETE FROM summary WHERE {flag} = ?', ('TRUE',))
+        if deleted_ids:
+            factor_tables.remove_individuals(deleted_ids)
+        return len(deleted_ids)
+
+
+class MirroredBackend(StorageBackend):
+    """
+    SQLiteを正として読み書きし、スプレッドシートには専用のスレッドで後から同じ変更を書き写す。
+    書き写しは1本のスレッドで順番に行うので、追加より先に更新が届くことはない。
+    """
+    name = 'sqlite+sheets'
+
+    def __init__(self, primary: SQLiteBackend, mirror: SheetsBackend):
+        self.primary = primary
+        self.mirror = mirror
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets-mirror")
+        self._pending_lock = threading.Lock()
+        self.pending = 0
+        self.failures = 0
+
+    def _mirror(self, func, *args, **kwargs):
+        with self._pending_lock:
+            self.pending += 1
+        self._executor.submit(self._run_mirror, func, *args, **kwargs)
+
+    def _mirror_structural(self, write_queue, func, *args, **kwargs):
+        """
+        行や列を消す書き写しを、それより前の書き写しの後に実行し、終わるまで待つ。
+        呼び出し側 (async_database) がロックを持っている間に終わらせないと、
+        キューに積まれた書き込みの行・列の位置がずれてしまう。
+        """
+        def run():
+            # 先に書き写した更新がキューに積んだ書き込みを、行や列を消す前に送っておく
+            if write_queue is not None:
+                write_queue.enqueue("", []).result()
+            return func(*args, **kwargs)
+        run.__name__ = func.__name__
+        with self._pending_lock:
+            self.pending += 1
+        self._executor.submit(self._run_mirror, run).result()
+
+    def _run_mirror(self, func, *args, **kwargs):
+        try:
+            result = func(*args, **kwargs)
+            if result is False or (isinstance(result, tuple) and result and result[0] is False):
+                self.failures += 1
+                print(f"警告: スプレッドシートへの書き写し({func.__name__})が失敗しました: {result}")
+        except Exception as e:
+            self.failures += 1
+            print(f"スプレッドシートへの書き写し中にエラー: {e}")
+            traceback.print_exc()
+        finally:
+            with self._pending_lock:
+                self.pending -= 1
+
+    def load_all(self):
+        if self.primary.is_empty():
+            # 初めて起動したときは、スプレッドシートの内容をSQLiteに取り込んでから使う
+            print("SQLiteが空なので、スプレッドシートから取り込むで...")
+            self.mirror.load_all()
+            tables = factor_tables.current()
+            self.primary.import_frames(tables.all_summary_df, tables.all_factors_df)
+        return self.primary.load_all()
+
+    def insert_individual(self, summary_row: dict, factor_rows: list):
+        individual_id = self.primary.insert_individual(summary_row, factor_rows)
+        if individual_id is not None:
+            self._mirror(self.mirror.insert_individual, summary_row, factor_rows)
+        return individual_id
+
+    def update_fields(self, individual_id: str, updates: dict, write_queue=None, add_missing_headers: bool = False):
+        result = self.primary.update_fields(individual_id, updates, add_missing_headers=add_missing_headers)
+        if result:
+            self._mirror(self.mirror.update_fields, individual_id, updates, write_queue=write_queue, add_missing_headers=add_missing_headers)
+        return result
+
+    def delete(self, individual_id: str, user_id: int, is_admin: bool, write_queue=None):
+        success, message = self.primary.delete(individual_id, user_id, is_admin)
+        if success:
+            # 権限はSQLite側で確認済み。印を付けるだけなら行はずれないので、待たずに書き写す
+            if config.SOFT_DELETE:
+                self._mirror(self.mirror.delete, individual_id, user_id, True)
+            else:
+                self._mirror_structural(write_queue, self.mirror.delete, individual_id, user_id, True)
+        return success, message
+
+    def bulk_update_scores(self, score_sheets, sheet_names: list = None, write_queue=None) -> int:
+        count = self.primary.bulk_update_scores(score_sheets, sheet_names)
+        # 使われなくなった採点簿の列を消すことがある
+        self._mirror_structural(write_queue, self.mirror.bulk_update_scores, score_sheets, sheet_names)
+        return count
+
+    def compact(self, write_queue=None) -> int:
+        count = self.primary.compact()
+        self._mirror_structural(write_queue, self.mirror.compact)
+        return count
+
+    def stats(self) -> dict:
+        return {'backend': self.name, 'mirror_pending': self.pending, 'mirror_failures': self.failures}
+
+
+_backend: StorageBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_backend(gspread_client) -> StorageBackend:
+    """config.STORAGE_BACKENDに応じた保存先を返す (最初の呼び出しで1つだけ作る)"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if config.STORAGE_BACKEND == "sheets":
+                _backend = SheetsBackend(gspread_client)
+            elif config.STORAGE_BACKEND == "sqlite":
+                _backend = SQLiteBackend(config.SQLITE_PATH)
+            elif config.STORAGE_BACKEND == "sqlite+sheets":
+                _backend = MirroredBackend(SQLiteBackend(config.SQLITE_PATH), SheetsBackend(gspread_client))
+            else:
+                raise ValueError(f"不明な保存先です: {config.STORAGE_BACKEND}")
+            print(f"因子データの保存先: {_backend.name}")
+        return _backend
+
+
+def stats() -> dict | None:
+    return _backend.stats() if _backend is not None else None
@@ -1,9 +1,10 @@
 import discord
 from discord import ui
-import pandas as pd
+import numpy as np
 import traceback
 from .ranking_view import RankingView
-import database
+import async_database
+import result_sessions
 
 # 循環参照を避けるための書き方
 from typing import TYPE_CHECKING
@@ -74,25 +75,27 @@ class RankingBuilderView(ui.View):
     async def on_confirm(self, interaction: discord.Interaction):
         await interaction.response.defer()
         try:
-            summary_df, _ = database.get_full_database(self.bot_client.gspread_client)
-            target_df = summary_df.copy()
+            summary_df, _ = await async_database.get_full_database(self.bot_client.gspread_client)
+            # 評価サマリーは切り出さず、行位置だけで絞り込んで並べる
+            target_rows = np.arange(len(summary_df))
             if self.selected_usage != "*all":
-                target_df = target_df[target_df['用途'] == self.selected_usage]
-            if target_df.empty:
+                target_rows = (summary_df['用途'] == self.selected_usage).to_numpy().nonzero()[0]
+            if not len(target_rows):
                 return await interaction.followup.send(f"「{self.selected_usage}」の用途が設定された因子は見つかりませんでしたわ。", ephemeral=True)
             score_col = f"合計({self.selected_sheet})"
-            if score_col not in target_df.columns:
+            if score_col not in summary_df.columns:
                 return await interaction.followup.send(f"「{self.selected_sheet}」のスコアデータが存在しないようですわ。", ephemeral=True)
-            target_df[score_col] = pd.to_numeric(target_df[score_col], errors='coerce')
-            target_df.dropna(subset=[score_col], inplace=True)
-            ranking_df = target_df.sort_values(by=score_col, ascending=False)
             server_ids = {str(m.id) for m in interaction.guild.members}
-            ranking_df = ranking_df[ranking_df['所有者ID'].isin(server_ids)]
-            ranking_df.drop_duplicates(subset=['所有者ID'], keep='first', inplace=True)
-            if ranking_df.empty:
+            target_rows = target_rows[summary_df['所有者ID'].iloc[target_rows].isin(server_ids).to_numpy()]
+            # スコアの高い順 (同点は元の順)。所有者ごとに一番高い1件だけを残す
+            scores = summary_df[score_col].to_numpy()[target_rows].astype(np.float64)
+            ranked_rows = target_rows[np.lexsort((target_rows, -scores))]
+            ranked_rows = ranked_rows[~summary_df['所有者ID'].iloc[ranked_rows].duplicated(keep='first').to_numpy()]
+            if not len(ranked_rows):
                 return await interaction.followup.send("条件に一致するランキングデータが見つかりませんでしたわ。", ephemeral=True)
 
-            view = RankingView(self.bot_client, self.author, ranking_df.head(20), self.selected_sheet, self.factor_dictionary, self)
+            session = result_sessions.manager.open(summary_df, ranked_rows[:20])
+            view = RankingView(self.bot_client, self.author, session, self.selected_sheet, self.factor_dictionary, self)
             await interaction.edit_original_response(content=None, embed=view.create_embed(), view=view)
         except Exception as e:
             await interaction.edit_original_response(content=f"ランキングの表示中にエラーが発生しました: {e}", view=None, embed=None)
@@ -2,6 +2,7 @@ import discord
 from discord import ui, Color, ButtonStyle, Embed
 import pandas as pd
 import config
+import result_sessions
 from .ui_helpers import create_themed_embed
 # ✨ RankingBuilderViewを循環参照しないようにインポート
 from typing import TYPE_CHECKING
@@ -11,11 +12,12 @@ if TYPE_CHECKING:
 
 class RankingView(ui.View):
     # ✨ 引数にbot_clientとbuilder_viewを追加
-    def __init__(self, bot_client: "FactorBotClient", author, ranking_df: pd.DataFrame, sheet_name: str, factor_dictionary: dict, builder_view: "RankingBuilderView"):
+    def __init__(self, bot_client: "FactorBotClient", author, session: result_sessions.ResultSession, sheet_name: str, factor_dictionary: dict, builder_view: "RankingBuilderView"):
         super().__init__(timeout=600)
         self.bot_client = bot_client
         self.author = author
-        self.ranking_df = ranking_df.reset_index(drop=True)
+        # 順位の順に並んだ、共有の評価サマリーの行位置
+        self.session = session
         self.sheet_name = sheet_name
         self.factor_dictionary = factor_dictionary
         # ✨ builder_viewを保存しておく
@@ -23,9 +25,17 @@ class RankingView(ui.View):
         self.current_index = 0
         self.update_components()
 
+    async def on_timeout(self):
+        result_sessions.manager.close(self.session)
+
     def update_components(self):
         self.clear_items()
-        total = len(self.ranking_df)
+        if self.session.expired:
+            back_button = ui.Button(label="🔄 条件を再指定する", style=ButtonStyle.secondary, row=0)
+            back_button.callback = self.back_to_builder
+            self.add_item(back_button)
+            return
+        total = len(self.session)
         # (ページ送りボタンの作成部分は変更なし)
         is_first_page = self.current_index == 0
         is_last_page = self.current_index >= total - 1
@@ -47,12 +57,15 @@ class RankingView(ui.View):
 
     # (create_embed と navigate_results は変更なし)
     def create_embed(self) -> Embed:
-        if self.ranking_df.empty:
+        result_sessions.manager.touch(self.session)
+        if self.session.expired:
+            return Embed(title=f"{self.sheet_name} ハイスコアランキング", description="しばらく操作がなかったので、このランキングは片付けてしまいましたわ。\nお手数ですが、条件をもう一度指定してくださいまし。", color=Color.gold())
+        if self.session.empty:
             return Embed(...)
         # (中身が長いので省略... この関数の中は変更せんでええで)
         top_ranks_text = []
         rank_emojis = ["🥇", "🥈", "🥉"]
-        for i, row in self.ranking_df.head(5).iterrows():
+        for i, row in self.session.head(5).iterrows():
             emoji = rank_emojis[i] if i < 3 else f"`{i+1}`位"
             owner_name = row.get('所有者メモ', row.get('投稿者名', '不明')).replace('サーバーメンバー: ', '')
             score = row.get(f"合計({self.sheet_name})", 'N/A')
@@ -64,7 +77,7 @@ class RankingView(ui.View):
             description="\n".join(top_ranks_text),
             color=Color.gold()
         )
-        current_row = self.ranking_df.iloc[self.current_index]
+        current_row = self.session.row(self.current_index)
         owner_name = current_row.get('所有者メモ', current_row.get('投稿者名', '不明')).replace('サーバーメンバー: ', '')
         score = current_row.get(f"合計({self.sheet_name})", 'N/A')
         char_name = current_row.get('キャラ名', '不明')
@@ -85,8 +98,8 @@ class RankingView(ui.View):
         btn_id = interaction.data['custom_id']
         if btn_id == "go_first": self.current_index = 0
         elif btn_id == "go_prev": self.current_index = max(0, self.current_index - 1)
-        elif btn_id == "go_next": self.current_index = min(len(self.ranking_df) - 1, self.current_index + 1)
-        elif btn_id == "go_last": self.current_index = len(self.ranking_df) - 1
+        elif btn_id == "go_next": self.current_index = min(len(self.session) - 1, self.current_index + 1)
+        elif btn_id == "go_last": self.current_index = len(self.session) - 1
         self.update_components()
         await interaction.edit_original_response(embed=self.create_embed(), view=self)
         
@@ -94,6 +107,7 @@ class RankingView(ui.View):
     async def back_to_builder(self, interaction: discord.Interaction):
         # 循環参照を避けるため、ここでインポートする
         from .ranking_builder_view import RankingBuilderView
+        result_sessions.manager.close(self.session)
         # 保存しておいた初期の選択肢リストを使って、新しい選択画面を作り直す
         new_builder_view = RankingBuilderView(
             self.bot_client,
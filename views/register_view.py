@@ -1,6 +1,6 @@
 import discord
 from discord import ui, Interaction, ButtonStyle, TextStyle, SelectOption, Embed
-import gspread
+import traceback
 
 class SetOwnerView(ui.View):
     def __init__(self, gspread_client, individual_id: str, author: discord.User, factor_dictionary: dict):
@@ -10,26 +10,8 @@ class SetOwnerView(ui.View):
         self.author = author
         self.factor_dictionary = factor_dictionary
 
-    async def update_db_owner(self, user_id: str, memo: str):
-        try:
-            spreadsheet = self.gspread_client.open("因子評価データベース")
-            summary_sheet = spreadsheet.worksheet("評価サマリー")
-            cell = summary_sheet.find(str(self.individual_id), in_column=1)
-            if not cell: return False
-            headers = summary_sheet.row_values(1)
-            cells_to_update = []
-            updates = {'所有者ID': user_id, '所有者メモ': memo}
-            for header, value in updates.items():
-                if header in headers:
-                    col_index = headers.index(header) + 1
-                    cells_to_update.append(gspread.Cell(row=cell.row, col=col_index, value=str(value)))
-            if cells_to_update:
-                summary_sheet.update_cells(cells_to_update)
-            return True
-        except Exception as e:
-            print(f"DBオーナー更新中にエラー: {e}")
-            traceback.print_exc()
-            return False
+    async def update_db_owner(self, interaction: Interaction, user_id: str, memo: str):
+        return await interaction.client.update_summary_fields(self.individual_id, {'所有者ID': user_id, '所有者メモ': memo})
 
     async def show_details_editor(self, interaction: Interaction, confirmation_message: str):
         original_embed = interaction.message.embeds[0]
@@ -45,7 +27,7 @@ class SetOwnerView(ui.View):
     async def set_self_callback(self, interaction: Interaction, button: ui.Button):
         author_user = self.author
         await interaction.response.defer()
-        success = await self.update_db_owner(str(author_user.id), f"サーバーメンバー: {author_user.display_name}")
+        success = await self.update_db_owner(interaction, str(author_user.id), f"サーバーメンバー: {author_user.display_name}")
         if success:
             from bot import check_rank_in
             await interaction.client.check_rank_in(interaction, self.gspread_client, self.individual_id, author_user)
@@ -57,7 +39,7 @@ class SetOwnerView(ui.View):
     async def user_select_callback(self, interaction: Interaction, select: ui.UserSelect):
         await interaction.response.defer()
         selected_user = select.values[0]
-        success = await self.update_db_owner(str(selected_user.id), f"サーバーメンバー: {selected_user.display_name}")
+        success = await self.update_db_owner(interaction, str(selected_user.id), f"サーバーメンバー: {selected_user.display_name}")
         if success:
             from bot import check_rank_in
             await interaction.client.check_rank_in(interaction, self.gspread_client, self.individual_id, selected_user)
@@ -118,24 +100,10 @@ class DetailsEditView(ui.View):
     async def confirm_button_callback(self, interaction: Interaction, button: ui.Button):
         try:
             await interaction.response.defer(ephemeral=True)
-            spreadsheet = self.gspread_client.open("因子評価データベース")
-            summary_sheet = spreadsheet.worksheet("評価サマリー")
-            cell = summary_sheet.find(str(self.individual_id), in_column=1)
-            
-            if not cell:
-                return await interaction.followup.send("エラー: 更新対象の因子が見つかりませんでした。", ephemeral=True)
-
             updates = {'用途': self.purpose, 'レースローテ': self.race_route, 'メモ': self.memo}
-            headers = summary_sheet.row_values(1)
-            cells_to_update = []
-            
-            for header, value in updates.items():
-                if value is not None and header in headers:
-                    col_index = headers.index(header) + 1
-                    cells_to_update.append(gspread.Cell(row=cell.row, col=col_index, value=value))
-            
-            if cells_to_update:
-                summary_sheet.update_cells(cells_to_update)
+            success = await interaction.client.update_summary_fields(self.individual_id, updates)
+            if not success:
+                return await interaction.followup.send("エラー: 更新対象の因子が見つかりませんでした。", ephemeral=True)
 
             await interaction.edit_original_response(content="✅ **詳細情報、確かに記録いたしました！**", view=None)
 
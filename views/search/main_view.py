@@ -1,16 +1,29 @@
 import discord
 from discord import ui, Interaction, Embed, Color, ButtonStyle
 from collections import defaultdict
-import pandas as pd
+import time
 import traceback
 
 import config
+import async_database
+import factor_tables
+import query_engine
+import result_sessions
 from ..ui_helpers import create_themed_embed
 from .results_view import SearchResultView
 from .browser_view import ItemBrowserView
 from .editors import SingleFactorEditView, RedFactorEditorView
 from .modals import ScoreSheetSelectView
 
+# 件数のプレビューで使う、条件の種類の表示名
+CONDITION_LABELS = {
+    'characters': 'キャラ名', 'score': 'スコア',
+    'red_factor_body': '本体の赤因子', 'red_factor_parent': '親の赤因子', 'red_factor_overall': '全体の赤因子',
+    'blue_factors': '青因子', 'green_factors': '緑因子',
+    'required_skills': '必須白スキル', 'optional_skills': '選択白スキル',
+    'required_genes': '必須遺伝子', 'optional_genes': '選択遺伝子',
+}
+
 class SearchView(ui.View):
     def __init__(self, gspread_client, author, message: discord.WebhookMessage, factor_dictionary: dict, character_data: dict, score_sheets: dict, character_list_sorted: list, conditions=None):
         super().__init__(timeout=1200) 
@@ -23,8 +36,37 @@ class SearchView(ui.View):
         self.character_list_sorted = character_list_sorted
         self.conditions = conditions if conditions is not None else defaultdict(list)
         self.search_only_mine = False
+        self.include_archive = False
         self.skill_cart = {} 
         self.character_cart = {}
+        self.prefetch = None
+        self.prefetch_started_at = 0.0
+
+    def start_prefetch(self):
+        """条件を組み立てている間に、データベースの読み込みを始めておく"""
+        if self.prefetch is None:
+            self.prefetch = async_database.prefetch_full_database(self.gspread_client)
+            self.prefetch_started_at = time.monotonic()
+
+    async def load_database(self):
+        """
+        先読みしておいた結果があればそれを使い、なければ今から読み込む。
+        先読みから時間が経ちすぎたときや、その後に新しい世代 (登録・削除など) ができたときは読み込み直す。
+        """
+        task, self.prefetch = self.prefetch, None
+        if task is not None:
+            try:
+                summary_df, factors_df = await task
+                tables = factor_tables.current()
+                if time.monotonic() - self.prefetch_started_at > config.SEARCH_PREFETCH_MAX_AGE:
+                    print("先読みしたデータベースが古くなったため、読み込み直します。")
+                elif tables is not None and tables.summary_df is not summary_df:
+                    print("先読みの後にデータベースが更新されたため、読み込み直します。")
+                else:
+                    return summary_df, factors_df
+            except Exception as e:
+                print(f"先読みしたデータベースが使えないため、読み込み直します: {e}")
+        return await async_database.get_full_database(self.gspread_client)
 
     def create_embed(self):
         embed = create_themed_embed(
@@ -92,8 +134,24 @@ class SearchView(ui.View):
             if conditions_blocks:
                 embed.add_field(name="🍀 現在の検索条件", value="\n\n".join(conditions_blocks), inline=False)
 
+        self.add_preview_field(embed)
         return embed
 
+    def add_preview_field(self, embed: Embed):
+        """最後に読み込んだ内容で、今の条件に当てはまる件数をEmbedに表示する (シートには問い合わせない)"""
+        try:
+            index = query_engine.current_index(self.include_archive)
+            if index is None:
+                return
+            owner_id = str(self.author.id) if self.search_only_mine else None
+            total, counts = index.preview(self.conditions, owner_id=owner_id, cache=query_engine.result_cache)
+            lines = [f"現在の条件で **{total}件** 見つかりそうですわ。"]
+            lines += [f"- {CONDITION_LABELS.get(cond_type, cond_type)}だけなら {count}件" for cond_type, count in counts.items()]
+            embed.add_field(name="🔎 該当件数の目安", value="\n".join(lines), inline=False)
+        except Exception as e:
+            print(f"件数のプレビュー中にエラー: {e}")
+            traceback.print_exc()
+
     def add_condition(self, condition):
         if condition['type'] == 'characters':
             self.conditions[condition['type']] = [condition]
@@ -149,6 +207,17 @@ class SearchView(ui.View):
     async def add_optional_gene_factor(self, interaction: Interaction, button: ui.Button):
         await self.switch_to_browser(interaction, '遺伝子因子', 'optional_genes')
 
+    @ui.button(label="アーカイブも含める", style=ButtonStyle.secondary, row=3)
+    async def toggle_include_archive(self, interaction: Interaction, button: ui.Button):
+        self.include_archive = not self.include_archive
+        if self.include_archive:
+            button.label = "✅ アーカイブも含める"
+            button.style = ButtonStyle.success
+        else:
+            button.label = "アーカイブも含める"
+            button.style = ButtonStyle.secondary
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
     @ui.button(label="🗑️ 条件を削除", style=ButtonStyle.secondary, row=4)
     async def delete_condition_button(self, interaction: Interaction, button: ui.Button):
         if not self.conditions:
@@ -166,146 +235,49 @@ class SearchView(ui.View):
         else:
             button.label = "自分の因子に絞り込む"
             button.style = ButtonStyle.secondary
-        await interaction.response.edit_message(view=self)
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
     
     @ui.button(label="🍀 検索実行", style=ButtonStyle.success, row=4)
     async def execute_search(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.defer()
+        await self.run_search()
+
+    async def run_search(self):
+        """今の条件で検索し、self.messageを結果の画面に書き換える"""
         await self.message.edit(content="データベースを検索中です…", view=None, embed=None)
 
         try:
-            spreadsheet = self.gspread_client.open("因子評価データベース")
-            summary_sheet = spreadsheet.worksheet("評価サマリー")
-            factors_sheet = spreadsheet.worksheet("因子データ")
-            summary_df = pd.DataFrame(summary_sheet.get_all_records(numericise_ignore=['all']))
-            factors_df = pd.DataFrame(factors_sheet.get_all_records(numericise_ignore=['all']))
+            summary_df, factors_df = await self.load_database()
+            if self.include_archive:
+                archive_summary_df, archive_factors_df = await async_database.get_archive_database(self.gspread_client)
+                if not archive_summary_df.empty:
+                    summary_df, factors_df = query_engine.with_archive(summary_df, factors_df, archive_summary_df, archive_factors_df)
             if summary_df.empty:
                 return await self.message.edit(content="あらあら、データベースにまだ因子が登録されていないようですわ。", view=None, embed=None)
-            summary_df['個体ID'] = summary_df['個体ID'].astype(str)
-            factors_df['個体ID'] = factors_df['個体ID'].astype(str)
-            if self.search_only_mine:
-                summary_df = summary_df[summary_df['所有者ID'] == str(self.author.id)]
-                if summary_df.empty:
-                    return await self.message.edit(content="あらあら、あなたの所有する因子が見つかりませんでしたわ。", view=None, embed=None)
-            
-            non_red_conditions = {k: v for k, v in self.conditions.items() if not k.startswith('red_factor')}
-            valid_ids = set(summary_df['個体ID'])
+            index = query_engine.index_for(summary_df, factors_df)
+            owner_id = str(self.author.id) if self.search_only_mine else None
+            if owner_id is not None and not len(index.value_positions('所有者ID', [owner_id])):
+                return await self.message.edit(content="あらあら、あなたの所有する因子が見つかりませんでしたわ。", view=None, embed=None)
 
-            for cond_type, conditions in non_red_conditions.items():
-                if not conditions or not valid_ids: continue
-                if cond_type == 'characters':
-                    char_names = [item['name'] for item in conditions[0]['items']]
-                    char_ids = set(summary_df[summary_df['キャラ名'].isin(char_names)]['個体ID'])
-                    valid_ids.intersection_update(char_ids)
-                elif cond_type == 'score':
-                    temp_summary = summary_df[summary_df['個体ID'].isin(valid_ids)].copy()
-                    for cond in conditions:
-                        score_col = f"合計({cond['sheet']})"
-                        if score_col in temp_summary.columns:
-                            temp_summary[score_col] = pd.to_numeric(temp_summary[score_col], errors='coerce').fillna(0)
-                            temp_summary = temp_summary[temp_summary[score_col] >= cond['score']]
-                    valid_ids.intersection_update(set(temp_summary['個体ID']))
-                elif cond_type in ['blue_factors', 'green_factors']:
-                    matched_ids_for_or_group = set()
-                    for cond in conditions:
-                        item = cond['items'][0]
-                        factor_id = item['id']
-                        min_stars = item['stars']
-                        factor_match_df = factors_df[(factors_df['因子ID'] == factor_id) & (pd.to_numeric(factors_df['星の数'], errors='coerce').fillna(0) >= min_stars)]
-                        matched_ids_for_or_group.update(set(factor_match_df['個体ID']))
-                    valid_ids.intersection_update(matched_ids_for_or_group)
-                elif cond_type in ['required_skills', 'required_genes']:
-                    for cond in conditions:
-                        item = cond['items'][0]
-                        factor_id = item['id']
-                        min_stars = item['stars']
-                        factor_match_df = factors_df[(factors_df['因子ID'] == factor_id) & (pd.to_numeric(factors_df['星の数'], errors='coerce').fillna(0) >= min_stars)]
-                        valid_ids.intersection_update(set(factor_match_df['個体ID']))
-                elif cond_type in ['optional_skills', 'optional_genes']:
-                    cond_group = conditions[0]
-                    items = cond_group['items']
-                    required_count = cond_group.get('count', 1)
-                    skill_conditions = {item['id']: item['stars'] for item in items}
-                    candidate_factors = factors_df[factors_df['因子ID'].isin(skill_conditions.keys())].copy()
-                    def check_stars(row):
-                        return pd.to_numeric(row['星の数'], errors='coerce').fillna(0) >= skill_conditions.get(row['因子ID'], 99)
-                    candidate_factors = candidate_factors[candidate_factors.apply(check_stars, axis=1)]
-                    if not candidate_factors.empty:
-                        match_counts = candidate_factors.groupby('個体ID').size()
-                        or_valid_ids = set(match_counts[match_counts >= required_count].index)
-                        valid_ids.intersection_update(or_valid_ids)
-                    else:
-                        valid_ids = set()
-
-            body_conds = self.conditions.get('red_factor_body', [])
-            parent_conds = self.conditions.get('red_factor_parent', [])
-            overall_conds = self.conditions.get('red_factor_overall', [])
-            
-            if body_conds:
-                matched_ids_for_or_group = set()
-                for cond in body_conds:
-                    factor_match_df = factors_df[(factors_df['因子ID'] == cond['id']) & (pd.to_numeric(factors_df['星の数'], errors='coerce').fillna(0) >= cond['stars'])]
-                    matched_ids_for_or_group.update(set(factor_match_df['個体ID']))
-                valid_ids.intersection_update(matched_ids_for_or_group)
-
-            if parent_conds:
-                target_summary_df = summary_df[summary_df['個体ID'].isin(valid_ids)].copy()
-                for i in [1, 2]:
-                    if f'親赤因子{i}_星数' in target_summary_df.columns:
-                        target_summary_df[f'親赤因子{i}_星数'] = pd.to_numeric(target_summary_df[f'親赤因子{i}_星数'], errors='coerce').fillna(0)
-                    else:
-                        target_summary_df[f'親赤因子{i}_星数'] = 0
-                temp_ids = valid_ids.copy()
-                for cond in parent_conds:
-                    is_p1_match = (target_summary_df['親赤因子1_ID'] == cond['id'])
-                    is_p2_match = (target_summary_df['親赤因子2_ID'] == cond['id'])
-                    p1_stars = target_summary_df['親赤因子1_星数'].where(is_p1_match, 0)
-                    p2_stars = target_summary_df['親赤因子2_星数'].where(is_p2_match, 0)
-                    matched_df = target_summary_df[(p1_stars + p2_stars) >= cond['stars']]
-                    temp_ids.intersection_update(set(matched_df['個体ID']))
-                valid_ids.intersection_update(temp_ids)
-
-            if overall_conds:
-                target_summary_df = summary_df[summary_df['個体ID'].isin(valid_ids)].copy()
-                target_factors_df = factors_df[factors_df['個体ID'].isin(valid_ids)].copy()
-                for i in [1, 2]:
-                    if f'親赤因子{i}_星数' in target_summary_df.columns:
-                        target_summary_df[f'親赤因子{i}_星数'] = pd.to_numeric(target_summary_df[f'親赤因子{i}_星数'], errors='coerce').fillna(0)
-                    else:
-                        target_summary_df[f'親赤因子{i}_星数'] = 0
-                target_factors_df['星の数'] = pd.to_numeric(target_factors_df['星の数'], errors='coerce').fillna(0)
-                temp_ids = valid_ids.copy() 
-                for cond in overall_conds:
-                    factor_id = cond['id']
-                    min_total_stars = cond['stars']
-                    is_p1_match = (target_summary_df['親赤因子1_ID'] == factor_id)
-                    is_p2_match = (target_summary_df['親赤因子2_ID'] == factor_id)
-                    p1_stars = target_summary_df['親赤因子1_星数'].where(is_p1_match, 0)
-                    p2_stars = target_summary_df['親赤因子2_星数'].where(is_p2_match, 0)
-                    parent_stars_series = (p1_stars + p2_stars)
-                    parent_stars_series.index = target_summary_df['個体ID']
-                    body_factors = target_factors_df[target_factors_df['因子ID'] == factor_id]
-                    body_stars_series = body_factors.set_index('個体ID')['星の数']
-                    overall_total_stars = parent_stars_series.add(body_stars_series, fill_value=0)
-                    overall_valid_ids = set(overall_total_stars[overall_total_stars >= min_total_stars].index)
-                    temp_ids.intersection_update(overall_valid_ids)
-                valid_ids.intersection_update(temp_ids)
-            
-            final_df = summary_df[summary_df['個体ID'].isin(valid_ids)].reset_index(drop=True)
+            positions = index.search(self.conditions, owner_id=owner_id, cache=query_engine.result_cache)
+            rows = index.select_rows(positions, owner_id=owner_id)
             
-            if final_df.empty:
+            if not len(rows):
                 back_to_builder_view = ui.View(timeout=600)
                 back_button = ui.Button(label="🔄 条件を編集する", style=ButtonStyle.secondary)
                 async def back_callback(interaction: discord.Interaction):
                     await interaction.response.defer()
                     builder = SearchView(self.gspread_client, self.author, self.message, self.factor_dictionary, self.character_data, self.score_sheets, self.character_list_sorted, self.conditions)
+                    builder.start_prefetch()
                     await self.message.edit(content=None, embed=builder.create_embed(), view=builder)
                 back_button.callback = back_callback
                 back_to_builder_view.add_item(back_button)
                 await self.message.edit(content="残念ですが、お探しの因子は見つかりませんでしたの。", embed=None, view=back_to_builder_view)
             else:
-                result_view = SearchResultView(self.gspread_client, self.author, self.message, final_df, self.conditions, self.factor_dictionary, self.character_data, self.score_sheets, self.character_list_sorted)
-                await self.message.edit(content=f"ふふっ、**{len(final_df)}件**の因子が見つかりました♪", embed=result_view.create_embed(), view=result_view)
+                # 結果はDataFrameを切り出さず、共有の評価サマリーの行位置として持つ
+                session = result_sessions.manager.open(index.summary_df, rows, red_stars=index.total_red_stars()[index.row_positions[rows]])
+                result_view = SearchResultView(self.gspread_client, self.author, self.message, session, self.conditions, self.factor_dictionary, self.character_data, self.score_sheets, self.character_list_sorted)
+                await self.message.edit(content=f"ふふっ、**{len(session)}件**の因子が見つかりました♪", embed=result_view.create_embed(), view=result_view)
         except Exception as e:
             await self.message.edit(content=f"検索中にエラーが発生しました…\n`{e}`", view=None, embed=None)
             traceback.print_exc()
@@ -315,6 +287,8 @@ class SearchView(ui.View):
         self.conditions.clear(); self.skill_cart.clear(); self.character_cart.clear()
         self.search_only_mine = False 
         new_view = SearchView(self.gspread_client, self.author, self.message, self.factor_dictionary, self.character_data, self.score_sheets, self.character_list_sorted)
+        new_view.prefetch = self.prefetch
+        new_view.prefetch_started_at = self.prefetch_started_at
         await interaction.response.edit_message(embed=new_view.create_embed(), view=new_view)
 
 class DeleteConditionView(ui.View):
@@ -6,6 +6,7 @@ if TYPE_CHECKING:
     from .main_view import SearchView
     from .browser_view import ItemBrowserView
     from ..register_view import SetOwnerView
+    from .results_view import SearchResultView
 
 class ExternalOwnerModal(ui.Modal, title="サーバー外の所有者情報"):
     def __init__(self, owner_view: 'SetOwnerView'):
@@ -14,7 +15,7 @@ class ExternalOwnerModal(ui.Modal, title="サーバー外の所有者情報"):
     owner_memo = ui.TextInput(label="所有者の名前やトレーナーID", placeholder="例: フレンドの〇〇 (トレID: ...)", required=True, style=TextStyle.paragraph)
     async def on_submit(self, interaction: Interaction):
         await interaction.response.defer(ephemeral=True)
-        success = await self.owner_view.update_db_owner("EXTERNAL", self.owner_memo.value)
+        success = await self.owner_view.update_db_owner(interaction, "EXTERNAL", self.owner_memo.value)
         if success:
             await interaction.client.check_rank_in(interaction, self.owner_view.gspread_client, self.owner_view.individual_id, self.owner_view.author)
             await self.owner_view.show_details_editor(interaction, "ふふっ、新しい出会いですわね♪")
@@ -77,4 +78,20 @@ class ScoreInputModal(ui.Modal, title="最低スコアを入力"):
             self.parent_view.conditions['score'] = [{'type': 'score', 'sheet': self.sheet_name, 'score': score_value}]
             await interaction.response.edit_message(embed=self.parent_view.create_embed(), view=self.parent_view)
         except ValueError:
-             await interaction.response.send_message("スコアは半角数字で入力してください。", ephemeral=True)
\ No newline at end of file
+             await interaction.response.send_message("スコアは半角数字で入力してください。", ephemeral=True)
+
+class JumpToRankModal(ui.Modal, title="順位を指定して移動"):
+    def __init__(self, result_view: "SearchResultView"):
+        super().__init__()
+        self.result_view = result_view
+        total = len(result_view.session)
+        self.rank = ui.TextInput(label=f"何番目の結果を表示しますか？ (1〜{total})", placeholder="例: 10", required=True)
+        self.add_item(self.rank)
+
+    async def on_submit(self, interaction: Interaction):
+        try:
+            rank = int(self.rank.value)
+            assert 1 <= rank <= len(self.result_view.session)
+            await self.result_view.jump_to(interaction, rank)
+        except (ValueError, AssertionError):
+            await interaction.response.send_message("入力値が正しくありません。", ephemeral=True)
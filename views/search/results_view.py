@@ -1,9 +1,13 @@
 import discord
 from discord import ui, Interaction, Embed, Color, ButtonStyle
+import numpy as np
 import pandas as pd
 
 import config
+import query_engine
+import result_sessions
 from ..ui_helpers import create_themed_embed
+from .modals import JumpToRankModal
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -25,12 +29,12 @@ class DeleteConfirmView(ui.View):
         try:
             success, message = await interaction.client.delete_factor_by_id(self.gspread_client, self.individual_id, interaction.user.id, is_admin)
             if success:
-                self.original_view.summary_df = self.original_view.summary_df[self.original_view.summary_df['個体ID'] != self.individual_id].reset_index(drop=True)
-                if self.original_view.summary_df.empty:
+                self.original_view.remove_individual(self.individual_id)
+                if self.original_view.session.empty:
                      await interaction.edit_original_response(content="因子を削除しました。検索結果は0件になりました。", embed=None, view=None)
                      return
 
-                self.original_view.current_index = min(self.original_view.current_index, len(self.original_view.summary_df) - 1)
+                self.original_view.current_index = min(self.original_view.current_index, len(self.original_view.session) - 1)
                 self.original_view.update_components()
                 await interaction.edit_original_response(content=f"個体ID `{self.individual_id}` の因子を削除しました。", embed=self.original_view.create_embed(), view=self.original_view)
             else:
@@ -44,7 +48,7 @@ class DeleteConfirmView(ui.View):
     @ui.button(label="いいえ、やめておきます", style=ButtonStyle.secondary)
     async def cancel_delete(self, interaction: Interaction, button: ui.Button):
         await interaction.response.edit_message(
-            content=f"**{len(self.original_view.summary_df)}件**の因子が見つかりました。", 
+            content=f"**{len(self.original_view.session)}件**の因子が見つかりました。", 
             embed=self.original_view.create_embed(), 
             view=self.original_view
         )
@@ -58,32 +62,85 @@ class BackToResultsView(ui.View):
     async def go_back(self, interaction: Interaction, button: ui.Button):
         # 元の検索結果画面を再表示する
         await interaction.response.edit_message(
-            content=f"**{len(self.original_view.summary_df)}件**の因子が見つかりました。", 
+            content=f"**{len(self.original_view.session)}件**の因子が見つかりました。", 
             embed=self.original_view.create_embed(), 
             view=self.original_view
         )        
 
+# 並び順の選択肢のうち、スコア以外のもの
+SORT_BY_SHEET = '__sheet'
+SORT_BY_DATE = '__date'
+SORT_BY_RED_STARS = '__red'
+
+
 class SearchResultView(ui.View):
-    def __init__(self, gspread_client, author, message: discord.WebhookMessage, summary_df: pd.DataFrame, conditions: dict, factor_dictionary: dict, character_data: dict, score_sheets: dict, character_list_sorted: list):
+    def __init__(self, gspread_client, author, message: discord.WebhookMessage, session: result_sessions.ResultSession, conditions: dict, factor_dictionary: dict, character_data: dict, score_sheets: dict, character_list_sorted: list):
         super().__init__(timeout=600)
         self.gspread_client = gspread_client
         self.author = author
         self.message = message
-        self.summary_df = summary_df.reset_index(drop=True)
+        # 表示する個体の行位置と、共有の評価サマリーへの参照。赤因子の星数の合計は 'red_stars' 列として持つ
+        self.session = session
         self.conditions = conditions
         self.factor_dictionary = factor_dictionary
         self.character_data = character_data
         self.score_sheets = score_sheets
         self.character_list_sorted = character_list_sorted
+        self.sort_key = SORT_BY_SHEET
+        # 並べ替えたときの順位 → 結果の中の位置。シートの順のときはNone
+        self.ranking = None
         self.current_index = 0
         self.update_components()
 
+    def sort_options(self) -> dict:
+        options = {SORT_BY_SHEET: "登録順 (シートの順)"}
+        if self.session.has_column('投稿日時'):
+            options[SORT_BY_DATE] = "新しい順"
+        for sheet_name in self.score_sheets.keys():
+            if self.session.has_column(f"合計({sheet_name})"):
+                options[f"合計({sheet_name})"] = f"{sheet_name} のスコアが高い順"
+        if self.session.has_column('red_stars'):
+            options[SORT_BY_RED_STARS] = "赤因子の星が多い順"
+        return dict(list(options.items())[:25])
+
+    def _sort_values(self, sort_key: str) -> np.ndarray:
+        if sort_key == SORT_BY_RED_STARS:
+            return self.session.values('red_stars')
+        if sort_key == SORT_BY_DATE:
+            posted_at = pd.to_datetime(pd.Series(self.session.values('投稿日時')), errors='coerce')
+            return np.where(posted_at.isna(), -np.inf, posted_at.to_numpy(dtype='datetime64[s]').astype(np.int64))
+        return self.session.values(sort_key)
+
+    def set_sort(self, sort_key: str):
+        """並び順を変える。上位から必要な分だけ並べるので、全件の並べ替えやDataFrameのコピーは作らない"""
+        self.sort_key = sort_key
+        self.ranking = None if sort_key == SORT_BY_SHEET else query_engine.TopK(self._sort_values(sort_key))
+        self.session.ranking = self.ranking
+
+    def current_row(self) -> pd.Series:
+        row = self.current_index if self.ranking is None else self.ranking.at(self.current_index)
+        return self.session.row(row)
+
+    def remove_individual(self, individual_id: str):
+        """削除した個体を結果から取り除き、並び順を作り直す"""
+        self.session.remove('個体ID', individual_id)
+        self.set_sort(self.sort_key if self.sort_key in self.sort_options() else SORT_BY_SHEET)
+
+    async def on_timeout(self):
+        result_sessions.manager.close(self.session)
+
     def update_components(self):
         self.clear_items()
-        if self.summary_df.empty:
+        if self.session.expired:
+            # メモリの上限で結果を手放したときは、条件の編集だけできるようにする
+            back_to_builder_btn = ui.Button(label="🔄 条件を編集する", style=ButtonStyle.secondary, row=0)
+            back_to_builder_btn.callback = self.back_to_builder
+            self.add_item(back_to_builder_btn)
+            return
+        if self.session.empty:
             return
 
-        total = len(self.summary_df)
+        total = len(self.session)
         self.current_index = min(self.current_index, total - 1)
         is_first_page = self.current_index == 0
         is_last_page = self.current_index >= total - 1
@@ -100,16 +157,36 @@ class SearchResultView(ui.View):
         delete_btn = ui.Button(label="🗑️ この因子を削除", style=ButtonStyle.danger, row=1)
         delete_btn.callback = self.delete_callback
         self.add_item(delete_btn)
+        jump_btn = ui.Button(label="🔢 順位を指定して移動", style=ButtonStyle.secondary, row=1)
+        jump_btn.callback = self.jump_callback
+        self.add_item(jump_btn)
+
+        sort_options = self.sort_options()
+        if len(sort_options) > 1:
+            sort_select = ui.Select(
+                placeholder="並び順を選んでくださいまし♪",
+                options=[discord.SelectOption(label=label, value=key, default=key == self.sort_key) for key, label in sort_options.items()],
+                row=2
+            )
+            sort_select.callback = self.sort_callback
+            self.add_item(sort_select)
 
     def create_embed(self):
-        if self.summary_df.empty:
+        result_sessions.manager.touch(self.session)
+        if self.session.expired:
+            return create_themed_embed(
+                title="検索結果の期限切れ",
+                description="しばらく操作がなかったので、この検索結果は片付けてしまいましたわ。\nお手数ですが、もう一度検索してくださいまし。",
+                footer_text=f"Request by {self.author.display_name}"
+            )
+        if self.session.empty:
             return create_themed_embed(
                 title="検索結果なし",
                 description="条件に一致する因子は見つかりませんでした。",
                 footer_text=f"Request by {self.author.display_name}"
             )
 
-        current_row = self.summary_df.iloc[self.current_index]
+        current_row = self.current_row()
         char_name = current_row.get("キャラ名", "不明")
         owner_name = current_row.get('所有者メモ', current_row.get('投稿者名', '不明'))
         image_url = current_row.get("画像URL")
@@ -120,10 +197,13 @@ class SearchResultView(ui.View):
         
         description = f"**{display_owner}** の **{char_name}**"
 
+        footer_text = f"個体ID: {individual_id}"
+        if self.sort_key != SORT_BY_SHEET:
+            footer_text += f" ・ 並び順: {self.sort_options().get(self.sort_key, '')}"
         embed = create_themed_embed(
-            title=f"🍀 検索結果 ({self.current_index + 1}/{len(self.summary_df)})",
+            title=f"🍀 検索結果 ({self.current_index + 1}/{len(self.session)})",
             description=description,
-            footer_text=f"個体ID: {individual_id}"
+            footer_text=footer_text
         )
 
         if pd.notna(image_url) and image_url:
@@ -135,9 +215,9 @@ class SearchResultView(ui.View):
         score_info = []
         for sheet_name in self.score_sheets.keys():
             score_col = f"合計({sheet_name})"
-            if score_col in current_row and pd.notna(current_row[score_col]):
-                score = pd.to_numeric(current_row[score_col], errors='coerce')
-                if pd.notna(score) and score > 0:
+            if score_col in current_row:
+                score = current_row[score_col]
+                if score > 0:
                     score_info.append(f"**{sheet_name}**: `{int(score)}`点")
         
         if score_info:
@@ -184,14 +264,41 @@ class SearchResultView(ui.View):
         btn_id = interaction.data['custom_id']
         if btn_id == "go_first": self.current_index = 0
         elif btn_id == "go_prev": self.current_index = max(0, self.current_index - 1)
-        elif btn_id == "go_next": self.current_index = min(len(self.summary_df) - 1, self.current_index + 1)
-        elif btn_id == "go_last": self.current_index = len(self.summary_df) - 1
+        elif btn_id == "go_next": self.current_index = min(len(self.session) - 1, self.current_index + 1)
+        elif btn_id == "go_last": self.current_index = len(self.session) - 1
         
         self.update_components()
         await interaction.edit_original_response(embed=self.create_embed(), view=self)
 
+    async def sort_callback(self, interaction: Interaction):
+        if self.session.expired:
+            return await self.show_expired(interaction)
+        self.set_sort(interaction.data['values'][0])
+        self.current_index = 0
+        self.update_components()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
+    async def jump_callback(self, interaction: Interaction):
+        if self.session.expired:
+            return await self.show_expired(interaction)
+        await interaction.response.send_modal(JumpToRankModal(self))
+
+    async def jump_to(self, interaction: Interaction, rank: int):
+        """rank位 (1始まり) の結果を表示する"""
+        if self.session.expired:
+            return await self.show_expired(interaction)
+        self.current_index = rank - 1
+        self.update_components()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
+    async def show_expired(self, interaction: Interaction):
+        self.update_components()
+        await interaction.response.edit_message(content=None, embed=self.create_embed(), view=self)
+
     async def delete_callback(self, interaction: Interaction):
-        current_row = self.summary_df.iloc[self.current_index]
+        if self.session.expired:
+            return await self.show_expired(interaction)
+        current_row = self.current_row()
         individual_id = current_row['個体ID']
         image_url = current_row.get('画像URL')
         embed = Embed(title="削除の最終確認", description="本当にお別れしますの…？ この出会いも、きっと何かの縁ですのに…\nこの操作は元に戻せませんのよ…？", color=Color.red())
@@ -204,5 +311,7 @@ class SearchResultView(ui.View):
     async def back_to_builder(self, interaction: discord.Interaction):
         from .main_view import SearchView
         await interaction.response.defer()
+        result_sessions.manager.close(self.session)
         builder_view = SearchView(self.gspread_client, self.author, self.message, self.factor_dictionary, self.character_data, self.score_sheets, self.character_list_sorted, self.conditions)
+        builder_view.start_prefetch()
         await interaction.edit_original_response(content=None, embed=builder_view.create_embed(), view=builder_view)        
\ No newline at end of file
@@ -0,0 +1,208 @@
+import asyncio
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+import gspread
+from gspread.utils import rowcol_to_a1
+
+import async_database
+import config
+
+# リトライしてよいHTTPステータス (クォータ超過とサーバー側の一時的なエラー)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """1分あたりのリクエスト数を制限するトークンバケット"""
+    def __init__(self, requests_per_minute: int, burst: int):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SheetWriteQueue:
+    """
+    ワークシートへのセル書き込みをまとめて、values_batch_updateで一括送信するキュー。
+    同じセルへの書き込みは後勝ちで1つにまとめ、同じ行の隣り合うセルは1つの範囲にまとめる。
+    enqueueはどのスレッドからでも呼べて、書き込みが確定したときに完了するFutureを返す。
+    """
+    def __init__(self, gspread_client, spreadsheet_name: str = "因子評価データベース"):
+        self.gspread_client = gspread_client
+        self.spreadsheet_name = spreadsheet_name
+        self.bucket = TokenBucket(config.SHEETS_WRITE_REQUESTS_PER_MINUTE, config.SHEETS_WRITE_BURST)
+        self._lock = threading.Lock()
+        # {シート名: {(行, 列): 値}}
+        self._pending: dict[str, dict[tuple[int, int], object]] = {}
+        self._waiters: list[Future] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self._spreadsheet = None
+        # 外部に公開する統計情報
+        self.flush_count = 0
+        self.retry_count = 0
+        self.last_flush_latency = 0.0
+        self.last_flush_cells = 0
+
+    @property
+    def depth(self) -> int:
+        """まだ送信されていないセルの数"""
+        with self._lock:
+            return sum(len(cells) for cells in self._pending.values())
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.depth,
+            'flush_count': self.flush_count,
+            'retry_count': self.retry_count,
+            'last_flush_latency': round(self.last_flush_latency, 3),
+            'last_flush_cells': self.last_flush_cells,
+        }
+
+    def start(self):
+        """イベントループ上で呼び出して、書き込み担当のタスクを起動する"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    def enqueue(self, sheet_title: str, cells: list[gspread.Cell]) -> Future:
+        future = Future()
+        if self._closing or self._loop is None:
+            future.set_exception(RuntimeError("書き込みキューが起動していません。"))
+            return future
+        with self._lock:
+            if cells:
+                sheet_cells = self._pending.setdefault(sheet_title, {})
+                for cell in cells:
+                    sheet_cells[(cell.row, cell.col)] = cell.value
+            self._waiters.append(future)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return future
+
+    async def update_cells(self, sheet_title: str, cells: list[gspread.Cell]):
+        """セルを書き込みキューに積み、書き込みが確定するまで待つ"""
+        await asyncio.wrap_future(self.enqueue(sheet_title, cells))
+
+    async def drain(self):
+        """今キューに積まれている書き込みが、すべて送信されるまで待つ"""
+        if self._task is None:
+            return
+        # セルの無い書き込みを積むと、それより前の書き込みと一緒に送信されたときに完了する
+        await asyncio.wrap_future(self.enqueue("", []))
+
+    async def close(self):
+        """残っている書き込みをすべて送信してから停止する"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._closing:
+                # 少し待って、後続の書き込みもまとめて送る
+                await asyncio.sleep(config.SHEETS_WRITE_FLUSH_DELAY)
+            self._wakeup.clear()
+            await self._flush()
+            if self._closing and not self.depth:
+                return
+
+    def _take_pending(self):
+        with self._lock:
+            pending, waiters = self._pending, self._waiters
+            self._pending, self._waiters = {}, []
+        return pending, waiters
+
+    @staticmethod
+    def _build_ranges(sheet_title: str, cells: dict[tuple[int, int], object]) -> list[dict]:
+        """同じ行の隣り合うセルを、1つの範囲にまとめる"""
+        data = []
+        run_row, run_start, run_values = None, None, []
+        for (row, col) in sorted(cells):
+            if row == run_row and col == run_start + len(run_values):
+                run_values.append(cells[(row, col)])
+                continue
+            if run_values:
+                data.append(SheetWriteQueue._range_entry(sheet_title, run_row, run_start, run_values))
+            run_row, run_start, run_values = row, col, [cells[(row, col)]]
+        if run_values:
+            data.append(SheetWriteQueue._range_entry(sheet_title, run_row, run_start, run_values))
+        return data
+
+    @staticmethod
+    def _range_entry(sheet_title: str, row: int, start_col: int, values: list) -> dict:
+        start = rowcol_to_a1(row, start_col)
+        end = rowcol_to_a1(row, start_col + len(values) - 1)
+        return {'range': f"'{sheet_title}'!{start}:{end}", 'values': [values]}
+
+    async def _flush(self):
+        pending, waiters = self._take_pending()
+        if not pending:
+            for future in waiters:
+                future.set_result(True)
+            return
+        data = []
+        for sheet_title, cells in pending.items():
+            data.extend(self._build_ranges(sheet_title, cells))
+        # 所有者IDのような長い数字やユーザーの書いた文字列が変換されないよう、そのまま書き込む
+        body = {'valueInputOption': 'RAW', 'data': data}
+
+        started_at = time.monotonic()
+        try:
+            await self._send_with_retry(body)
+        except Exception as e:
+            print(f"書き込みキューの送信に失敗しました: {e}")
+            traceback.print_exc()
+            for future in waiters:
+                future.set_exception(e)
+            return
+        self.flush_count += 1
+        self.last_flush_latency = time.monotonic() - started_at
+        self.last_flush_cells = sum(len(cells) for cells in pending.values())
+        for future in waiters:
+            future.set_result(True)
+
+    async def _send_with_retry(self, body: dict):
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                return await async_database.run_blocking(self._send, body)
+            except gspread.exceptions.APIError as e:
+                status = getattr(e.response, 'status_code', None)
+                if status not in RETRYABLE_STATUS_CODES or attempt >= config.SHEETS_WRITE_MAX_RETRIES:
+                    raise
+                # フルジッター付きの指数バックオフ
+                delay = random.uniform(0, min(config.SHEETS_WRITE_BACKOFF_MAX, config.SHEETS_WRITE_BACKOFF_BASE ** attempt))
+                attempt += 1
+                self.retry_count += 1
+                print(f"書き込みがAPIに拒否されました(HTTP {status})。{delay:.1f}秒後に再試行します ({attempt}/{config.SHEETS_WRITE_MAX_RETRIES})")
+                await asyncio.sleep(delay)
+
+    def _send(self, body: dict):
+        if self._spreadsheet is None:
+            self._spreadsheet = self.gspread_client.open(self.spreadsheet_name)
+        return self._spreadsheet.values_batch_update(body)